@@ -0,0 +1,50 @@
+"""Measures automod matching cost per message.
+
+Usage: python benchmarks/bench_automod.py [keyword_rules] [regex_rules]
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import CompiledRuleSet
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+def main():
+    keyword_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    regex_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(42)
+
+    rules = [{"id": i + 1, "kind": "keyword", "pattern": random_word(rng), "action": "delete", "delta": -5} for i in range(keyword_count)]
+    rules += [
+        {"id": keyword_count + i + 1, "kind": "regex", "pattern": rf"{random_word(rng, 3, 5)}\d{{2,}}", "action": "flag", "delta": -5}
+        for i in range(regex_count)
+    ]
+
+    started = time.perf_counter()
+    rule_set = CompiledRuleSet(rules)
+    print(f"compiled {keyword_count:,} keyword + {regex_count} regex rules in {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"({len(rule_set.keywords.goto):,} automaton states)")
+
+    vocabulary = [random_word(rng, 2, 8) for _ in range(5000)]
+    messages = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 30))) for _ in range(10_000)]
+    # Roughly 5% of messages contain a rule keyword
+    for i in range(0, len(messages), 20):
+        messages[i] += " " + rng.choice(rules[:keyword_count])["pattern"]
+
+    hits = 0
+    started = time.perf_counter()
+    for content in messages:
+        if rule_set.match(content):
+            hits += 1
+    elapsed = time.perf_counter() - started
+    avg_len = sum(map(len, messages)) / len(messages)
+    print(f"{len(messages):,} messages (avg {avg_len:.0f} chars): {elapsed / len(messages) * 1e6:.1f} us/message, {hits:,} matched")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Runs MyBot's bulk commands and event handlers against a local fake Discord.
+
+Nothing talks to discord.com: REST goes to benchmarks/fakediscord.py and gateway
+events are fed straight into the client's connection state. Each scenario reports
+throughput and latency; results are compared with benchmarks/baselines.json so
+regressions show up as numbers.
+
+Usage:
+  python benchmarks/bench_commands.py                    # run and compare with the baseline
+  python benchmarks/bench_commands.py --save-baseline    # run and record a new baseline
+  python benchmarks/bench_commands.py --latency 0.05 --bucket-limit 50 --only massban lockdown
+
+Numbers depend on --latency and the rate-limit options, so a baseline is only
+compared when it was recorded with the same settings.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The bot reads its data paths at import time, so keep its files out of the repo
+DATA_DIR = tempfile.mkdtemp(prefix="modbot-bench-")
+os.environ["MODBOT_DATA_DIR"] = DATA_DIR
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot as modbot
+from fakediscord import FakeDiscord, FakeGateway, LatencyRecorder, snowflake
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+GUILD_ID = 500000000000000000
+
+class Harness:
+    def __init__(self, server: FakeDiscord, scale: float):
+        self.server = server
+        self.scale = scale
+        self.bot = modbot.bot
+        self.gateway = None
+        self._guilds = 0
+
+    def n(self, count):
+        return max(1, int(count * self.scale))
+
+    async def start(self):
+        await self.server.start()
+        self.server.patch_routes()
+        await self.bot.login("fake-token")
+        self.gateway = FakeGateway(self.bot, self.server)
+        # Progress edits are throttled to one per PROGRESS_EDIT_INTERVAL anyway
+        modbot.PROGRESS_EDIT_INTERVAL = 0.5
+
+    async def stop(self):
+        await self.bot.close()
+        await self.server.stop()
+
+    def next_guild_id(self):
+        return GUILD_ID + (self._guilds + 1) * 1000
+
+    def guild(self, members=(), channels=5, extra_roles=()):
+        guild_id = self.next_guild_id()
+        self._guilds += 1
+        return self.gateway.create_guild(guild_id, members, channels=channels, extra_roles=extra_roles)
+
+    async def command(self, guild, name, **kwargs):
+        interaction = self.gateway.interaction(guild.id, guild.text_channels[0].id, name)
+        callback = self.bot.tree.get_command(name).callback
+        started = time.perf_counter()
+        await callback(interaction, **kwargs)
+        return time.perf_counter() - started
+
+# --- Scenarios ---
+# Each returns (operations, elapsed seconds, LatencyRecorder).
+
+async def bench_massban(h: Harness):
+    count = h.n(2000)
+    guild = h.guild()
+    ids = " ".join(str(snowflake()) for _ in range(count))
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "massban", user_ids=ids, reason="bench"))
+    return count, recorder.samples[0], recorder
+
+async def bench_massban_file(h: Harness):
+    count = h.n(20000)
+    guild = h.guild()
+    ids = [snowflake() for _ in range(count)]
+    # A CSV export with a header, a second column and some repeated rows
+    rows = ["user_id,joined"] + [f"{uid},2024-01-01" for uid in ids] + [f"{uid},2024-01-02" for uid in ids[:count // 10]]
+    attachment = h.server.attachment(h.bot, "raiders.csv", "\n".join(rows).encode())
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "massban", reason="bench", user_file=attachment))
+    return count, recorder.samples[0], recorder
+
+async def bench_massinvite(h: Harness):
+    count = h.n(300)
+    guild = h.guild()
+    # Real runs are paced by DM_RATE_PER_SECOND; lift it to measure the pipeline itself
+    h.bot.dm_dispatcher.bucket = modbot.TokenBucket(rate=1_000_000, capacity=1_000_000)
+    targets = [snowflake() for _ in range(count)]
+    h.server.forbidden_dms.update(targets[::10])
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "massinvite", user_ids=" ".join(map(str, targets))))
+    return count, recorder.samples[0], recorder
+
+async def bench_cleanuser(h: Harness):
+    per_channel = h.n(400)
+    channels = 10
+    target = snowflake()
+    # Moderators are exempt from the spam filter, which would otherwise act on this flood
+    moderators = [h.gateway.moderator_role(h.next_guild_id())]
+    guild = h.guild(members=[(target, moderators)], channels=channels)
+    for channel in guild.text_channels:
+        for i in range(per_channel):
+            author = target if i % 2 == 0 else int(h.server.owner_user["id"])
+            h.gateway.message_create(guild.id, channel.id, author, f"message {i}", roles=moderators)
+    member = guild.get_member(target)
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "cleanuser", member=member, limit=per_channel, scan=False))
+    return channels * per_channel // 2, recorder.samples[0], recorder
+
+async def bench_softban_sweep(h: Harness):
+    count = h.n(200)
+    members = [snowflake() for _ in range(count)]
+    guild = h.guild(members=[(uid, []) for uid in members])
+    recorder = LatencyRecorder()
+
+    async def one(uid):
+        recorder.add(await h.command(guild, "softban", member=guild.get_member(uid), reason="bench"))
+
+    started = time.perf_counter()
+    await modbot.run_bounded(members, one, 10)
+    return count, time.perf_counter() - started, recorder
+
+async def bench_lockdown(h: Harness):
+    channels = h.n(150)
+    guild = h.guild(channels=channels)
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "lockdown"))
+    recorder.add(await h.command(guild, "unlockdown"))
+    return channels * 2, sum(recorder.samples), recorder
+
+async def bench_banrole(h: Harness):
+    count = h.n(2000)
+    role_id = snowflake()
+    guild = h.guild(members=[(snowflake(), [role_id]) for _ in range(count)], extra_roles=[(role_id, "raiders")])
+    recorder = LatencyRecorder()
+    recorder.add(await h.command(guild, "banrole", role=guild.get_role(role_id), reason="bench"))
+    return count, recorder.samples[0], recorder
+
+async def bench_trust_updates(h: Harness):
+    count = h.n(5000)
+    members = [snowflake() for _ in range(h.n(1000))]
+    guild = h.guild(members=[(uid, []) for uid in members])
+    resolved = [guild.get_member(uid) for uid in members]
+    recorder = LatencyRecorder()
+
+    async def one(i):
+        started = time.perf_counter()
+        # Small steps so nobody reaches 0 and gets auto-banned mid-run
+        await h.bot.update_trust(resolved[i % len(resolved)], -1 if i % 2 else 1, "bench")
+        recorder.add(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await modbot.run_bounded(range(count), one, 50)
+    await h.bot.trust.flush()
+    return count, time.perf_counter() - started, recorder
+
+async def bench_trust_cap(h: Harness):
+    """Trust updates across many guilds with the cache cap far below what is dirty.
+
+    Every partition stays dirty until the next flush, so each new guild has to be
+    loaded and used while the store is over its cap.
+    """
+    store = h.bot.trust
+    guilds = [h.guild(members=[(snowflake(), []) for _ in range(20)]) for _ in range(h.n(1000))]
+    recorder = LatencyRecorder()
+    saved_cap, store.max_entries = store.max_entries, 15
+    started = time.perf_counter()
+    try:
+        for guild in guilds:
+            begun = time.perf_counter()
+            for member in [member for member in guild.members if not member.bot][:5]:
+                await h.bot.update_trust(member, -1, "bench")
+            await store.index(guild.id)
+            recorder.add(time.perf_counter() - begun)
+        await store.flush()
+    finally:
+        store.max_entries = saved_cap
+    return len(guilds), time.perf_counter() - started, recorder
+
+async def bench_raid_joins(h: Harness):
+    count = h.n(1000)
+    guild = h.guild()
+    enforcer = h.bot.raid_enforcer
+    baseline = enforcer.enforced + enforcer.failed
+    recorder = LatencyRecorder()
+    started = time.perf_counter()
+    for _ in range(count):
+        joined = time.perf_counter()
+        # Fresh snowflakes are brand-new accounts, so the detector trips after a few joins
+        h.gateway.member_add(guild.id, snowflake())
+        recorder.add(time.perf_counter() - joined)
+        await asyncio.sleep(0)
+    # Let the handlers and batched enforcement drain: done once nothing is queued
+    # and the counters have stopped moving for a couple of linger periods
+    handled, finished, last_change = 0, time.perf_counter(), time.perf_counter()
+    while time.perf_counter() - last_change < 2 * modbot.RAID_BATCH_LINGER or enforcer.pending():
+        await asyncio.sleep(0.05)
+        current = enforcer.enforced + enforcer.failed - baseline
+        if current != handled:
+            handled, finished, last_change = current, time.perf_counter(), time.perf_counter()
+    return handled, finished - started, recorder
+
+SCENARIOS = {
+    "massban": bench_massban,
+    "massban_file": bench_massban_file,
+    "massinvite": bench_massinvite,
+    "cleanuser": bench_cleanuser,
+    "softban_sweep": bench_softban_sweep,
+    "lockdown": bench_lockdown,
+    "banrole": bench_banrole,
+    "trust_updates": bench_trust_updates,
+    "trust_cap": bench_trust_cap,
+    "raid_joins": bench_raid_joins,
+}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            print(f"  {name:<14} (no baseline)")
+            continue
+        change = (result["ops_per_sec"] - previous["ops_per_sec"]) / previous["ops_per_sec"] if previous["ops_per_sec"] else 0.0
+        flag = "REGRESSION" if change < -tolerance else "ok"
+        if flag != "ok":
+            regressions.append(name)
+        print(f"  {name:<14} {previous['ops_per_sec']:>10,.1f} -> {result['ops_per_sec']:>10,.1f} ops/s ({change:+.0%}) {flag}")
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake REST response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per response")
+    parser.add_argument("--bucket-limit", type=int, default=0, help="Requests per route bucket per second before 429s (0: unlimited)")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Also answer every Nth request with a 429")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every scenario's size")
+    parser.add_argument("--only", nargs="*", choices=sorted(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument("--routes", action="store_true", help="Print the busiest fake REST routes per scenario")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Record results to {os.path.basename(BASELINE_FILE)}")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Throughput drop that counts as a regression")
+    args = parser.parse_args()
+
+    settings = {"latency": args.latency, "jitter": args.jitter, "bucket_limit": args.bucket_limit, "rate_limit_every": args.rate_limit_every, "scale": args.scale}
+    server = FakeDiscord(latency=args.latency, jitter=args.jitter, bucket_limit=args.bucket_limit or None, rate_limit_every=args.rate_limit_every)
+    harness = Harness(server, args.scale)
+    await harness.start()
+    results = {}
+    try:
+        for name in args.only or SCENARIOS:
+            server.reset_counters()
+            operations, elapsed, recorder = await SCENARIOS[name](harness)
+            result = recorder.summary(elapsed, operations)
+            result["rest_requests"] = sum(server.requests.values())
+            result["rate_limited"] = server.rate_limited
+            results[name] = result
+            if args.routes:
+                print("    " + ", ".join(f"{route}: {count}" for route, count in server.requests.most_common(5)))
+            print(
+                f"{name:<14} {operations:>7,} ops in {elapsed:7.2f}s  {result['ops_per_sec']:>10,.1f} ops/s  "
+                f"p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  REST {result['rest_requests']:,} (429s: {result['rate_limited']})"
+            )
+    finally:
+        await harness.stop()
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        entry = baselines.get("results", {}) if baselines.get("settings") == settings else {}
+        entry.update(results)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({"settings": settings, "results": entry}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {BASELINE_FILE}")
+        return 0
+    if baselines.get("settings") != settings:
+        print("No baseline recorded with these settings; run with --save-baseline to create one.")
+        return 0
+    print("Compared with baseline:")
+    regressions = compare(results, baselines["results"], args.tolerance)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,43 @@
+"""Measures MessageIndex memory and insert speed.
+
+Usage: python benchmarks/bench_message_index.py [messages] [members]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from bot import MessageIndex
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    members = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    guild_id = 111111111111111111
+    channels = [222222222222222222 + i for i in range(50)]
+    base = discord.utils.time_snowflake(discord.utils.utcnow())
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = MessageIndex(max_entries=total)
+    started = time.perf_counter()
+    for i in range(total):
+        index.add(guild_id, 333333333333333333 + i % members, channels[i % len(channels)], base + i)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    per_million = used / len(index) * 1_000_000
+    print(f"indexed {len(index):,} messages for {len(index.members):,} members")
+    print(f"memory: {used / 1024 / 1024:.1f} MiB total, {per_million / 1024 / 1024:.1f} MiB per million messages, {used / len(index):.1f} bytes/message")
+    print(f"insert: {elapsed:.2f}s, {elapsed / total * 1e6:.2f} us/message")
+
+    started = time.perf_counter()
+    for i in range(1000):
+        index.messages_for(guild_id, 333333333333333333 + i % members)
+    print(f"lookup: {(time.perf_counter() - started) / 1000 * 1e6:.1f} us/member")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""Local stand-in for the Discord REST API and gateway, for offline benchmarks.
+
+FakeDiscord is an aiohttp server answering the REST routes the bot uses, with
+configurable latency and rate limiting. Point discord.py at it with
+`FakeDiscord.patch_routes()`; it overrides `discord.http.Route.BASE`, which the
+interaction webhooks share.
+
+FakeGateway feeds dispatch payloads straight into the client's connection state
+(the same parse_* handlers the websocket uses), so events like GUILD_MEMBER_ADD
+and MESSAGE_CREATE go through discord.py's normal event path.
+"""
+import asyncio
+import datetime
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+import discord
+from aiohttp import web
+
+ADMINISTRATOR = str(discord.Permissions.all().value)
+EPOCH = 1420070400000
+UNLIMITED_BUCKET = 1_000_000
+
+_increment = itertools.count()
+
+def snowflake(offset_ms=0):
+    """A unique snowflake for now (or `offset_ms` ago)."""
+    return (int(time.time() * 1000) - EPOCH - offset_ms) << 22 | (next(_increment) & 0x3FFFFF)
+
+def user_payload(user_id, name=None, bot=False):
+    # Snowflakes carry the creation time, which the anti-raid age checks read
+    user_id = int(user_id)
+    return {"id": str(user_id), "username": name or f"user{user_id % 100000}", "discriminator": "0", "global_name": None, "avatar": None, "bot": bot}
+
+def member_payload(user, roles=(), joined_at=None):
+    return {
+        "user": user, "roles": [str(r) for r in roles], "joined_at": joined_at or datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "deaf": False, "mute": False, "flags": 0, "nick": None, "avatar": None, "premium_since": None, "pending": False,
+    }
+
+def message_payload(channel_id, author, content="", message_id=None, guild_id=None):
+    payload = {
+        "id": str(message_id or snowflake()), "channel_id": str(channel_id), "author": author, "content": content,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), "edited_timestamp": None, "tts": False,
+        "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0,
+    }
+    if guild_id is not None:
+        payload["guild_id"] = str(guild_id)
+    return payload
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes bodies whose content type is exactly application/json
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={**(headers or {}), "Content-Type": "application/json"})
+
+class FakeDiscord:
+    """Answers Discord REST routes from memory.
+
+    latency: seconds added to every response (plus up to `jitter` extra).
+    bucket_limit / bucket_window: requests allowed per route bucket (method, route,
+        major ID) per window; further requests get a 429 with the time left in the window.
+        Rate-limit headers are sent so discord.py can pace itself like it does live.
+    rate_limit_every: additionally answer every Nth request with a 429 of `retry_after`s.
+    """
+
+    API = "/api/v10"
+
+    def __init__(self, latency=0.02, jitter=0.0, bucket_limit=None, bucket_window=1.0, rate_limit_every=0, retry_after=0.05, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.bot_user = user_payload(1000, "ModBot", bot=True)
+        self.owner_user = user_payload(1001, "Owner")
+        self.application_id = 1000
+        self.history = {} # channel_id -> list of message payloads, newest first
+        self.forbidden_dms = set() # user IDs that have DMs closed
+        self.attachments = {} # attachment ID -> file body served from /attachments/
+        self.requests = Counter() # "METHOD route" -> count
+        self.rate_limited = 0
+        self.bans = set()
+        self._buckets = {}
+        self._count = itertools.count(1)
+        self._runner = None
+        self.port = None
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.port}{self.API}"
+
+    def patch_routes(self):
+        discord.http.Route.BASE = self.base
+
+    async def start(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=64 * 1024 * 1024)
+        r = app.router
+        api = self.API
+        r.add_get(api + "/users/@me", self.get_me)
+        r.add_get(api + "/gateway/bot", self.get_gateway)
+        r.add_get(api + "/oauth2/applications/@me", self.get_application)
+        r.add_put(api + "/applications/{app}/commands", self.put_commands)
+        r.add_post(api + "/interactions/{id}/{token}/callback", self.interaction_callback)
+        r.add_post(api + "/webhooks/{app}/{token}", self.create_message)
+        r.add_get(api + "/webhooks/{app}/{token}/messages/{message}", self.get_webhook_message)
+        r.add_patch(api + "/webhooks/{app}/{token}/messages/{message}", self.edit_message)
+        r.add_put(api + "/guilds/{guild}/bans/{user}", self.ban)
+        r.add_delete(api + "/guilds/{guild}/bans/{user}", self.no_content)
+        r.add_post(api + "/guilds/{guild}/bulk-ban", self.bulk_ban)
+        r.add_delete(api + "/guilds/{guild}/members/{user}", self.no_content)
+        r.add_patch(api + "/guilds/{guild}/members/{user}", self.edit_member)
+        r.add_put(api + "/guilds/{guild}/members/{user}/roles/{role}", self.no_content)
+        r.add_delete(api + "/guilds/{guild}/members/{user}/roles/{role}", self.no_content)
+        r.add_post(api + "/guilds/{guild}/channels", self.create_channel)
+        r.add_get(api + "/users/{user}", self.get_user)
+        r.add_post(api + "/users/@me/channels", self.create_dm)
+        r.add_get(api + "/channels/{channel}/messages", self.get_history)
+        r.add_post(api + "/channels/{channel}/messages", self.create_message)
+        r.add_post(api + "/channels/{channel}/messages/bulk-delete", self.no_content)
+        r.add_delete(api + "/channels/{channel}/messages/{message}", self.no_content)
+        r.add_patch(api + "/channels/{channel}/messages/{message}", self.edit_message)
+        r.add_put(api + "/channels/{channel}/messages/{message}/reactions/{emoji}/@me", self.no_content)
+        r.add_put(api + "/channels/{channel}/permissions/{target}", self.no_content)
+        r.add_delete(api + "/channels/{channel}/permissions/{target}", self.no_content)
+        r.add_post(api + "/channels/{channel}/invites", self.create_invite)
+        r.add_patch(api + "/channels/{channel}", self.edit_channel)
+        r.add_delete(api + "/channels/{channel}", self.edit_channel)
+        r.add_get("/attachments/{attachment}/{filename}", self.get_attachment)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def reset_counters(self):
+        self.requests.clear()
+        self.rate_limited = 0
+
+    # --- Plumbing ---
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.requests[f"{request.method} {route}"] += 1
+        delay = self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        # Discord always sends rate-limit headers; without them discord.py runs one
+        # request per bucket at a time, so "unlimited" still advertises a large limit
+        limit = self.bucket_limit or UNLIMITED_BUCKET
+        # Bucket per route and its major parameter, roughly like Discord
+        major = request.match_info.get("guild") or request.match_info.get("channel") or request.match_info.get("token") or ""
+        key = (request.method, route, major)
+        now = time.monotonic()
+        window = self._buckets.get(key)
+        if window is None or now >= window[0]:
+            window = self._buckets[key] = [now + self.bucket_window, 0]
+        window[1] += 1
+        remaining = limit - window[1]
+        reset_after = max(0.0, window[0] - now)
+        headers = {
+            "X-Ratelimit-Bucket": f"{request.method}:{route}", "X-Ratelimit-Limit": str(limit),
+            "X-Ratelimit-Remaining": str(max(0, remaining)), "X-Ratelimit-Reset-After": f"{reset_after:.3f}",
+        }
+        if remaining < 0:
+            return self._too_many(reset_after, headers)
+        if self.rate_limit_every and next(self._count) % self.rate_limit_every == 0:
+            return self._too_many(self.retry_after, headers)
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    def _too_many(self, retry_after, headers):
+        self.rate_limited += 1
+        # discord.py treats a 429 without a Via header as a Cloudflare ban
+        headers = dict(headers, Via="1.1 google", **{"Retry-After": f"{retry_after:.3f}"})
+        return json_response({"message": "You are being rate limited.", "retry_after": retry_after, "global": False}, status=429, headers=headers)
+
+    async def _payload(self, request):
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json", "{}"))
+        if request.can_read_body:
+            try:
+                return await request.json()
+            except ValueError:
+                return {}
+        return {}
+
+    async def no_content(self, request):
+        return web.Response(status=204)
+
+    # --- Routes ---
+
+    async def get_me(self, request):
+        return json_response(self.bot_user)
+
+    async def get_gateway(self, request):
+        return json_response({"url": "ws://127.0.0.1", "shards": 1, "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+
+    async def get_application(self, request):
+        return json_response({
+            "id": str(self.application_id), "name": "ModBot", "description": "", "icon": None, "bot_public": True,
+            "bot_require_code_grant": False, "owner": self.owner_user, "team": None, "verify_key": "0" * 64, "flags": 0,
+        })
+
+    async def put_commands(self, request):
+        return json_response([])
+
+    async def interaction_callback(self, request):
+        payload = await self._payload(request)
+        data = {"interaction": {"id": request.match_info["id"], "type": 2}}
+        if payload.get("type") == 4:
+            message = message_payload(0, self.bot_user, (payload.get("data") or {}).get("content") or "")
+            data["interaction"]["response_message_id"] = message["id"]
+            data["resource"] = {"type": 4, "message": message}
+        return json_response(data)
+
+    async def get_webhook_message(self, request):
+        return json_response(message_payload(0, self.bot_user, message_id=snowflake()))
+
+    async def create_message(self, request):
+        payload = await self._payload(request)
+        channel = request.match_info.get("channel", 0)
+        return json_response(message_payload(channel, self.bot_user, payload.get("content") or ""))
+
+    async def edit_message(self, request):
+        payload = await self._payload(request)
+        return json_response(message_payload(request.match_info.get("channel", 0), self.bot_user, payload.get("content") or "", message_id=request.match_info["message"] if request.match_info["message"] != "@original" else None))
+
+    async def ban(self, request):
+        self.bans.add(int(request.match_info["user"]))
+        return web.Response(status=204)
+
+    async def bulk_ban(self, request):
+        payload = await self._payload(request)
+        users = payload.get("user_ids", [])
+        self.bans.update(int(uid) for uid in users)
+        return json_response({"banned_users": users, "failed_users": []})
+
+    async def edit_member(self, request):
+        return json_response(member_payload(user_payload(request.match_info["user"])))
+
+    async def create_channel(self, request):
+        payload = await self._payload(request)
+        return json_response({"id": str(snowflake()), "type": 0, "guild_id": request.match_info["guild"], "name": payload.get("name", "channel"), "position": 0, "permission_overwrites": []})
+
+    async def edit_channel(self, request):
+        payload = await self._payload(request)
+        return json_response({"id": request.match_info["channel"], "type": 0, "name": payload.get("name", "channel"), "position": 0, "permission_overwrites": []})
+
+    async def get_user(self, request):
+        return json_response(user_payload(request.match_info["user"]))
+
+    async def create_dm(self, request):
+        payload = await self._payload(request)
+        recipient = int(payload.get("recipient_id", 0))
+        if recipient in self.forbidden_dms:
+            return json_response({"message": "Cannot send messages to this user", "code": 50007}, status=403)
+        return json_response({"id": str(snowflake()), "type": 1, "recipients": [user_payload(recipient)], "last_message_id": None})
+
+    async def get_history(self, request):
+        messages = self.history.get(int(request.match_info["channel"]), [])
+        limit = int(request.query.get("limit", 50))
+        before = request.query.get("before")
+        if before:
+            before = int(before)
+            messages = [m for m in messages if int(m["id"]) < before]
+        return json_response(messages[:limit])
+
+    async def create_invite(self, request):
+        code = "".join(self.rng.choice("abcdefghjkmnpqrstuvwxyz23456789") for _ in range(8))
+        return json_response({
+            "code": code, "uses": 0, "max_uses": 0, "max_age": 86400, "temporary": False,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), "inviter": self.bot_user,
+            "channel": {"id": request.match_info["channel"], "name": "general", "type": 0}, "type": 0,
+        })
+
+    async def get_attachment(self, request):
+        body = self.attachments.get(int(request.match_info["attachment"]))
+        if body is None:
+            return web.Response(status=404)
+        return web.Response(body=body, content_type="text/plain")
+
+    def attachment(self, client, filename, body: bytes):
+        """A discord.Attachment for `body`, downloadable from this server like a CDN file."""
+        attachment_id = snowflake()
+        self.attachments[attachment_id] = body
+        url = f"http://127.0.0.1:{self.port}/attachments/{attachment_id}/{filename}"
+        data = {"id": str(attachment_id), "filename": filename, "size": len(body), "url": url, "proxy_url": url}
+        return discord.Attachment(data=data, state=client._connection)
+
+class FakeGateway:
+    """Builds guilds in the client's cache and dispatches gateway events into it."""
+
+    def __init__(self, client, server: FakeDiscord):
+        self.client = client
+        self.server = server
+        self.state = client._connection
+
+    def create_guild(self, guild_id, members, channels=5, extra_roles=()):
+        """Adds a guild with the bot (administrator), its owner and `members` to the cache.
+
+        `members` is a list of (user_id, role_ids). `moderator_role(guild_id)` has
+        Manage Messages, which exempts its members from automod and the spam filter.
+        """
+        bot_role, member_role = guild_id + 1, guild_id + 2
+        roles = [
+            {"id": str(guild_id), "name": "@everyone", "permissions": str(discord.Permissions.general().value), "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False},
+            {"id": str(bot_role), "name": "ModBot", "permissions": ADMINISTRATOR, "position": 10, "color": 0, "hoist": False, "managed": False, "mentionable": False},
+            {"id": str(member_role), "name": "Members", "permissions": "0", "position": 1, "color": 0, "hoist": False, "managed": False, "mentionable": False},
+            {"id": str(self.moderator_role(guild_id)), "name": "Moderators", "permissions": str(discord.Permissions(manage_messages=True).value), "position": 2, "color": 0, "hoist": False, "managed": False, "mentionable": False},
+        ]
+        for position, (role_id, name) in enumerate(extra_roles, start=3):
+            roles.append({"id": str(role_id), "name": name, "permissions": "0", "position": position, "color": 0, "hoist": False, "managed": False, "mentionable": False})
+        channel_payloads = [
+            {"id": str(guild_id + 100 + i), "type": 0, "name": f"channel-{i}", "position": i, "permission_overwrites": [], "guild_id": str(guild_id)}
+            for i in range(channels)
+        ]
+        member_payloads = [member_payload(self.server.bot_user, [bot_role]), member_payload(self.server.owner_user)]
+        member_payloads += [member_payload(user_payload(uid), roles) for uid, roles in members]
+        payload = {
+            "id": str(guild_id), "name": f"Guild {guild_id}", "owner_id": self.server.owner_user["id"], "roles": roles,
+            "channels": channel_payloads, "members": member_payloads, "member_count": len(member_payloads),
+            "features": [], "emojis": [], "stickers": [], "premium_tier": 0, "large": len(member_payloads) > 250,
+            "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+            "system_channel_id": channel_payloads[0]["id"], "icon": None, "description": None, "preferred_locale": "en-US",
+        }
+        guild = discord.Guild(data=payload, state=self.state)
+        self.state._add_guild(guild)
+        return guild
+
+    @staticmethod
+    def moderator_role(guild_id):
+        return guild_id + 3
+
+    def member_add(self, guild_id, user_id):
+        data = member_payload(user_payload(user_id))
+        data["guild_id"] = str(guild_id)
+        self.state.parse_guild_member_add(data)
+
+    def message_create(self, guild_id, channel_id, author_id, content, roles=()):
+        data = message_payload(channel_id, user_payload(author_id), content, guild_id=guild_id)
+        data["member"] = member_payload(None, roles)
+        del data["member"]["user"]
+        self.state.parse_message_create(data)
+        # Kept server-side too, so history scans see what the gateway delivered
+        self.server.history.setdefault(channel_id, []).insert(0, data)
+        return int(data["id"])
+
+    def interaction(self, guild_id, channel_id, name, options=(), user=None):
+        """A slash-command interaction from the guild owner (or `user`) in `channel_id`."""
+        member = member_payload(user or self.server.owner_user)
+        member["permissions"] = ADMINISTRATOR
+        data = {
+            "id": str(snowflake()), "application_id": str(self.server.application_id), "type": 2, "token": f"token{snowflake()}",
+            "version": 1, "guild_id": str(guild_id), "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": 0, "name": "general", "guild_id": str(guild_id), "permission_overwrites": [], "position": 0},
+            "member": member, "app_permissions": ADMINISTRATOR, "attachment_size_limit": 8 * 1024 * 1024, "locale": "en-US",
+            "data": {"id": str(snowflake()), "name": name, "type": 1, "options": list(options)},
+        }
+        return discord.Interaction(data=data, state=self.state)
+
+class LatencyRecorder:
+    """Collects per-operation latencies and summarises them."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self, elapsed, operations=None):
+        samples = sorted(self.samples)
+        operations = operations if operations is not None else len(samples)
+
+        def pct(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+        return {
+            "operations": operations, "seconds": round(elapsed, 3), "ops_per_sec": round(operations / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(pct(0.50), 2), "p95_ms": round(pct(0.95), 2), "max_ms": round(samples[-1] * 1000, 2) if samples else 0.0,
+        }
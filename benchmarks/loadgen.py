@@ -0,0 +1,307 @@
+"""Replays gateway event streams into MyBot's handlers at a controlled rate.
+
+Runs fully offline: events go through the client's connection-state parsers
+(see fakediscord.FakeGateway) and any REST the handlers cause hits the local
+fake Discord. For each stream it reports end-to-end handling latency (event fed
+-> handler finished), event-loop lag and peak RSS.
+
+Streams:
+  joins      join storm of brand-new accounts (on_member_join, anti-raid)
+  messages   message flood from many members with a few spammers (on_message)
+  reactions  mass reactions on a /poll message (raw and cached reaction events)
+
+Usage:
+  python benchmarks/loadgen.py joins --rate 200 --events 5000
+  python benchmarks/loadgen.py messages --rate 2000 --multiplier 10
+  python benchmarks/loadgen.py messages --record flood.jsonl   # save the synthetic stream
+  python benchmarks/loadgen.py replay flood.jsonl --rate 500   # replay a recorded stream
+  python benchmarks/loadgen.py replay flood.jsonl --multiplier 10   # ...at 10x its recorded pace
+
+A recorded stream is JSON lines of {"t": seconds from start, "op": gateway event
+name, "d": payload}. Replay keeps the recorded spacing unless --rate is given.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Shares the command benchmarks' setup: temp data dir, fake REST, logged-in bot
+from bench_commands import Harness, modbot
+from fakediscord import FakeDiscord, LatencyRecorder, member_payload, message_payload, snowflake, user_payload
+
+PARSERS = {
+    "GUILD_MEMBER_ADD": "parse_guild_member_add",
+    "MESSAGE_CREATE": "parse_message_create",
+    "MESSAGE_REACTION_ADD": "parse_message_reaction_add",
+}
+
+def rss_mb():
+    """Current resident set size, from /proc where available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a short sleep."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = LatencyRecorder()
+        self.peak_rss = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        samples = 0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.add(max(0.0, loop.time() - expected))
+            samples += 1
+            if samples % 10 == 0:
+                self.peak_rss = max(self.peak_rss, rss_mb())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+class HandlerTimer:
+    """Wraps bot event handlers to time each event from feed to completion.
+
+    The feeder stamps an event key (member ID, message ID, ...) before parsing it;
+    the wrapped handler looks the stamp up when it finishes.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.fed = {}
+        self.latency = LatencyRecorder()
+        self.handled = 0
+
+    def stamp(self, key):
+        self.fed[key] = time.perf_counter()
+
+    def wrap(self, event, key):
+        original = getattr(self.bot, event, None)
+
+        async def timed(*args):
+            try:
+                if original is not None:
+                    await original(*args)
+            finally:
+                fed = self.fed.pop(key(*args), None)
+                if fed is not None:
+                    self.latency.add(time.perf_counter() - fed)
+                    self.handled += 1
+
+        # Client.dispatch looks handlers up on the instance, so this shadows the method
+        setattr(self.bot, event, timed)
+
+# --- Streams ---
+# Each yields (op, payload, key) where key matches what HandlerTimer sees.
+
+def join_stream(guild, count):
+    for _ in range(count):
+        user_id = snowflake()
+        data = member_payload(user_payload(user_id))
+        data["guild_id"] = str(guild.id)
+        yield "GUILD_MEMBER_ADD", data, user_id
+
+def message_stream(guild, count, members=5000, spammers=20, seed=3):
+    rng = random.Random(seed)
+    channels = [channel.id for channel in guild.text_channels]
+    words = ["hey", "lol", "anyone", "raid", "tonight", "gg", "what", "is", "the", "patch", "nerf", "buff", "ok", "thanks"]
+    spam = "FREE NITRO!!! claim at discord-gift.example"
+    for i in range(count):
+        if i % 25 == 0:
+            author, content = rng.randrange(spammers) + 10, spam
+        else:
+            author, content = 100_000 + rng.randrange(members), " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+        data = message_payload(rng.choice(channels), user_payload(author), content, guild_id=guild.id)
+        data["member"] = member_payload(None)
+        del data["member"]["user"]
+        yield "MESSAGE_CREATE", data, int(data["id"])
+
+def reaction_stream(guild, channel_id, message_id, count):
+    for i in range(count):
+        user_id = 200_000 + i
+        data = {
+            "user_id": str(user_id), "channel_id": str(channel_id), "message_id": str(message_id), "guild_id": str(guild.id),
+            "emoji": {"id": None, "name": "✅" if i % 3 else "❌"}, "burst": False, "type": 0,
+            "member": member_payload(user_payload(user_id)),
+        }
+        yield "MESSAGE_REACTION_ADD", data, user_id
+
+def load_recording(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+async def replay(harness, events, rate, timer):
+    """Feeds (offset, op, payload, key) events, pacing by `rate` or the recorded offsets."""
+    state = harness.bot._connection
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    fed = 0
+    for index, (offset, op, payload, key) in enumerate(events):
+        due = started + (index / rate if rate else offset)
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif index % 100 == 0:
+            # Running behind: still yield now and then so handlers get to run
+            await asyncio.sleep(0)
+        if key is not None:
+            timer.stamp(key)
+        getattr(state, PARSERS[op])(payload)
+        fed += 1
+    return fed, loop.time() - started
+
+async def drain(timer, expected, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while timer.handled < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+async def settle_enforcement(enforcer, timeout=120.0):
+    """Waits for queued anti-raid kicks/bans to finish. Returns how many were handled."""
+    handled = enforcer.enforced + enforcer.failed
+    last_change = time.perf_counter()
+    deadline = last_change + timeout
+    while (enforcer.pending() or time.perf_counter() - last_change < 2 * enforcer.linger) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        current = enforcer.enforced + enforcer.failed
+        if current != handled:
+            handled, last_change = current, time.perf_counter()
+    return handled
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("stream", choices=["joins", "messages", "reactions", "replay"])
+    parser.add_argument("recording", nargs="?", help="JSON lines stream for 'replay'")
+    parser.add_argument("--events", type=int, default=2000, help="Events in a synthetic stream")
+    parser.add_argument("--rate", type=float, default=None, help="Events per second (default: 100, or the recorded pace for replay)")
+    parser.add_argument("--multiplier", type=float, default=1.0, help="Scale --rate and --events, e.g. 10 for 10x peak")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake REST response")
+    parser.add_argument("--automod-rules", type=int, default=0, help="Keyword automod rules to load for the message stream")
+    parser.add_argument("--record", help="Write the synthetic stream to this file instead of replaying it")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+    if args.record and args.stream == "replay":
+        parser.error("--record saves a synthetic stream; a recording is already a file")
+
+    rate = args.rate * args.multiplier if args.rate else (None if args.stream == "replay" else 100 * args.multiplier)
+    count = int(args.events * args.multiplier)
+    server = FakeDiscord(latency=args.latency)
+    harness = Harness(server, 1.0)
+    await harness.start()
+    bot = harness.bot
+    timer = HandlerTimer(bot)
+    try:
+        guild = harness.guild(channels=20)
+        if args.stream == "joins" or args.stream == "replay":
+            timer.wrap("on_member_join", lambda member: member.id)
+        if args.stream == "messages" or args.stream == "replay":
+            timer.wrap("on_message", lambda message: message.id)
+            for i in range(args.automod_rules):
+                await bot.automod.add_rule(guild.id, "keyword", f"blocked{i}word", "delete", modbot.AUTOMOD_DEFAULT_DELTA)
+        if args.stream == "reactions" or args.stream == "replay":
+            timer.wrap("on_raw_reaction_add", lambda payload: payload.user_id)
+
+        if args.stream == "joins":
+            stream = join_stream(guild, count)
+        elif args.stream == "messages":
+            stream = message_stream(guild, count)
+        elif args.stream == "reactions":
+            channel = guild.text_channels[0]
+            interaction = harness.gateway.interaction(guild.id, channel.id, "poll")
+            await bot.tree.get_command("poll").callback(interaction, question="Load test?")
+            poll = await interaction.original_response()
+            # Discord echoes the bot's own message on the gateway, which is what puts it in the message cache
+            bot._connection.parse_message_create(message_payload(channel.id, server.bot_user, message_id=poll.id, guild_id=guild.id))
+            stream = reaction_stream(guild, channel.id, poll.id, count)
+        else:
+            if not args.recording:
+                parser.error("replay needs a recording file")
+            key_of = {"GUILD_MEMBER_ADD": lambda d: int(d["user"]["id"]), "MESSAGE_CREATE": lambda d: int(d["id"]), "MESSAGE_REACTION_ADD": lambda d: int(d["user_id"])}
+            stream = None
+
+        if args.record:
+            with open(args.record, "w") as f:
+                for index, (op, payload, _) in enumerate(stream):
+                    f.write(json.dumps({"t": round(index / rate, 6), "op": op, "d": payload}) + "\n")
+            print(f"Wrote {count:,} events to {args.record}")
+            return 0
+
+        if stream is None:
+            # Recorded payloads are retargeted at the harness guild
+            events = []
+            for event in load_recording(args.recording):
+                payload = event["d"]
+                payload["guild_id"] = str(guild.id)
+                if event["op"] == "MESSAGE_CREATE" or event["op"] == "MESSAGE_REACTION_ADD":
+                    payload["channel_id"] = str(guild.text_channels[0].id)
+                # --multiplier compresses the recorded timeline, e.g. 10 replays at 10x speed
+                events.append((event["t"] / args.multiplier, event["op"], payload, key_of[event["op"]](payload)))
+        else:
+            events = [(0.0, op, payload, key) for op, payload, key in stream]
+
+        monitor = LoopLagMonitor()
+        server.reset_counters()
+        rss_before = rss_mb()
+        monitor.start()
+        started = time.perf_counter()
+        fed, feed_seconds = await replay(harness, events, rate, timer)
+        await drain(timer, fed)
+        elapsed = time.perf_counter() - started
+        enforced = await settle_enforcement(bot.raid_enforcer)
+        enforcement_seconds = time.perf_counter() - started
+        await monitor.stop()
+    finally:
+        await harness.stop()
+
+    latency = timer.latency.summary(elapsed)
+    lag = monitor.samples.summary(elapsed)
+    result = {
+        "stream": args.stream, "events": fed, "handled": timer.handled,
+        "target_rate": rate, "achieved_rate": round(fed / feed_seconds, 1) if feed_seconds else None,
+        "latency_p50_ms": latency["p50_ms"], "latency_p95_ms": latency["p95_ms"], "latency_max_ms": latency["max_ms"],
+        "loop_lag_p95_ms": lag["p95_ms"], "loop_lag_max_ms": lag["max_ms"],
+        "rss_start_mb": round(rss_before, 1), "rss_peak_mb": round(max(monitor.peak_rss, rss_before), 1), "process_peak_rss_mb": round(peak_rss_mb(), 1),
+        "rest_requests": sum(server.requests.values()), "rate_limited": server.rate_limited,
+        "raid_enforced": enforced, "raid_drain_seconds": round(enforcement_seconds, 2) if enforced else None,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        target = f"{rate:,.0f}/s" if rate else "recorded pace"
+        print(f"{args.stream}: {fed:,} events fed at {result['achieved_rate']:,}/s (target {target}), {timer.handled:,} handled")
+        print(f"  handling latency  p50 {latency['p50_ms']:.2f}ms  p95 {latency['p95_ms']:.2f}ms  max {latency['max_ms']:.2f}ms")
+        print(f"  event-loop lag    p95 {lag['p95_ms']:.2f}ms  max {lag['max_ms']:.2f}ms")
+        print(f"  RSS               {result['rss_start_mb']} MiB at start, {result['rss_peak_mb']} MiB peak (process peak {result['process_peak_rss_mb']} MiB)")
+        print(f"  REST              {result['rest_requests']:,} requests, {result['rate_limited']} 429s")
+        if enforced:
+            print(f"  anti-raid         {enforced:,} joiners removed, queue drained {enforcement_seconds:.2f}s after the first event")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -2,70 +2,2816 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import aiohttp
+import asyncio
+from aiohttp import web
+from array import array
+import bisect
 import json
+import logging
 import os
 import re
+import contextlib
+import contextvars
 import datetime
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import math
 import random
+import sqlite3
+import string
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 from typing import Optional
 
+PROCESS_STARTED = time.perf_counter()
+
 # Configuration
 TOKEN_FILE = 'token.txt'
+DATA_DIR = os.getenv('MODBOT_DATA_DIR', os.getcwd()) # Where all data files live; no directory searching
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '0') == '1' # Sync slash commands even if unchanged
 TRUST_FILE_NAME = 'trust_scores.json'
 BLOCK_FILE_NAME = 'blocked_users.json'
+TRUST_DB_NAME = 'trust.db'
+TRUST_BACKEND = os.getenv('TRUST_BACKEND', 'sqlite') # 'sqlite' (with history) or 'json'
+TRUST_FLUSH_INTERVAL = 5.0 # Seconds between write-behind flushes of the trust store
+TRUST_FLUSH_THRESHOLD = 100 # Pending writes that force an early flush
+TRUST_CACHE_MAX_MB = float(os.getenv('TRUST_CACHE_MAX_MB', '64')) # Memory cap for resident guild partitions
+TRUST_ENTRY_BYTES = 180 # Rough resident cost of one cached score (dict slot + key + value + score index set slot)
+TRUST_SHARD_IDLE_SECONDS = 1800 # Unload a guild's partition after this long without access
+LEGACY_GUILD_ID = 0 # Scores recorded before trust was scoped per guild
+TRUST_LEGACY_CACHE_ENTRIES = 10000 # Users whose legacy score lookup is kept in memory
+BULK_BAN_CHUNK = 200 # Max users per bulk-ban request
+BULK_BAN_CONCURRENCY = 2 # Bulk-ban requests in flight at once
+MASSBAN_CONCURRENCY = 5 # Single bans in flight when bulk ban is unavailable
+PROGRESS_EDIT_INTERVAL = 2.0 # Min seconds between progress message edits
+ID_FILE_MAX_BYTES = 25 * 1024 * 1024 # Largest ID list attachment the bulk commands accept
+ID_FILE_CHUNK = 64 * 1024 # Bytes parsed at a time while an ID list attachment downloads
+ID_FILE_EXTENSIONS = ('.txt', '.csv', '.json')
+DM_WORKERS = 4 # Parallel DM senders per mass-invite job
+DM_RATE_PER_SECOND = 1.0 # Sustained DM rate shared by all jobs
+DM_BURST = 5 # DMs allowed back to back before the rate applies
+DM_MAX_ATTEMPTS = 3 # Tries per DM on 429s and server errors
+DM_CHECKPOINT_INTERVAL = 5.0 # Seconds between job progress saves
+CLEAN_CHANNEL_CONCURRENCY = 5 # Channels scanned at once by /cleanuser
+CLEAN_OLD_DELETE_INTERVAL = 1.0 # Seconds between single deletes of messages too old for bulk delete
+CLEAN_JOIN_MARGIN = datetime.timedelta(minutes=10) # /cleanuser scans this far before a member's join time, for clock skew
+MESSAGE_INDEX_ENABLED = os.getenv('MESSAGE_INDEX', '1') != '0' # Track recent message IDs per member for /cleanuser
+MESSAGE_INDEX_PER_USER = 256 # Most recent messages remembered per member
+MESSAGE_INDEX_MAX_ENTRIES = 600_000 # Total messages across all members (~110 bytes each with the delete lookup)
+MESSAGE_INDEX_MAX_AGE = datetime.timedelta(days=14) # Matches the bulk-delete window
+LOCKDOWN_CONCURRENCY = 5 # Channel overwrite edits in flight during /lockdown and /unlockdown
+RAID_JOIN_THRESHOLD = 10 # Joins within RAID_WINDOW_SECONDS that switch raid mode on
+RAID_WINDOW_SECONDS = 10.0
+RAID_COOLDOWN_SECONDS = 300.0 # Raid mode switches off after this long below the threshold
+RAID_YOUNG_ACCOUNT_AGE = datetime.timedelta(days=7) # Younger accounts count double toward the threshold
+RAID_TRUSTED_ACCOUNT_AGE = datetime.timedelta(days=180) # Older accounts are let through during an automatic raid
+RAID_ACTION = os.getenv('RAID_ACTION', 'kick') # 'kick' or 'ban' for joiners caught in a raid
+RAID_BATCH_SIZE = 200 # Joiners handled per enforcement batch
+RAID_BATCH_LINGER = 1.0 # Seconds to collect joiners before enforcing a batch
+RAID_KICK_CONCURRENCY = 5 # Kicks in flight per batch
+AUTOMOD_DEFAULT_DELTA = -5 # Trust change when an automod rule is broken
+SPAM_HISTORY = 16 # Recent messages remembered per member by the spam detector
+SPAM_MAX_TRACKED = 100_000 # Members tracked at once; the least recently active are dropped
+SPAM_RATE_LIMIT = 8 # Messages within SPAM_RATE_WINDOW that count as flooding
+SPAM_RATE_WINDOW = 5.0
+SPAM_DUPLICATE_LIMIT = 4 # Same message this many times within SPAM_DUPLICATE_WINDOW
+SPAM_DUPLICATE_CHANNELS = 3 # ...or in this many different channels
+SPAM_DUPLICATE_WINDOW = 60.0
+SPAM_FINGERPRINT_CHARS = 500 # Only the start of long messages is fingerprinted
+SPAM_TIMEOUT_MINUTES = 10 # Timeout applied to detected spammers
+REST_BUCKET_CONCURRENCY = 5 # REST calls in flight per route bucket
+MOD_DM_DEADLINE = 2.0 # Seconds a kick or ban waits for its notice DM before going ahead
+MOD_DM_LOG_SIZE = 500 # Moderation DM outcomes remembered per guild for /dmlog
+AUDIT_FLUSH_INTERVAL = 2.0 # Seconds between audit log batch writes
+AUDIT_FLUSH_THRESHOLD = 500 # Buffered audit records that trigger an early write
+AUDIT_SEGMENT_BYTES = 8 * 1024 * 1024 # Compressed size at which the audit log starts a new segment file
+MODLOG_LIMIT = 15 # Actions shown by /modlog
+INVITE_POOL_USES = 25 # Handouts per pooled invite (also its max_uses on Discord)
+INVITE_POOL_LOW_WATER = 5 # Spare handouts below which a replacement invite is created in the background
+INVITE_POOL_REFILL_AHEAD = 300 # Seconds before a pooled invite becomes unusable that its replacement is made
+SOFTBAN_INVITE_AGE = 3600 # Max age of the rejoin invites sent with softbans
+SOFTBAN_INVITE_MIN_REMAINING = 900 # Seconds a softban rejoin link stays valid at least
+SOFTBAN_INVITE_USES = int(os.getenv('SOFTBAN_INVITE_USES', '1')) # Uses per softban rejoin link; above 1, softbanned members share links and can pass them on
+INVITE_DM_AGE = 86400 # Max age of the invites sent by /inviteuser and /massinvite
+INVITE_DM_MIN_REMAINING = 43200 # Seconds a DMed invite link stays valid at least
+TRUSTBOARD_PAGE_SIZE = 15 # Members per /trustboard page
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1') # Metrics endpoint stays local unless overridden
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) # Serve Prometheus metrics on this port; 0 disables the endpoint
+LOOP_LAG_INTERVAL = 0.5 # Seconds between event-loop lag samples
+COMMAND_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300) # Seconds
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1) # Seconds
+TRUST_FLUSH_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5) # Seconds
+USER_CACHE_SIZE = 50_000 # Fetched users kept by the lookup cache
+USER_CACHE_TTL = 3600.0 # Seconds a fetched user stays cached
+USER_CACHE_NEGATIVE_TTL = 600.0 # Seconds an unknown user ID stays cached
+BLOCK_COMPACT_EVERY = 1000 # Blocked-user log lines before folding them into the snapshot
+SHARD_COUNT = int(os.getenv('MODBOT_SHARD_COUNT', '0')) # Set by cluster.py for its workers; 0 runs one unsharded process
+SHARD_ID = int(os.getenv('MODBOT_SHARD_ID', '0'))
+STATE_SOCKET = os.getenv('MODBOT_STATE_SOCKET') # Unix socket of the cluster state service, if any
+CLUSTER_HEARTBEAT_INTERVAL = 5.0 # Seconds between worker health reports to the state service
+CLUSTER_REQUEST_TIMEOUT = 10.0 # Seconds a worker waits for the state service to answer
+SQLITE_BUSY_TIMEOUT = 30.0 # Seconds a trust.db writer waits while another worker holds the lock
+
+def get_token():
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, 'r') as f:
+            return f.read().strip()
+    return None
+
+TOKEN = get_token()
+
+TRUST_FILE = os.getenv('TRUST_FILE', os.path.join(DATA_DIR, TRUST_FILE_NAME))
+BLOCK_FILE = os.getenv('BLOCK_FILE', os.path.join(DATA_DIR, BLOCK_FILE_NAME))
+BLOCK_SNAPSHOT_FILE = os.path.splitext(BLOCK_FILE)[0] + '.bin'
+BLOCK_LOG_FILE = os.path.splitext(BLOCK_FILE)[0] + '.log'
+TRUST_DB = os.path.join(DATA_DIR, TRUST_DB_NAME)
+TRUST_DIR = os.path.join(DATA_DIR, 'trust_scores')
+DM_JOBS_DIR = os.path.join(DATA_DIR, 'dm_jobs')
+LOCKDOWN_FILE = os.path.join(DATA_DIR, 'lockdown_snapshots.json')
+COMMAND_SYNC_FILE = os.path.join(DATA_DIR, 'command_sync.json')
+AUTOMOD_FILE = os.path.join(DATA_DIR, 'automod_rules.json')
+AUDIT_DIR = os.path.join(DATA_DIR, 'audit_log')
+ANTIRAID_FILE = os.path.join(DATA_DIR, 'antiraid_guilds.json')
+
+def atomic_write_json(path, data):
+    """Writes JSON to a temp file next to `path` and renames it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def owns_guild(guild_id):
+    """Whether Discord routes `guild_id`'s events to this process's shard."""
+    return not SHARD_COUNT or (int(guild_id) >> 22) % SHARD_COUNT == SHARD_ID
+
+def write_guild_json(path, data):
+    """Writes a {guild_id: ...} file that every shard worker of a cluster shares.
+
+    Unsharded this is atomic_write_json. In a cluster each worker is only
+    authoritative for its own guilds, so under a file lock the file is re-read,
+    this shard's entries are replaced with those in `data` and every other
+    shard's entries are kept as they are.
+    """
+    if not SHARD_COUNT:
+        atomic_write_json(path, data)
+        return
+    import fcntl # Cluster mode is Unix-only (the state service is a Unix socket)
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    current = json.load(f)
+            except (OSError, ValueError):
+                pass
+        merged = {guild_id: value for guild_id, value in current.items() if not owns_guild(guild_id)}
+        merged.update((guild_id, value) for guild_id, value in data.items() if owns_guild(guild_id))
+        atomic_write_json(path, merged)
+
+class StartupTimer:
+    """Records how long each startup phase takes."""
+
+    def __init__(self):
+        self.phases = [("module init", time.perf_counter() - PROCESS_STARTED)]
+        self.reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        total = time.perf_counter() - PROCESS_STARTED
+        lines = [f"  {name:<24} {seconds * 1000:8.1f} ms" for name, seconds in self.phases]
+        return "Startup timing:\n" + "\n".join(lines) + f"\n  {'time to ready':<24} {total * 1000:8.1f} ms"
+
+# --- REST Scheduler ---
+
+REST_LANE = contextvars.ContextVar('rest_lane', default='interactive')
+
+class _PriorityGate:
+    """Semaphore that wakes waiters by lane priority (lower first), then FIFO."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were handed a slot just as we got cancelled; pass it on
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        while self.waiters and self.active < self.limit:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+class RestScheduler:
+    """Priority lanes for bot-initiated REST calls.
+
+    Calls run in the lane set by REST_LANE for the current task: 'interactive'
+    (the default, used by single moderation commands) or 'bulk' (mass actions).
+    Within a bucket (roughly Discord's per-route bucket, e.g. bans per guild), at
+    most `bucket_concurrency` calls run at once, and bulk calls yield to
+    interactive calls queued on the same bucket. Other buckets are unaffected.
+    """
+
+    LANES = ('interactive', 'bulk')
+
+    def __init__(self, bucket_concurrency=REST_BUCKET_CONCURRENCY):
+        self.bucket_concurrency = bucket_concurrency
+        self.gates = {}
+        self.metrics = {lane: {"depth": 0, "max_depth": 0, "calls": 0, "errors": 0, "total_wait": 0.0, "max_wait": 0.0} for lane in self.LANES}
+
+    @contextlib.contextmanager
+    def lane(self, lane):
+        """Runs everything awaited inside the block (and tasks it spawns) in `lane`."""
+        token = REST_LANE.set(lane)
+        try:
+            yield
+        finally:
+            REST_LANE.reset(token)
+
+    async def call(self, bucket, func, *args, **kwargs):
+        """Awaits `func(*args, **kwargs)` once its lane and bucket allow it."""
+        lane = REST_LANE.get()
+        metrics = self.metrics[lane]
+        interactive = lane == 'interactive'
+        enqueued = time.monotonic()
+        metrics["depth"] += 1
+        metrics["max_depth"] = max(metrics["max_depth"], metrics["depth"])
+        gate = self.gates.get(bucket)
+        if gate is None:
+            gate = self.gates[bucket] = _PriorityGate(self.bucket_concurrency)
+        acquired = False
+        try:
+            await gate.acquire(0 if interactive else 1)
+            acquired = True
+            waited = time.monotonic() - enqueued
+            metrics["total_wait"] += waited
+            metrics["max_wait"] = max(metrics["max_wait"], waited)
+            metrics["depth"] -= 1
+            metrics["calls"] += 1
+            try:
+                return await func(*args, **kwargs)
+            except discord.HTTPException:
+                metrics["errors"] += 1
+                raise
+        finally:
+            if acquired:
+                gate.release()
+            else:
+                metrics["depth"] -= 1
+
+    def stats(self):
+        return {
+            lane: {
+                "queued": metrics["depth"],
+                "max_queued": metrics["max_depth"],
+                "calls": metrics["calls"],
+                "errors": metrics["errors"],
+                "avg_wait_ms": round(metrics["total_wait"] / metrics["calls"] * 1000, 1) if metrics["calls"] else 0.0,
+                "max_wait_ms": round(metrics["max_wait"] * 1000, 1),
+            }
+            for lane, metrics in self.metrics.items()
+        }
+
+rest = RestScheduler()
+
+# --- Metrics ---
+# Everything here is a counter bump or a bisect on the hot path; rendering to the
+# Prometheus text format only happens when the endpoint is scraped.
+
+COMMAND_NAME = contextvars.ContextVar('command_name', default='')
+
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus layout (cumulative on render)."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        sep = "," if labels else ""
+        for bound, count in zip(self.bounds + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+class _RateLimitLogHandler(logging.Handler):
+    """discord.py retries 429s internally and only logs them, so count the log lines."""
+
+    def __init__(self, metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith('We are being rate limited'):
+            self.metrics.rate_limited[COMMAND_NAME.get()] += 1
+
+class Metrics:
+    """Command latency and outcomes, REST calls and 429s per command, loop lag and trust flush time.
+
+    REST calls and 429s are attributed through COMMAND_NAME, which the command
+    tree sets for the task running a command (and every task it spawns). Calls
+    made outside any command are labelled command="".
+    """
+
+    def __init__(self):
+        self.commands = {} # name -> Histogram of seconds from receipt to completion
+        self.outcomes = Counter() # (name, outcome)
+        self.rest_calls = Counter() # command name -> requests sent
+        self.rate_limited = Counter() # command name -> 429s hit
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.max_loop_lag = 0.0
+        self.trust_flush = Histogram(TRUST_FLUSH_BUCKETS)
+        self.collectors = [] # (prefix, callable returning {name: number} or {label: {name: number}})
+        self._runner = None
+        self._lag_task = None
+
+    def observe_command(self, interaction, outcome):
+        started = interaction.extras.get('metrics_started')
+        if started is None:
+            return
+        name = interaction.command.qualified_name if interaction.command else interaction.data.get('name', '')
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram(COMMAND_LATENCY_BUCKETS)
+        histogram.observe(time.perf_counter() - started)
+        self.outcomes[name, outcome] += 1
+
+    def instrument(self, client):
+        """Counts every REST request the client's HTTP session sends."""
+        request = client.http.request
+
+        async def counted_request(*args, **kwargs):
+            self.rest_calls[COMMAND_NAME.get()] += 1
+            return await request(*args, **kwargs)
+
+        client.http.request = counted_request
+        logging.getLogger('discord.http').addHandler(_RateLimitLogHandler(self))
+
+    def add_collector(self, prefix, collect):
+        self.collectors.append((prefix, collect))
+
+    async def watch_loop_lag(self, interval=LOOP_LAG_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag.observe(lag)
+            self.max_loop_lag = max(self.max_loop_lag, lag)
+
+    def render(self):
+        lines = [
+            "# TYPE modbot_command_duration_seconds histogram",
+            *(line for name, histogram in sorted(self.commands.items())
+              for line in histogram.render("modbot_command_duration_seconds", f'command="{name}"')),
+            "# TYPE modbot_command_total counter",
+            *(f'modbot_command_total{{command="{name}",outcome="{outcome}"}} {count}' for (name, outcome), count in sorted(self.outcomes.items())),
+            "# TYPE modbot_rest_requests_total counter",
+            *(f'modbot_rest_requests_total{{command="{name}"}} {count}' for name, count in sorted(self.rest_calls.items())),
+            "# TYPE modbot_rest_rate_limited_total counter",
+            *(f'modbot_rest_rate_limited_total{{command="{name}"}} {count}' for name, count in sorted(self.rate_limited.items())),
+            "# TYPE modbot_event_loop_lag_seconds histogram",
+            *self.loop_lag.render("modbot_event_loop_lag_seconds"),
+            "# TYPE modbot_event_loop_lag_max_seconds gauge",
+            f"modbot_event_loop_lag_max_seconds {self.max_loop_lag}",
+            "# TYPE modbot_trust_flush_seconds histogram",
+            *self.trust_flush.render("modbot_trust_flush_seconds"),
+        ]
+        for prefix, collect in self.collectors:
+            for key, value in collect().items():
+                if isinstance(value, dict):
+                    # Nested stats become one labelled series per inner key
+                    lines.extend(f'modbot_{prefix}_{name}{{{prefix}="{key}"}} {number}' for name, number in value.items() if isinstance(number, (int, float)))
+                elif isinstance(value, (int, float)):
+                    lines.append(f"modbot_{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self._lag_task = asyncio.create_task(self.watch_loop_lag())
+        if not port:
+            return
+        app = web.Application()
+
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = Metrics()
+
+class InstrumentedTree(app_commands.CommandTree):
+    """Command tree that times every slash command and labels its REST calls."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Runs inside the task that invokes the command, so the context var covers it
+        if interaction.type is discord.InteractionType.application_command:
+            COMMAND_NAME.set(interaction.data.get('name', ''))
+            interaction.extras['metrics_started'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        metrics.observe_command(interaction, "denied" if isinstance(error, app_commands.CheckFailure) else "error")
+        # Hand the error to the bot's on_app_command_error listener
+        self.client.dispatch('app_command_error', interaction, error)
+
+# --- Trust Storage Backends ---
+# Backends run inside a worker thread (see TrustStore), never on the event loop.
+# Scores are partitioned by guild. Scores recorded before guild scoping live under
+# LEGACY_GUILD_ID and are looked up per user while a guild has no score of its own.
+
+class JsonTrustBackend:
+    """Current scores only, one JSON file per guild. No history."""
+
+    supports_history = False
+    needs_full_shard = True
+
+    def __init__(self, directory, legacy_json_path=None):
+        self.directory = directory
+        self.legacy_json_path = legacy_json_path
+        self.has_legacy = bool(legacy_json_path and os.path.exists(legacy_json_path))
+        self._legacy = None
+
+    def _guild_path(self, guild_id):
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def load_guild(self, guild_id):
+        path = self._guild_path(guild_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def legacy_score(self, user_id):
+        if self._legacy is None:
+            # Parsed once; this file stops growing once scores are scoped per guild
+            with open(self.legacy_json_path, 'r') as f:
+                self._legacy = json.load(f)
+        return self._legacy.get(user_id)
+
+    def persist(self, shards, events):
+        os.makedirs(self.directory, exist_ok=True)
+        for guild_id, scores in shards.items():
+            atomic_write_json(self._guild_path(guild_id), scores)
+
+    def close(self):
+        pass
+
+class SqliteTrustBackend:
+    """Append-only trust event log plus a materialized current-score table."""
+
+    supports_history = True
+    needs_full_shard = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS trust_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            reason TEXT,
+            moderator_id INTEGER,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_trust_events_user ON trust_events (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_trust_events_guild_user ON trust_events (guild_id, user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_trust_events_time ON trust_events (created_at);
+        CREATE TABLE IF NOT EXISTS trust_scores (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self.has_legacy = False
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        # Cluster workers share this file; a writer waits for another's transaction instead of failing
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self.conn:
+            self._migrate_unscoped_table()
+            self.conn.executescript(self.SCHEMA)
+            self._migrate_json()
+            self.has_legacy = self.conn.execute("SELECT 1 FROM trust_scores WHERE guild_id = ? LIMIT 1", (LEGACY_GUILD_ID,)).fetchone() is not None
+
+    def _migrate_unscoped_table(self):
+        """Moves scores from the pre-guild-scoping table layout under LEGACY_GUILD_ID."""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(trust_scores)")]
+        if columns and "guild_id" not in columns:
+            self.conn.execute("ALTER TABLE trust_scores RENAME TO trust_scores_unscoped")
+            self.conn.executescript(self.SCHEMA)
+            self.conn.execute(
+                "INSERT INTO trust_scores (guild_id, user_id, score, updated_at) "
+                "SELECT ?, user_id, score, updated_at FROM trust_scores_unscoped",
+                (LEGACY_GUILD_ID,)
+            )
+            self.conn.execute("DROP TABLE trust_scores_unscoped")
+            self.conn.execute("UPDATE trust_events SET guild_id = ? WHERE guild_id IS NULL", (LEGACY_GUILD_ID,))
+
+    def _migrate_json(self):
+        """Imports the old trust_scores.json the first time the database is opened."""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        if self.legacy_json_path and os.path.exists(self.legacy_json_path):
+            with open(self.legacy_json_path, 'r') as f:
+                legacy = json.load(f)
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO trust_scores (guild_id, user_id, score, updated_at) VALUES (?, ?, ?, ?)",
+                [(LEGACY_GUILD_ID, int(user_id), score, now) for user_id, score in legacy.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO trust_events (guild_id, user_id, delta, score, reason, moderator_id, created_at) VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                [(LEGACY_GUILD_ID, int(user_id), score - 100, score, "Imported from trust_scores.json", now) for user_id, score in legacy.items()]
+            )
+            print(f"Migrated {len(legacy)} trust scores from {self.legacy_json_path}.")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+
+    def load_guild(self, guild_id):
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id, score FROM trust_scores WHERE guild_id = ?", (guild_id,)).fetchall()
+        return {str(user_id): score for user_id, score in rows}
+
+    def legacy_score(self, user_id):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT score FROM trust_scores WHERE guild_id = ? AND user_id = ?", (LEGACY_GUILD_ID, int(user_id))
+            ).fetchone()
+        return row[0] if row else None
+
+    def persist(self, shards, events):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO trust_events (guild_id, user_id, delta, score, reason, moderator_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(e["guild_id"], int(e["user_id"]), e["delta"], e["score"], e["reason"], e["moderator_id"], e["created_at"]) for e in events]
+            )
+            self.conn.executemany(
+                "INSERT INTO trust_scores (guild_id, user_id, score, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET score = excluded.score, updated_at = excluded.updated_at",
+                [(guild_id, int(user_id), score, now) for guild_id, scores in shards.items() for user_id, score in scores.items() if score is not None]
+            )
+            self.conn.executemany(
+                "DELETE FROM trust_scores WHERE guild_id = ? AND user_id = ?",
+                [(guild_id, int(user_id)) for guild_id, scores in shards.items() for user_id, score in scores.items() if score is None]
+            )
+
+    def history(self, guild_id, user_id, limit=10):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT guild_id, delta, score, reason, moderator_id, created_at FROM trust_events "
+                "WHERE guild_id IN (?, ?) AND user_id = ? ORDER BY created_at DESC LIMIT ?",
+                (LEGACY_GUILD_ID, guild_id, int(user_id), limit)
+            ).fetchall()
+
+    def dropped_below(self, guild_id, threshold, since, limit=25):
+        """Users whose score crossed from >= threshold to below it after `since`."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT user_id, MIN(score), MAX(created_at) FROM trust_events "
+                "WHERE created_at >= ? AND guild_id = ? AND score < ? AND score - delta >= ? "
+                "GROUP BY user_id ORDER BY MAX(created_at) DESC LIMIT ?",
+                (since, guild_id, threshold, threshold, limit)
+            ).fetchall()
+
+    def close(self):
+        if self.conn is not None:
+            with self._lock:
+                self.conn.close()
+            self.conn = None
+
+def make_trust_backend():
+    if TRUST_BACKEND == 'json':
+        return JsonTrustBackend(TRUST_DIR, legacy_json_path=TRUST_FILE)
+    return SqliteTrustBackend(TRUST_DB, legacy_json_path=TRUST_FILE)
+
+def clamp_score(score):
+    return max(0, min(100, int(score)))
+
+class ScoreIndex:
+    """Per-guild counts and member sets for each score from 0 to 100.
+
+    Kept in step with a partition by TrustStore. With only 101 possible scores,
+    histograms, percentiles and the mean are O(1) and bottom-N is O(N). Members
+    without a stored score sit at the default of 100 and are not indexed.
+    """
+
+    __slots__ = ('buckets', 'total', 'score_sum')
+
+    def __init__(self, scores=()):
+        self.buckets = [set() for _ in range(101)]
+        self.total = 0
+        self.score_sum = 0
+        for user_id, score in scores:
+            self.add(user_id, score)
+
+    def add(self, user_id, score):
+        self.buckets[score].add(user_id)
+        self.total += 1
+        self.score_sum += score
+
+    def move(self, user_id, old, new):
+        if old is None:
+            self.add(user_id, new)
+            return
+        self.buckets[old].discard(user_id)
+        self.buckets[new].add(user_id)
+        self.score_sum += new - old
+
+    def remove(self, user_id, score):
+        if user_id in self.buckets[score]:
+            self.buckets[score].discard(user_id)
+            self.total -= 1
+            self.score_sum -= score
+
+    def lowest(self, offset=0, limit=10):
+        """(user_id, score) pairs from the lowest score up, skipping `offset`. Ties are in no set order."""
+        results = []
+        for score, bucket in enumerate(self.buckets):
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            for user_id in itertools.islice(bucket, offset, offset + limit - len(results)):
+                results.append((user_id, score))
+            offset = 0
+            if len(results) >= limit:
+                break
+        return results
+
+    def count_below(self, threshold):
+        return sum(len(bucket) for bucket in self.buckets[:max(0, min(101, threshold))])
+
+    def percentile(self, p):
+        """Lowest score at or below which `p` percent of indexed members fall."""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for score, bucket in enumerate(self.buckets):
+            seen += len(bucket)
+            if seen >= rank:
+                return score
+        return 100
+
+    def histogram(self, width=10):
+        """Counts per `width`-point band; the last band includes 100."""
+        bands = [0] * math.ceil(100 / width)
+        for score, bucket in enumerate(self.buckets):
+            bands[min(score // width, len(bands) - 1)] += len(bucket)
+        return bands
+
+    @property
+    def mean(self):
+        return self.score_sum / self.total if self.total else None
+
+class TrustStore:
+    """Guild-partitioned trust scores with lazy loading and write-behind persistence.
+
+    Each guild's partition is loaded from the backend on first access and kept in
+    an LRU. Clean partitions are evicted once they sit idle for `idle_seconds` or
+    when resident entries exceed `max_entries`.
+
+    Updates only mark entries dirty. A background task coalesces them and hands
+    them to the backend in a worker thread every `flush_interval` seconds, or
+    sooner once `flush_threshold` writes are pending.
+    """
+
+    def __init__(self, backend, flush_interval=TRUST_FLUSH_INTERVAL, flush_threshold=TRUST_FLUSH_THRESHOLD,
+                 max_entries=None, idle_seconds=TRUST_SHARD_IDLE_SECONDS):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_entries = max_entries or int(TRUST_CACHE_MAX_MB * 1024 * 1024 / TRUST_ENTRY_BYTES)
+        self.idle_seconds = idle_seconds
+        self.shards = OrderedDict() # guild_id -> {user_id: score}, least recently used first
+        self.indexes = {} # guild_id -> ScoreIndex over that partition
+        self.last_used = {}
+        self.resident_entries = 0
+        self.dirty = {} # guild_id -> set of user_ids
+        self.legacy = OrderedDict() # user_id -> legacy score or None, least recently used first
+        self.flushing = set() # guild_ids whose writes are being persisted right now
+        self.events = []
+        self._loading = {}
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+        # Counters
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.shard_loads = 0
+        self.shard_evictions = 0
+
+    def open(self):
+        if hasattr(self.backend, 'open'):
+            self.backend.open()
+
+    async def shard(self, guild_id: int):
+        """Returns the resident partition for a guild, loading it if needed."""
+        shard = self.shards.get(guild_id)
+        if shard is not None:
+            self.shards.move_to_end(guild_id)
+            self.last_used[guild_id] = time.monotonic()
+            return shard
+        # Merge concurrent first accesses into one backend load
+        loading = self._loading.get(guild_id)
+        if loading is None:
+            loading = asyncio.ensure_future(asyncio.to_thread(self.backend.load_guild, guild_id))
+            self._loading[guild_id] = loading
+            try:
+                shard = await loading
+            finally:
+                del self._loading[guild_id]
+            self.shards[guild_id] = shard
+            self.indexes[guild_id] = ScoreIndex((user_id, clamp_score(score)) for user_id, score in shard.items())
+            self.last_used[guild_id] = time.monotonic()
+            self.resident_entries += len(shard)
+            self.shard_loads += 1
+            # The caller is about to use this partition, so it must survive the cap
+            self._enforce_cap(pinned=guild_id)
+            return shard
+        await asyncio.shield(loading)
+        return await self.shard(guild_id)
+
+    async def legacy_score(self, user_id: str):
+        """The user's score from before guild scoping, or None. Only read while a guild has no score of its own."""
+        if not self.backend.has_legacy:
+            return None
+        if user_id in self.legacy:
+            self.legacy.move_to_end(user_id)
+            return self.legacy[user_id]
+        score = await asyncio.to_thread(self.backend.legacy_score, user_id)
+        self.legacy[user_id] = score
+        if len(self.legacy) > TRUST_LEGACY_CACHE_ENTRIES:
+            self.legacy.popitem(last=False)
+        return score
+
+    async def get(self, guild_id: int, user_id: str, default: int = 100):
+        shard = await self.shard(guild_id)
+        score = shard.get(user_id)
+        if score is None:
+            score = await self.legacy_score(user_id)
+        return default if score is None else score
+
+    async def set(self, guild_id: int, user_id: str, score: int, reason: str = None, moderator_id: int = None):
+        shard = await self.shard(guild_id)
+        fallback = 100
+        if user_id not in shard:
+            legacy = await self.legacy_score(user_id)
+            fallback = 100 if legacy is None else legacy
+            # The lookup may have yielded long enough for the partition to be evicted
+            shard = await self.shard(guild_id)
+        previous = shard.get(user_id)
+        delta = score - (fallback if previous is None else previous)
+        if previous is None:
+            self.resident_entries += 1
+        shard[user_id] = score
+        self.indexes[guild_id].move(user_id, None if previous is None else clamp_score(previous), clamp_score(score))
+        self._log(guild_id, user_id, delta, score, reason, moderator_id)
+
+    async def clear(self, guild_id: int, user_id: str, reason: str = None, moderator_id: int = None):
+        """Deletes a member's score in a guild, putting them back at the default of 100."""
+        legacy = await self.legacy_score(user_id)
+        if legacy is not None and legacy != 100:
+            # Without a row of its own the guild would fall back to the legacy score
+            await self.set(guild_id, user_id, 100, reason, moderator_id)
+            return
+        shard = await self.shard(guild_id)
+        previous = shard.pop(user_id, None)
+        if previous is None:
+            return
+        self.resident_entries -= 1
+        self.indexes[guild_id].remove(user_id, clamp_score(previous))
+        self._log(guild_id, user_id, 100 - previous, 100, reason, moderator_id)
+
+    def _log(self, guild_id, user_id, delta, score, reason, moderator_id):
+        self.events.append({
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "delta": delta,
+            "score": score,
+            "reason": reason,
+            "moderator_id": moderator_id,
+            "created_at": time.time(),
+        })
+        self._mark_dirty(guild_id, user_id)
+
+    def _mark_dirty(self, guild_id: int, user_id: str):
+        self.writes += 1
+        dirty = self.dirty.setdefault(guild_id, set())
+        if user_id in dirty:
+            self.coalesced += 1
+        dirty.add(user_id)
+        if len(self.events) >= self.flush_threshold:
+            self._wake.set()
+
+    def _drop_shard(self, guild_id: int):
+        shard = self.shards.pop(guild_id)
+        self.indexes.pop(guild_id, None)
+        self.last_used.pop(guild_id, None)
+        self.resident_entries -= len(shard)
+        self.shard_evictions += 1
+
+    def _enforce_cap(self, pinned=None):
+        """Evicts clean least-recently-used partitions until under the entry cap.
+
+        `pinned`, dirty and flushing partitions are never evicted; when only those
+        remain, the store stays over the cap until a flush makes some clean.
+        """
+        if self.resident_entries <= self.max_entries:
+            return
+        for guild_id in list(self.shards):
+            if self.resident_entries <= self.max_entries:
+                break
+            if guild_id != pinned and guild_id not in self.dirty and guild_id not in self.flushing:
+                self._drop_shard(guild_id)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for guild_id in list(self.shards):
+            if self.last_used.get(guild_id, 0) < cutoff and guild_id not in self.dirty and guild_id not in self.flushing:
+                self._drop_shard(guild_id)
+
+    @property
+    def pending_writes(self):
+        return len(self.events)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Trust store flush failed: {e}")
+            self._evict_idle()
+            self._enforce_cap()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.dirty and not self.events:
+                return
+            dirty, events = self.dirty, self.events
+            self.dirty, self.events = {}, []
+            # Partitions stay resident until persisted, or a reload could read stale scores
+            self.flushing = set(dirty)
+            # Snapshot on the loop so the worker thread never sees a dict mid-update
+            if self.backend.needs_full_shard:
+                shards = {guild_id: dict(self.shards[guild_id]) for guild_id in dirty}
+            else:
+                # None marks a score deleted by clear()
+                shards = {guild_id: {user_id: self.shards[guild_id].get(user_id) for user_id in users} for guild_id, users in dirty.items()}
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.backend.persist, shards, events)
+            except Exception:
+                self.flush_failures += 1
+                for guild_id, users in dirty.items():
+                    self.dirty.setdefault(guild_id, set()).update(users)
+                self.events = events + self.events
+                raise
+            finally:
+                self.flushing = set()
+            elapsed = (time.perf_counter() - started) * 1000
+            metrics.trust_flush.observe(elapsed / 1000)
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+
+    async def index(self, guild_id: int):
+        """The score index for a guild's partition, loading it if needed."""
+        await self.shard(guild_id)
+        return self.indexes[guild_id]
+
+    async def history(self, guild_id: int, user_id: str, limit: int = 10):
+        await self.flush()
+        return await asyncio.to_thread(self.backend.history, guild_id, user_id, limit)
+
+    async def dropped_below(self, guild_id: int, threshold: int, since: float, limit: int = 25):
+        await self.flush()
+        return await asyncio.to_thread(self.backend.dropped_below, guild_id, threshold, since, limit)
+
+    async def close(self):
+        if self._task is not None:
+            # Let the loop finish its pass; wait_for can swallow a cancel that lands as the wake fires
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self.backend.close()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "pending_writes": self.pending_writes,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "resident_guilds": len(self.shards),
+            "resident_entries": self.resident_entries,
+            "max_entries": self.max_entries,
+            "shard_loads": self.shard_loads,
+            "shard_evictions": self.shard_evictions,
+        }
+
+# --- Blocked User Registry ---
+
+class BlockRegistry:
+    """Users who opted out of invite DMs.
+
+    Membership is a set of ints. On disk, a compact snapshot of packed uint64 IDs
+    is followed by an append-only log with one ID per line. Each block appends a
+    single line, and the log is folded into the snapshot once it grows past
+    `compact_every` lines.
+    """
+
+    def __init__(self, snapshot_path, log_path, legacy_json_path=None, compact_every=BLOCK_COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.legacy_json_path = legacy_json_path
+        self.compact_every = compact_every
+        self._ids = set()
+        self._log_lines = 0
+        self._lock = asyncio.Lock()
+
+    def load(self):
+        ids = array('Q')
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                ids.frombytes(f.read())
+        elif self.legacy_json_path and os.path.exists(self.legacy_json_path):
+            try:
+                with open(self.legacy_json_path, 'r') as f:
+                    ids.extend(int(uid) for uid in json.load(f))
+            except (OSError, ValueError):
+                pass
+        self._ids = set(ids)
+        self._log_lines = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.isdigit():
+                        self._ids.add(int(line))
+                        self._log_lines += 1
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def contains_many(self, user_ids):
+        """Returns the subset of `user_ids` (as ints) that are blocked."""
+        return self._ids.intersection(map(int, user_ids))
+
+    async def add(self, user_id):
+        """Blocks a user. Returns False if they were already blocked."""
+        user_id = int(user_id)
+        async with self._lock:
+            if user_id in self._ids:
+                return False
+            self._ids.add(user_id)
+            await asyncio.to_thread(self._append, user_id)
+            self._log_lines += 1
+            if self._log_lines >= self.compact_every:
+                await self._compact()
+        return True
+
+    def _append(self, user_id):
+        with open(self.log_path, 'a') as f:
+            f.write(f"{user_id}\n")
+
+    async def compact(self):
+        async with self._lock:
+            await self._compact()
+
+    async def _compact(self):
+        snapshot = array('Q', self._ids)
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        self._log_lines = 0
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            snapshot.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Everything in the log is now in the snapshot
+        open(self.log_path, 'w').close()
+
+# --- Cluster State ---
+# cluster.py runs one worker process per shard. Discord pins each guild to a shard,
+# so per-guild state (trust, lockdowns, automod) stays with the worker that owns
+# the guild. Blocked users are global and anti-raid switches must survive a guild
+# moving shards, so both live in StateService and every worker keeps a copy that
+# the service pushes changes into.
+
+class StateServiceError(Exception):
+    pass
+
+class StateService:
+    """Unix-socket JSON-lines server for the state shared by a cluster's workers.
+
+    Requests are {"id": n, "op": ...} lines answered with {"id": n, "result": ...}
+    or {"id": n, "error": ...}; requests without an id get no answer. Changes are
+    pushed to every connected worker as {"event": ...} lines, and workers' health
+    heartbeats are kept for the launcher.
+    """
+
+    SNAPSHOT_CHUNK = 2000 # Blocked IDs per snapshot line, well under the stream line limit
+
+    def __init__(self, path, blocked: BlockRegistry, antiraid_path=ANTIRAID_FILE):
+        self.path = path
+        self.blocked = blocked
+        self.antiraid_path = antiraid_path
+        self.antiraid = set() # guild_ids with /antiraid switched on
+        self.health = {} # shard_id -> last heartbeat stats plus "received" (unix time)
+        self.writers = set()
+        self._server = None
+
+    def load(self):
+        self.blocked.load()
+        if os.path.exists(self.antiraid_path):
+            with open(self.antiraid_path, 'r') as f:
+                self.antiraid = set(json.load(f))
+
+    async def start(self):
+        self.load()
+        if os.path.exists(self.path):
+            # Left behind by a launcher that did not shut down cleanly
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.blocked.compact()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    def broadcast(self, message):
+        line = json.dumps(message, separators=(',', ':')).encode() + b"\n"
+        for writer in self.writers:
+            writer.write(line)
+
+    async def _serve(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                try:
+                    result = await self._dispatch(message, writer)
+                    reply = {"id": message.get("id"), "result": result}
+                except Exception as e:
+                    reply = {"id": message.get("id"), "error": f"{type(e).__name__}: {e}"}
+                if message.get("id") is not None:
+                    writer.write(json.dumps(reply, separators=(',', ':')).encode() + b"\n")
+                    await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, message, writer):
+        op = message.get("op")
+        if op == "hello":
+            # Stream the blocked list ahead of the reply so the worker is in sync once hello returns
+            ids = list(self.blocked)
+            for start in range(0, len(ids), self.SNAPSHOT_CHUNK):
+                writer.write(json.dumps({"event": "blocked", "user_ids": ids[start:start + self.SNAPSHOT_CHUNK]}, separators=(',', ':')).encode() + b"\n")
+                await writer.drain()
+            return {"antiraid": sorted(self.antiraid)}
+        if op == "block":
+            user_id = int(message["user_id"])
+            added = await self.blocked.add(user_id)
+            if added:
+                self.broadcast({"event": "blocked", "user_ids": [user_id]})
+            return {"added": added}
+        if op == "antiraid":
+            guild_id = int(message["guild_id"])
+            if message["enabled"]:
+                self.antiraid.add(guild_id)
+            else:
+                self.antiraid.discard(guild_id)
+            await asyncio.to_thread(atomic_write_json, self.antiraid_path, sorted(self.antiraid))
+            self.broadcast({"event": "antiraid", "guild_id": guild_id, "enabled": bool(message["enabled"])})
+            return {}
+        if op == "health":
+            self.health[int(message["shard_id"])] = dict(message["stats"], received=time.time())
+            return None
+        if op == "status":
+            return self.status()
+        raise StateServiceError(f"unknown op {op!r}")
+
+    def status(self):
+        return {
+            "workers": len(self.writers),
+            "blocked_users": len(self.blocked),
+            "antiraid_guilds": len(self.antiraid),
+            "shards": {str(shard_id): stats for shard_id, stats in sorted(self.health.items())},
+        }
+
+class StateClient:
+    """A shard worker's connection to StateService.
+
+    Keeps `blocked` and the raid detector's manual switches in step with the
+    service's pushes, sends a health heartbeat, and reconnects (re-syncing from a
+    fresh snapshot) if the service goes away.
+    """
+
+    def __init__(self, client, path, shard_id=SHARD_ID):
+        self.client = client
+        self.path = path
+        self.shard_id = shard_id
+        self.mode = "gateway" # Shown as the state until the shard is ready; cluster.py --offline sets "offline"
+        self.blocked = set()
+        self.reconnects = 0
+        self._writer = None
+        self._pending = {} # request id -> Future
+        self._ids = itertools.count(1)
+        self._reader_task = None
+        self._heartbeat_task = None
+        self._reconnect_task = None
+        self._closing = False
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._reader_task = asyncio.create_task(self._read(reader))
+        hello = await self.request("hello", shard_id=self.shard_id)
+        detector = self.client.raid_detector
+        switched_on = set(hello["antiraid"])
+        for guild_id in detector.manual - switched_on:
+            detector.set_manual(guild_id, False)
+        for guild_id in switched_on:
+            detector.set_manual(guild_id, True)
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def close(self):
+        self._closing = True
+        for task in (self._heartbeat_task, self._reconnect_task):
+            if task is not None:
+                task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+
+    def _send(self, message):
+        self._writer.write(json.dumps(message, separators=(',', ':')).encode() + b"\n")
+
+    async def request(self, op, **fields):
+        if self._writer is None:
+            raise ConnectionError("Not connected to the cluster state service")
+        request_id = next(self._ids)
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        self._send(dict(fields, id=request_id, op=op))
+        try:
+            return await asyncio.wait_for(future, CLUSTER_REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def notify(self, op, **fields):
+        """Sends a request that gets no answer. Dropped while disconnected."""
+        if self._writer is not None:
+            self._send(dict(fields, op=op))
+
+    async def _read(self, reader):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if "event" in message:
+                    self._apply(message)
+                    continue
+                future = self._pending.get(message["id"])
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(StateServiceError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the cluster state service"))
+            if not self._closing and (self._reconnect_task is None or self._reconnect_task.done()):
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    def _apply(self, message):
+        if message["event"] == "blocked":
+            self.blocked.update(message["user_ids"])
+        elif message["event"] == "antiraid":
+            self.client.raid_detector.set_manual(message["guild_id"], message["enabled"])
+
+    async def _reconnect(self):
+        delay = 1.0
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                await self.connect()
+                self.reconnects += 1
+                print("Reconnected to the cluster state service.")
+                return
+            except (OSError, asyncio.TimeoutError, StateServiceError):
+                delay = min(delay * 2, 30.0)
+
+    def health(self):
+        client = self.client
+        latency = client.latency
+        trust = client.trust.stats()
+        return {
+            "pid": os.getpid(),
+            "mode": self.mode,
+            "ready": client.is_ready(),
+            "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None,
+            "guilds": len(client.guilds),
+            "commands": sum(metrics.outcomes.values()),
+            "rate_limited": sum(metrics.rate_limited.values()),
+            "loop_lag_max_ms": round(metrics.max_loop_lag * 1000, 1),
+            "trust_pending": trust["pending_writes"],
+            "uptime": round(time.perf_counter() - PROCESS_STARTED),
+        }
+
+    async def _heartbeat(self):
+        while True:
+            self.notify("health", shard_id=self.shard_id, stats=self.health())
+            await asyncio.sleep(CLUSTER_HEARTBEAT_INTERVAL)
+
+class SharedBlockRegistry:
+    """BlockRegistry's interface, backed by the cluster state service.
+
+    Lookups use the worker's synced copy. Blocks go through the service, which
+    persists them and pushes them to every worker.
+    """
+
+    def __init__(self, state: StateClient):
+        self.state = state
+
+    def load(self):
+        # StateClient.connect() has already streamed the snapshot in
+        pass
+
+    def __contains__(self, user_id):
+        return int(user_id) in self.state.blocked
+
+    def __len__(self):
+        return len(self.state.blocked)
+
+    def contains_many(self, user_ids):
+        return self.state.blocked.intersection(map(int, user_ids))
+
+    async def add(self, user_id):
+        result = await self.state.request("block", user_id=int(user_id))
+        self.state.blocked.add(int(user_id))
+        return result["added"]
+
+    async def compact(self):
+        # The service owns the files
+        pass
+
+# --- DM Dispatch ---
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds` (used on 429s)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+class DMDispatcher:
+    """Runs mass-DM jobs through bounded workers sharing one DM rate limit.
+
+    Each job is checkpointed to `directory` so a restarted bot resumes it where it
+    stopped. `position` marks the prefix of `targets` that is fully handled and
+    `done_ahead` holds IDs finished out of order past it, so no one is DMed twice.
+    """
+
+    def __init__(self, client, directory):
+        self.client = client
+        self.directory = directory
+        self.bucket = TokenBucket(DM_RATE_PER_SECOND, DM_BURST)
+        self.tasks = set()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def create_job(self, targets, message, requested_by, excluded=0, blocked=0):
+        return {
+            "id": f"{int(time.time() * 1000)}-{requested_by}",
+            "requested_by": requested_by,
+            "shard": SHARD_ID,
+            "message": message,
+            "targets": targets,
+            "position": 0,
+            "done_ahead": [],
+            "counters": {"sent": 0, "failed": 0, "blocked": blocked, "skipped": excluded},
+        }
+
+    def _save(self, job):
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write_json(self._path(job["id"]), job)
+
+    def resume(self):
+        """Restarts every job left unfinished by a previous run."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Cluster workers share the directory; each resumes only the jobs its shard started
+            if SHARD_COUNT and job.get("shard", 0) % SHARD_COUNT != SHARD_ID:
+                continue
+            print(f"Resuming DM job {job['id']} at {job['position']}/{len(job['targets'])}.")
+            task = asyncio.create_task(self._run_and_notify(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run_and_notify(self, job):
+        await self.run(job)
+        await self.notify_requester(job, format_dm_report(job))
+
+    async def notify_requester(self, job, content):
+        try:
+            user = await self.client.users_cache.get(job["requested_by"])
+            await rest.call("dm", user.send, content)
+        except discord.HTTPException:
+            pass
+
+    async def run(self, job, on_progress=None):
+        targets = job["targets"]
+        completed = set(job["done_ahead"])
+        queue = asyncio.Queue()
+        for uid in targets[job["position"]:]:
+            if uid not in completed:
+                queue.put_nowait(uid)
+        last_save = time.monotonic()
+        save_lock = asyncio.Lock()
+
+        async def checkpoint(force=False):
+            nonlocal last_save
+            while job["position"] < len(targets) and targets[job["position"]] in completed:
+                completed.discard(targets[job["position"]])
+                job["position"] += 1
+            if not force and time.monotonic() - last_save < DM_CHECKPOINT_INTERVAL:
+                return
+            if save_lock.locked() and not force:
+                return
+            async with save_lock:
+                last_save = time.monotonic()
+                job["done_ahead"] = list(completed)
+                # `targets` is never mutated, so the worker thread can share it
+                snapshot = dict(job, counters=dict(job["counters"]))
+                await asyncio.to_thread(self._save, snapshot)
+
+        async def worker():
+            while not queue.empty():
+                uid = queue.get_nowait()
+                outcome = await self.deliver(int(uid), job["message"])
+                job["counters"][outcome] += 1
+                completed.add(uid)
+                await checkpoint()
+                if on_progress:
+                    await on_progress(job)
+
+        await checkpoint(force=True)
+        with rest.lane("bulk"):
+            await asyncio.gather(*(worker() for _ in range(DM_WORKERS)))
+        await checkpoint(force=True)
+        await asyncio.to_thread(os.remove, self._path(job["id"]))
+        return job
+
+    async def deliver(self, user_id: int, content: str):
+        """Sends one invite DM. Returns the counter it belongs to."""
+        for attempt in range(DM_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                # create_dm only needs the ID, which saves the fetch_user round-trip
+                channel = await rest.call("dm", self.client.create_dm, discord.Object(id=user_id))
+                await rest.call("dm", channel.send, content, view=InviteView(user_id))
+                return "sent"
+            except (discord.Forbidden, discord.NotFound):
+                return "failed"
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+                    self.bucket.pause(float(retry_after or 5))
+                elif e.status >= 500:
+                    await asyncio.sleep(2 ** attempt)
+                else:
+                    return "failed"
+        return "failed"
+
+def format_dm_report(job):
+    counters = job["counters"]
+    return (
+        f"📊 **Mass Invite Report**\n"
+        f"✅ Sent: {counters['sent']}\n"
+        f"🚫 Failed (DMs off/Blocked): {counters['failed']}\n"
+        f"🛑 Already Blocked Bot: {counters['blocked']}\n"
+        f"⏭️ Skipped (Excluded): {counters['skipped']}"
+    )
+
+# --- Moderation DMs ---
+
+class ModerationOutbox:
+    """Sends moderation notices without holding up the action they describe.
+
+    `before_action` is for kicks and bans: it waits for the DM only until
+    MOD_DM_DEADLINE, because after the member leaves the guild the DM can no
+    longer be delivered anyway. `send` is for warnings and timeouts, where the
+    member stays reachable: it returns at once and retries in the background.
+    The last MOD_DM_LOG_SIZE outcomes per guild are kept for /dmlog.
+    """
+
+    def __init__(self, deadline=MOD_DM_DEADLINE, log_size=MOD_DM_LOG_SIZE):
+        self.deadline = deadline
+        self.log_size = log_size
+        self.logs = {} # guild_id -> deque of outcome records
+        self.counters = Counter()
+        self.tasks = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def before_action(self, member, kind: str, content: str):
+        """Starts the DM and waits up to the deadline. Returns True once delivered."""
+        task = self._spawn(self._deliver(member, kind, content, retry=False))
+        try:
+            # Shielded: on timeout the send keeps going and its outcome is still logged
+            return await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except asyncio.TimeoutError:
+            return False
+        except Exception as e:
+            # The notice is best effort; the moderation action goes ahead regardless
+            print(f"Moderation DM to {member} failed: {e}")
+            return False
+
+    def send(self, member, kind: str, content: str):
+        """Queues the DM with retries and returns immediately."""
+        self._spawn(self._deliver(member, kind, content, retry=True))
+
+    async def _deliver(self, member, kind, content, retry):
+        started = time.monotonic()
+        attempts = DM_MAX_ATTEMPTS if retry else 1
+        outcome = "failed"
+        for attempt in range(attempts):
+            try:
+                await rest.call("dm", member.send, content)
+                outcome = "sent"
+                break
+            except (discord.Forbidden, discord.NotFound):
+                outcome = "closed"
+                break
+            except discord.HTTPException as e:
+                if e.status == 429 or e.status >= 500:
+                    if attempt + 1 < attempts:
+                        retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+                        await asyncio.sleep(float(retry_after or 2 ** attempt))
+                    continue
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                # Connection trouble is retried like a 5xx and otherwise logged as failed
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(2 ** attempt)
+        elapsed = time.monotonic() - started
+        self.record(member.guild.id, member.id, kind, outcome, attempt + 1, elapsed)
+        return outcome == "sent"
+
+    def record(self, guild_id, user_id, kind, outcome, attempts, elapsed):
+        log = self.logs.get(guild_id)
+        if log is None:
+            log = self.logs[guild_id] = deque(maxlen=self.log_size)
+        # A kick/ban DM that lands after the deadline arrived after the action
+        late = outcome == "sent" and kind in ("kick", "ban", "softban", "autoban") and elapsed > self.deadline
+        log.append({
+            "time": time.time(), "user_id": user_id, "kind": kind,
+            "outcome": "late" if late else outcome, "attempts": attempts, "elapsed": elapsed,
+        })
+        self.counters["late" if late else outcome] += 1
+
+    def history(self, guild_id, user_id=None, limit=20):
+        """Newest first, optionally for one member."""
+        entries = reversed(self.logs.get(guild_id, ()))
+        if user_id is not None:
+            entries = (entry for entry in entries if entry["user_id"] == user_id)
+        return list(itertools.islice(entries, limit))
+
+    def stats(self):
+        return {"pending": len(self.tasks), **{key: self.counters[key] for key in ("sent", "late", "closed", "failed")}}
+
+# --- Invite Pool ---
+
+class _PooledInvite:
+    __slots__ = ('invite', 'expires', 'handed', 'budget')
+
+    def __init__(self, invite, expires, budget):
+        self.invite = invite
+        self.expires = expires # monotonic
+        self.handed = 0
+        self.budget = budget # 0: unlimited
+
+    def spare(self):
+        return None if not self.budget else self.budget - self.handed
+
+class InvitePool:
+    """Reuses invites per guild instead of creating one for every softban or invite DM.
+
+    A pooled invite has a max age and a use budget (also its max_uses on
+    Discord). Every handout counts against the budget, and an invite is only
+    handed out while it has at least `min_remaining` seconds left. When spare
+    handouts fall below `low_water`, a replacement is created in the background
+    so the next caller finds one ready. The first invite-capable channel per
+    guild is cached. Channel, role and bot-member changes clear that choice, and
+    deleted channels or revoked invites drop their pooled invites.
+    """
+
+    def __init__(self, uses=INVITE_POOL_USES, low_water=INVITE_POOL_LOW_WATER, refill_ahead=INVITE_POOL_REFILL_AHEAD):
+        self.uses = uses
+        self.low_water = low_water
+        self.refill_ahead = refill_ahead
+        self.channels = {} # guild_id -> channel_id the bot can create invites in
+        self.pools = {} # (guild_id, channel_id, max_age, uses) -> list of _PooledInvite
+        self.counters = Counter()
+        self._locks = {} # pool key -> Lock, so concurrent misses create one invite
+        self._refills = {} # pool key -> background refill task
+
+    def invite_channel(self, guild: discord.Guild):
+        channel = guild.get_channel(self.channels.get(guild.id, 0))
+        if channel is not None:
+            return channel
+        for channel in guild.text_channels:
+            if channel.permissions_for(guild.me).create_instant_invite:
+                self.channels[guild.id] = channel.id
+                return channel
+        return None
+
+    async def get(self, guild: discord.Guild, channel=None, *, max_age: int, min_remaining: float, uses: int = None, reason: str = None):
+        """An invite to `channel` (default: the guild's invite channel) valid for `min_remaining` more seconds.
+
+        Returns None when no channel allows invites. Raises discord.HTTPException
+        when a needed invite can't be created.
+        """
+        channel = channel or self.invite_channel(guild)
+        if channel is None:
+            return None
+        uses = self.uses if uses is None else uses
+        key = (guild.id, channel.id, max_age, uses)
+        entry = self._take(key, min_remaining)
+        if entry is not None:
+            self.counters["reused"] += 1
+        else:
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                entry = self._take(key, min_remaining)
+                if entry is None:
+                    entry = await self._create(channel, max_age, uses, reason)
+                    entry.handed += 1
+                    self.pools.setdefault(key, []).append(entry)
+                    self.counters["created"] += 1
+                else:
+                    self.counters["reused"] += 1
+        self._maybe_refill(key, channel, min_remaining)
+        return entry.invite
+
+    def _take(self, key, min_remaining):
+        entries = self.pools.get(key)
+        if not entries:
+            return None
+        now = time.monotonic()
+        entries[:] = [entry for entry in entries if entry.expires - now > min_remaining and entry.spare() != 0]
+        if not entries:
+            return None
+        # The invite closest to expiring goes first, so fresher ones last longer
+        entry = min(entries, key=lambda entry: entry.expires)
+        entry.handed += 1
+        return entry
+
+    async def _create(self, channel, max_age, uses, reason):
+        invite = await rest.call(f"channel:{channel.id}", channel.create_invite, max_age=max_age, max_uses=uses, unique=True, reason=reason or "Invite pool")
+        return _PooledInvite(invite, time.monotonic() + max_age, uses)
+
+    def _maybe_refill(self, key, channel, min_remaining):
+        task = self._refills.get(key)
+        if task is not None and not task.done():
+            return
+        horizon = time.monotonic() + min_remaining + self.refill_ahead
+        spare = 0
+        for entry in self.pools.get(key, ()):
+            if entry.expires > horizon:
+                spare += self.low_water if entry.spare() is None else entry.spare()
+        if spare >= self.low_water:
+            return
+        # Enough invites to get back to low_water handouts; single-use pools need several
+        count = math.ceil((self.low_water - spare) / key[3]) if key[3] else 1
+        self._refills[key] = asyncio.create_task(self._refill(key, channel, count))
+
+    async def _refill(self, key, channel, count=1):
+        for _ in range(count):
+            try:
+                with rest.lane("bulk"):
+                    pooled = await self._create(channel, key[2], key[3], "Invite pool refill")
+            except discord.HTTPException:
+                self.counters["refill_failures"] += 1
+                return
+            self.pools.setdefault(key, []).append(pooled)
+            self.counters["refills"] += 1
+
+    def forget_channel_choice(self, guild_id: int):
+        """Permissions may have changed; pick the invite channel again next time."""
+        if self.channels.pop(guild_id, None) is not None:
+            self.counters["invalidated"] += 1
+
+    def drop_channel(self, guild_id: int, channel_id: int):
+        if self.channels.get(guild_id) == channel_id:
+            del self.channels[guild_id]
+        for key in [key for key in self.pools if key[0] == guild_id and key[1] == channel_id]:
+            self.counters["invalidated"] += len(self.pools.pop(key))
+
+    def drop_invite(self, code: str):
+        for entries in self.pools.values():
+            before = len(entries)
+            entries[:] = [entry for entry in entries if entry.invite.code != code]
+            self.counters["invalidated"] += before - len(entries)
+
+    def drop_guild(self, guild_id: int):
+        self.channels.pop(guild_id, None)
+        for key in [key for key in self.pools if key[0] == guild_id]:
+            del self.pools[key]
+
+    def stats(self):
+        return {
+            "pooled": sum(len(entries) for entries in self.pools.values()),
+            "guild_channels": len(self.channels),
+            **{key: self.counters[key] for key in ("reused", "created", "refills", "refill_failures", "invalidated")},
+        }
+
+# --- Audit Log ---
+
+class AuditLog:
+    """Moderation actions as compressed, indexed segment files.
+
+    `record` only appends to an in-memory buffer; a background task writes the
+    buffer every AUDIT_FLUSH_INTERVAL seconds (sooner past AUDIT_FLUSH_THRESHOLD
+    records). Each write appends one gzip member of JSON lines to the current
+    segment, so a segment is a valid .gz file made of independently readable
+    batches. Next to it, a .idx file gets one line per batch: its byte range,
+    first and last timestamp, and the "guild" and "guild:user" keys it holds.
+    Queries read the indexes (kept in memory) and decompress only the batches
+    that mention the guild or member asked about. Segments rotate past
+    AUDIT_SEGMENT_BYTES.
+    """
+
+    def __init__(self, directory, interval=AUDIT_FLUSH_INTERVAL, threshold=AUDIT_FLUSH_THRESHOLD, segment_bytes=AUDIT_SEGMENT_BYTES):
+        self.directory = directory
+        self.interval = interval
+        self.threshold = threshold
+        self.segment_bytes = segment_bytes
+        # Cluster workers share the directory, so each writes its own segments
+        self.prefix = f"audit-shard{SHARD_ID}-" if SHARD_COUNT else "audit-"
+        self.buffer = []
+        self.in_flight = [] # The batch being written, still visible to queries
+        self.segments = [] # [{"path": str, "size": int, "batches": [index entry, ...]}], oldest first
+        self.records = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self._wake = asyncio.Event()
+        self._lock = threading.Lock() # Guards self.segments between the writer and query threads
+        self._write_lock = threading.Lock() # One writer thread at a time, whoever calls flush()
+        self._task = None
+        self._closing = False
+
+    def load(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".idx"):
+                continue
+            path = os.path.join(self.directory, name[:-4] + ".jsonl.gz")
+            index_path = os.path.join(self.directory, name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            batches, end, damaged = [], 0, False
+            with open(index_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        damaged = True
+                        break
+                    # Batches are contiguous; one past the end of the data was cut short by a crash
+                    if entry["offset"] != end or entry["offset"] + entry["length"] > size:
+                        damaged = True
+                        break
+                    end = entry["offset"] + entry["length"]
+                    batches.append(entry)
+            segment = {"path": path, "size": end, "batches": batches}
+            if (damaged or size != end) and self._owns(segment):
+                self._repair(segment, index_path)
+            for entry in batches:
+                entry["keys"] = set(entry["keys"])
+            self.segments.append(segment)
+
+    def _repair(self, segment, index_path):
+        """Cuts a segment back to its last complete batch so later appends line up with the index."""
+        with open(segment["path"], 'ab') as f:
+            f.truncate(segment["size"])
+        with open(f"{index_path}.tmp", 'w') as f:
+            f.writelines(json.dumps(entry, separators=(',', ':')) + "\n" for entry in segment["batches"])
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # Same as TrustStore.close: wake the writer and let it exit rather than cancel it
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def record(self, guild_id: int, action: str, user_id: Optional[int], moderator_id: Optional[int], reason: str = None, **details):
+        """Queues one action. The only cost on the command path."""
+        self.buffer.append({"time": time.time(), "guild_id": guild_id, "action": action, "user_id": user_id,
+                            "moderator_id": moderator_id, "reason": reason, **details})
+        if len(self.buffer) >= self.threshold:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            self._wake.clear()
+            try:
+                await self.flush()
+            except OSError as e:
+                print(f"Audit log write failed: {e}")
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        self.in_flight = batch
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except OSError:
+            # Keep the records for the next attempt
+            self.buffer[:0] = batch
+            raise
+        finally:
+            self.in_flight = []
+        self.records += len(batch)
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def _owns(self, segment):
+        return re.fullmatch(re.escape(self.prefix) + r"\d{6}\.jsonl\.gz", os.path.basename(segment["path"])) is not None
+
+    def _write(self, batch):
+        with self._write_lock:
+            self._append_batch(batch)
+
+    def _append_batch(self, batch):
+        os.makedirs(self.directory, exist_ok=True)
+        data = gzip.compress("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in batch).encode())
+        keys = set()
+        for record in batch:
+            keys.add(str(record["guild_id"]))
+            if record["user_id"] is not None:
+                keys.add(f"{record['guild_id']}:{record['user_id']}")
+        with self._lock:
+            own = [segment for segment in self.segments if self._owns(segment)]
+        segment = own[-1] if own else None
+        if segment is None or segment["size"] >= self.segment_bytes:
+            number = len(own)
+            segment = {"path": os.path.join(self.directory, f"{self.prefix}{number:06d}.jsonl.gz"), "size": 0, "batches": []}
+            with self._lock:
+                self.segments.append(segment)
+        with open(segment["path"], 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        entry = {"offset": offset, "length": len(data), "first": batch[0]["time"], "last": batch[-1]["time"], "count": len(batch), "keys": sorted(keys)}
+        with open(segment["path"][:-len(".jsonl.gz")] + ".idx", 'a') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        entry["keys"] = keys
+        with self._lock:
+            segment["batches"].append(entry)
+            segment["size"] = offset + len(data)
+            # Committed: from here on queries find these records on disk, not in memory
+            self.in_flight = []
+
+    async def query(self, guild_id: int, user_id: int = None, limit=20, since: float = 0.0):
+        """Newest actions in a guild, optionally against one member, newest first."""
+        key = str(guild_id) if user_id is None else f"{guild_id}:{user_id}"
+        # Memory and disk in one snapshot, so a batch committing in between is not returned twice
+        with self._lock:
+            pending = itertools.chain(reversed(self.buffer), reversed(self.in_flight))
+            matches = [record for record in pending if self._matches(record, guild_id, user_id, since)][:limit]
+            batches = [(segment["path"], entry) for segment in self.segments for entry in segment["batches"]]
+        if len(matches) < limit:
+            matches += await asyncio.to_thread(self._search, batches, key, guild_id, user_id, limit - len(matches), since)
+        return matches
+
+    @staticmethod
+    def _matches(record, guild_id, user_id, since):
+        return record["guild_id"] == guild_id and (user_id is None or record["user_id"] == user_id) and record["time"] >= since
+
+    def _search(self, batches, key, guild_id, user_id, limit, since):
+        # Segments from several cluster workers interleave in time
+        batches.sort(key=lambda item: item[1]["last"])
+        needle = f'"guild_id":{guild_id},' if user_id is None else f'"user_id":{user_id},'
+        needle = needle.encode()
+        found = []
+        for path, entry in reversed(batches):
+            if entry["last"] < since:
+                break
+            if key not in entry["keys"]:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(entry["offset"])
+                lines = gzip.decompress(f.read(entry["length"])).splitlines()
+            for line in reversed(lines):
+                # Cheap byte check first; batches from mass actions hold thousands of other members
+                if needle not in line:
+                    continue
+                record = json.loads(line)
+                if self._matches(record, guild_id, user_id, since):
+                    found.append(record)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self.buffer),
+                "records_written": self.records,
+                "flushes": self.flushes,
+                "segments": len(self.segments),
+                "bytes": sum(segment["size"] for segment in self.segments),
+                "last_flush_ms": round(self.last_flush_ms, 2),
+            }
+
+# --- Message Index ---
+
+class _UserMessages:
+    """Ring buffer of one member's recent messages as parallel uint64 arrays.
+
+    A message's timestamp is recovered from its snowflake, so it is not stored.
+    Deleted messages are tombstoned with ID 0.
+    """
+
+    __slots__ = ('channel_ids', 'message_ids', 'head', 'overflowed')
+
+    def __init__(self):
+        self.channel_ids = array('Q')
+        self.message_ids = array('Q')
+        self.head = 0 # Oldest slot once the ring is full
+        self.overflowed = False # A live message was overwritten, so older ones are missing
+
+    def newest(self):
+        """ID of the newest live message, or 0 when every slot is a tombstone."""
+        size = len(self.message_ids)
+        for step in range(1, size + 1):
+            message_id = self.message_ids[(self.head - step) % size]
+            if message_id:
+                return message_id
+        return 0
+
+class MessageIndex:
+    """Bounded in-process index of recent message IDs per (guild, member).
+
+    Fed by on_message and pruned by delete events. Each member keeps at most
+    `per_user` messages. Members are kept in least-recently-active order, so the
+    whole index is bounded by evicting the quietest members first, either past
+    `max_entries` or once their newest message is older than `max_age`.
+
+    The index only knows what it has seen since `started`; `covers` says whether
+    it holds every message a member posted after a given time.
+    """
+
+    def __init__(self, per_user=MESSAGE_INDEX_PER_USER, max_entries=MESSAGE_INDEX_MAX_ENTRIES, max_age=MESSAGE_INDEX_MAX_AGE):
+        self.per_user = per_user
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.members = OrderedDict() # (guild_id, user_id) -> _UserMessages
+        self.owners = {} # message_id -> _UserMessages, so deletes need no cached author
+        self.entries = 0
+        self.evictions = 0
+        self.started = discord.utils.utcnow()
+        self.capacity_evicted_at = None # Last time a member was dropped to stay under max_entries
+
+    def __len__(self):
+        return self.entries
+
+    def add(self, guild_id: int, user_id: int, channel_id: int, message_id: int):
+        key = (guild_id, user_id)
+        ring = self.members.get(key)
+        if ring is None:
+            ring = self.members[key] = _UserMessages()
+        else:
+            self.members.move_to_end(key)
+        if len(ring.message_ids) < self.per_user:
+            ring.channel_ids.append(channel_id)
+            ring.message_ids.append(message_id)
+            self.entries += 1
+        else:
+            overwritten = ring.message_ids[ring.head]
+            if overwritten:
+                self.owners.pop(overwritten, None)
+                ring.overflowed = True
+            else:
+                self.entries += 1
+            ring.channel_ids[ring.head] = channel_id
+            ring.message_ids[ring.head] = message_id
+            ring.head = (ring.head + 1) % self.per_user
+        self.owners[message_id] = ring
+        while self.entries > self.max_entries and self.members:
+            self._evict_oldest()
+            self.capacity_evicted_at = discord.utils.utcnow()
+
+    def _drop(self, ring):
+        for mid in ring.message_ids:
+            if mid:
+                self.owners.pop(mid, None)
+                self.entries -= 1
+
+    def _evict_oldest(self):
+        _, ring = self.members.popitem(last=False)
+        self._drop(ring)
+        self.evictions += 1
+
+    def remove(self, message_id: int):
+        ring = self.owners.pop(message_id, None)
+        if ring is None:
+            return
+        ring.message_ids[ring.message_ids.index(message_id)] = 0
+        self.entries -= 1
+
+    def prune(self):
+        """Drops members whose newest indexed message is older than `max_age`."""
+        cutoff = discord.utils.time_snowflake(discord.utils.utcnow() - self.max_age)
+        while self.members:
+            ring = next(iter(self.members.values()))
+            if ring.newest() >= cutoff:
+                break
+            self._evict_oldest()
+
+    def messages_for(self, guild_id: int, user_id: int):
+        """Returns {channel_id: [message_id, ...]} of live, in-window messages for a member."""
+        ring = self.members.get((guild_id, user_id))
+        if ring is None:
+            return {}
+        cutoff = discord.utils.time_snowflake(discord.utils.utcnow() - self.max_age)
+        by_channel = {}
+        for channel_id, message_id in zip(ring.channel_ids, ring.message_ids):
+            if message_id >= cutoff:
+                by_channel.setdefault(channel_id, []).append(message_id)
+        return by_channel
+
+    def covers(self, guild_id: int, user_id: int, since):
+        """True when every message the member posted after `since` is still indexed."""
+        if since is None or since < self.started or since < discord.utils.utcnow() - self.max_age:
+            return False
+        if self.capacity_evicted_at is not None and self.capacity_evicted_at >= since:
+            return False
+        ring = self.members.get((guild_id, user_id))
+        return ring is None or not ring.overflowed
+
+    def forget(self, guild_id: int, user_id: int):
+        ring = self.members.pop((guild_id, user_id), None)
+        if ring is not None:
+            self._drop(ring)
+
+    def stats(self):
+        return {
+            "indexed_messages": self.entries,
+            "indexed_members": len(self.members),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+# --- Message Cleanup ---
+
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5) # Margin for clock skew
+
+class CleanupEngine:
+    """Deletes one member's messages across many channels.
+
+    Channels are scanned concurrently. Each scan stops at `limit` messages or at
+    `since` (usually just before the member joined), whichever comes first.
+    Messages younger than 14 days are removed through bulk delete in batches of
+    100. Older ones can only be deleted one at a time, so they share a single
+    throttled lane across all channels.
+    """
+
+    def __init__(self, concurrency=CLEAN_CHANNEL_CONCURRENCY, old_delete_interval=CLEAN_OLD_DELETE_INTERVAL):
+        self.concurrency = concurrency
+        self.old_delete_interval = old_delete_interval
+        self._old_lane = asyncio.Lock()
+
+    @staticmethod
+    def can_clean(channel, me):
+        perms = channel.permissions_for(me)
+        return perms.view_channel and perms.read_message_history and perms.manage_messages
+
+    async def delete_ids(self, channel, message_ids, reason="User cleanup"):
+        """Deletes known message IDs from one channel. Returns how many were deleted."""
+        cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        recent = [discord.Object(id=mid) for mid in message_ids if discord.utils.snowflake_time(mid) > cutoff]
+        old = [mid for mid in message_ids if discord.utils.snowflake_time(mid) <= cutoff]
+        deleted = 0
+        for i in range(0, len(recent), 100):
+            batch = recent[i:i + 100]
+            try:
+                await rest.call(f"messages:{channel.id}", channel.delete_messages, batch, reason=reason)
+                deleted += len(batch)
+            except discord.NotFound:
+                # Some were already deleted; remove the rest one at a time
+                for message in batch:
+                    try:
+                        await rest.call(f"messages:{channel.id}", channel.get_partial_message(message.id).delete)
+                        deleted += 1
+                    except discord.NotFound:
+                        pass
+        for mid in old:
+            async with self._old_lane:
+                try:
+                    await rest.call(f"messages:{channel.id}", channel.get_partial_message(mid).delete)
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+                await asyncio.sleep(self.old_delete_interval)
+        return deleted
+
+    async def clean_channel(self, channel, member, limit, since=None):
+        """Scans one channel and deletes the member's messages. Returns (scanned, deleted)."""
+        # Nothing posted here since `since`, so skip the history request entirely
+        if since and (channel.last_message_id is None or discord.utils.snowflake_time(channel.last_message_id) < since):
+            return 0, 0
+        scanned = 0
+        found = []
+        async for message in channel.history(limit=limit, after=since, oldest_first=False):
+            scanned += 1
+            if message.author.id == member.id:
+                found.append(message.id)
+        deleted = await self.delete_ids(channel, found) if found else 0
+        return scanned, deleted
+
+    async def clean_indexed(self, guild, member, index, on_channel_done=None):
+        """Deletes the member's messages known to the message index, without scanning history."""
+        known = index.messages_for(guild.id, member.id)
+        channels = [(guild.get_channel(channel_id), ids) for channel_id, ids in known.items()]
+        channels = [(channel, ids) for channel, ids in channels if channel is not None and self.can_clean(channel, guild.me)]
+        results = []
+
+        async def worker(item):
+            channel, ids = item
+            started = time.monotonic()
+            result = {"channel": channel, "scanned": len(ids), "deleted": 0, "error": None}
+            try:
+                result["deleted"] = await self.delete_ids(channel, ids)
+                for message_id in ids:
+                    index.remove(message_id)
+            except discord.HTTPException as e:
+                result["error"] = e.text or str(e.status)
+            result["elapsed"] = time.monotonic() - started
+            results.append(result)
+            if on_channel_done:
+                await on_channel_done(result, len(results), len(channels))
+
+        await run_bounded(channels, worker, self.concurrency)
+        return results
+
+    async def clean(self, guild, member, limit, on_channel_done=None, since=None):
+        """Cleans every readable text channel. Returns a list of per-channel results."""
+        channels = [channel for channel in guild.text_channels if self.can_clean(channel, guild.me)]
+        results = []
+
+        async def worker(channel):
+            started = time.monotonic()
+            result = {"channel": channel, "scanned": 0, "deleted": 0, "error": None}
+            try:
+                result["scanned"], result["deleted"] = await self.clean_channel(channel, member, limit, since)
+            except discord.HTTPException as e:
+                result["error"] = e.text or str(e.status)
+            result["elapsed"] = time.monotonic() - started
+            results.append(result)
+            if on_channel_done:
+                await on_channel_done(result, len(results), len(channels))
+
+        await run_bounded(channels, worker, self.concurrency)
+        return results
+
+# --- Lockdown ---
+
+class LockdownEngine:
+    """Server-wide lockdown that remembers what it changed.
+
+    Before any channel is touched, the prior @everyone overwrite of every channel
+    being locked is saved to disk as an (allow, deny) pair, or None when there was
+    no overwrite. Unlock restores exactly those snapshots, so channels that were
+    already locked before the lockdown stay locked.
+    """
+
+    def __init__(self, path, concurrency=LOCKDOWN_CONCURRENCY):
+        self.path = path
+        self.concurrency = concurrency
+        self.snapshots = {} # guild_id -> {channel_id: [allow, deny] or None}
+        self._lock = asyncio.Lock()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.snapshots = json.load(f)
+
+    async def _save(self):
+        snapshot = {guild_id: dict(channels) for guild_id, channels in self.snapshots.items()}
+        await asyncio.to_thread(write_guild_json, self.path, snapshot)
+
+    def is_locked(self, guild_id: int):
+        return bool(self.snapshots.get(str(guild_id)))
+
+    async def lock(self, guild: discord.Guild, on_progress=None):
+        """Locks every unlocked text channel. Returns (locked_channels, failed_channels)."""
+        role = guild.default_role
+        targets = []
+        async with self._lock:
+            saved = self.snapshots.setdefault(str(guild.id), {})
+            for channel in guild.text_channels:
+                overwrite = channel.overwrites_for(role)
+                if overwrite.send_messages is False or str(channel.id) in saved:
+                    continue
+                saved[str(channel.id)] = None if overwrite.is_empty() else [pair.value for pair in overwrite.pair()]
+                targets.append(channel)
+            await self._save()
+
+        locked, failed = [], []
+
+        async def apply(channel):
+            overwrite = channel.overwrites_for(role)
+            overwrite.send_messages = False
+            try:
+                await rest.call(f"channel:{channel.id}", channel.set_permissions, role, overwrite=overwrite, reason="Server Lockdown")
+                locked.append(channel)
+            except discord.HTTPException:
+                failed.append(channel)
+            if on_progress:
+                await on_progress(len(locked), len(failed), len(targets))
+
+        await run_bounded(targets, apply, self.concurrency)
+        if failed:
+            # Nothing changed on these, so there is nothing to restore later
+            async with self._lock:
+                for channel in failed:
+                    saved.pop(str(channel.id), None)
+                await self._save()
+        return locked, failed
+
+    async def unlock(self, guild: discord.Guild, on_progress=None):
+        """Restores the saved overwrites. Returns (restored_channels, failed_channels)."""
+        role = guild.default_role
+        saved = self.snapshots.get(str(guild.id), {})
+        targets = [(guild.get_channel(int(channel_id)), channel_id, pair) for channel_id, pair in saved.items()]
+        restored, failed = [], []
+        done_ids = []
+
+        async def restore(item):
+            channel, channel_id, pair = item
+            if channel is None:
+                # Deleted while locked
+                done_ids.append(channel_id)
+                return
+            overwrite = None if pair is None else discord.PermissionOverwrite.from_pair(discord.Permissions(pair[0]), discord.Permissions(pair[1]))
+            try:
+                await rest.call(f"channel:{channel.id}", channel.set_permissions, role, overwrite=overwrite, reason="Server Lockdown Lifted")
+                restored.append(channel)
+                done_ids.append(channel_id)
+            except discord.HTTPException:
+                failed.append(channel)
+            if on_progress:
+                await on_progress(len(restored), len(failed), len(targets))
+
+        await run_bounded(targets, restore, self.concurrency)
+        async with self._lock:
+            # Failed channels keep their snapshot so a second /unlockdown can retry them
+            for channel_id in done_ids:
+                saved.pop(channel_id, None)
+            if not saved:
+                self.snapshots.pop(str(guild.id), None)
+            await self._save()
+        return restored, failed
+
+# --- Anti-Raid ---
+
+class JoinRateDetector:
+    """Per-guild sliding-window join counter that switches raid mode on and off.
+
+    Each guild keeps only the timestamps of its last `threshold` joins, so a join
+    costs O(1) and memory stays bounded. Raid mode starts when `threshold` joins
+    land within `window` seconds. It ends `cooldown` seconds after the join rate
+    falls back below the threshold. Accounts younger than `young_account_age`
+    count double toward the threshold.
+    """
+
+    def __init__(self, threshold=RAID_JOIN_THRESHOLD, window=RAID_WINDOW_SECONDS, cooldown=RAID_COOLDOWN_SECONDS,
+                 young_account_age=RAID_YOUNG_ACCOUNT_AGE):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.young_account_age = young_account_age
+        self.joins = {} # guild_id -> deque of monotonic join times
+        self.raid_until = {} # guild_id -> monotonic time raid mode ends
+        self.manual = set() # guild_ids with /antiraid switched on
+
+    def record_join(self, guild_id: int, account_created_at: datetime.datetime, now: float = None):
+        """Records a join. Returns (raid_active, raid_just_started)."""
+        now = time.monotonic() if now is None else now
+        joins = self.joins.get(guild_id)
+        if joins is None:
+            joins = self.joins[guild_id] = deque(maxlen=self.threshold)
+        joins.append(now)
+        if discord.utils.utcnow() - account_created_at < self.young_account_age:
+            joins.append(now)
+        was_active = self.raid_until.get(guild_id, 0) > now
+        if len(joins) == self.threshold and now - joins[0] <= self.window:
+            self.raid_until[guild_id] = now + self.cooldown
+        is_auto = self.raid_until.get(guild_id, 0) > now
+        return guild_id in self.manual or is_auto, is_auto and not was_active
+
+    def is_active(self, guild_id: int):
+        return guild_id in self.manual or self.raid_until.get(guild_id, 0) > time.monotonic()
+
+    def is_auto_active(self, guild_id: int):
+        return self.raid_until.get(guild_id, 0) > time.monotonic()
+
+    def set_manual(self, guild_id: int, enabled: bool):
+        if enabled:
+            self.manual.add(guild_id)
+        else:
+            self.manual.discard(guild_id)
+            self.raid_until.pop(guild_id, None)
+
+class RaidEnforcer:
+    """Queues joiners caught in a raid and removes them in concurrent batches."""
+
+    def __init__(self, client, action=RAID_ACTION, batch_size=RAID_BATCH_SIZE, linger=RAID_BATCH_LINGER):
+        self.client = client
+        self.action = action
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queues = {} # guild_id -> asyncio.Queue of member IDs
+        self.workers = {}
+        self.enforced = 0
+        self.failed = 0
+
+    def submit(self, guild: discord.Guild, member_id: int):
+        queue = self.queues.get(guild.id)
+        if queue is None:
+            queue = self.queues[guild.id] = asyncio.Queue()
+            self.workers[guild.id] = asyncio.create_task(self._worker(guild.id))
+        queue.put_nowait(member_id)
+
+    async def _worker(self, guild_id: int):
+        queue = self.queues[guild_id]
+        while True:
+            batch = [await queue.get()]
+            # Give the raid a moment to pile up so one request covers many joiners
+            await asyncio.sleep(self.linger)
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            guild = self.client.get_guild(guild_id)
+            if guild is None:
+                continue
+            try:
+                with rest.lane("bulk"):
+                    await self.enforce(guild, batch)
+            except Exception as e:
+                print(f"Raid enforcement failed in {guild_id}: {e}")
+
+    async def enforce(self, guild: discord.Guild, member_ids):
+        if self.action == 'ban':
+            banned, failed = await ban_many(guild, member_ids, "Anti-Raid Mode Active")
+            self.enforced += len(banned)
+            self.failed += len(failed)
+            return
+
+        async def kick(member_id):
+            try:
+                await rest.call(f"members:{guild.id}", guild.kick, discord.Object(id=member_id), reason="Anti-Raid Mode Active")
+                self.enforced += 1
+            except discord.HTTPException:
+                self.failed += 1
+
+        await run_bounded(member_ids, kick, RAID_KICK_CONCURRENCY)
+
+    def pending(self):
+        return sum(queue.qsize() for queue in self.queues.values())
+
+# --- User Lookup Cache ---
+
+class UserLookupCache:
+    """User lookups that avoid repeat REST calls.
+
+    Lookups check the client's own user cache first, then a bounded LRU of
+    fetched users with a TTL. Unknown IDs (404) are cached as negative entries.
+    Concurrent lookups of the same ID share one fetch_user request.
+    """
+
+    _NOT_FOUND = object()
+
+    def __init__(self, client, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, negative_ttl=USER_CACHE_NEGATIVE_TTL):
+        self.client = client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict() # user_id -> (expires_at, user or _NOT_FOUND)
+        self._inflight = {}
+        self.local_hits = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    async def get(self, user_id: int):
+        """Like Client.fetch_user, raising discord.NotFound for unknown IDs."""
+        user = self.client.get_user(user_id)
+        if user is not None:
+            self.local_hits += 1
+            return user
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(user_id)
+                if value is self._NOT_FOUND:
+                    self.negative_hits += 1
+                    raise discord.NotFound(_NotFoundResponse(), "Unknown User (cached)")
+                self.hits += 1
+                return value
+            del self.entries[user_id]
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            self.merged += 1
+            return await asyncio.shield(inflight)
+        self.misses += 1
+        inflight = self._inflight[user_id] = asyncio.ensure_future(self._fetch(user_id))
+        try:
+            return await asyncio.shield(inflight)
+        finally:
+            self._inflight.pop(user_id, None)
+
+    async def _fetch(self, user_id: int):
+        try:
+            user = await rest.call("users", self.client.fetch_user, user_id)
+        except discord.NotFound:
+            self._store(user_id, self._NOT_FOUND, self.negative_ttl)
+            raise
+        self._store(user_id, user, self.ttl)
+        return user
 
-def get_token():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'r') as f:
-            return f.read().strip()
-    return None
+    def _store(self, user_id, value, ttl):
+        self.entries[user_id] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
 
-TOKEN = get_token()
+    def stats(self):
+        lookups = self.local_hits + self.hits + self.negative_hits + self.misses + self.merged
+        return {
+            "lookups": lookups,
+            "local_hits": self.local_hits,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "merged": self.merged,
+            "misses": self.misses,
+            "hit_rate": f"{(lookups - self.misses) / lookups:.0%}" if lookups else "n/a",
+            "cached": len(self.entries),
+        }
 
-def find_trust_file():
-    """Deep searches for trust_scores.json in common user directories."""
-    # List of directories to search in
-    base_search = [
-        os.getcwd(),
-        os.path.expanduser("~/Desktop"),
-        os.path.expanduser("~/Documents"),
-        os.path.expanduser("~/Downloads"),
-        os.path.expanduser("~")
-    ]
-    
-    # First, check immediate paths for speed
-    for base in base_search:
-        full_path = os.path.join(base, TRUST_FILE_NAME)
-        if os.path.exists(full_path):
-            return full_path
-            
-    # If not found, do a shallow walk (1 level deep) in Desktop and Documents
-    deep_search = [
-        os.path.expanduser("~/Desktop"),
-        os.path.expanduser("~/Documents")
-    ]
-    for base in deep_search:
-        if os.path.exists(base):
-            for item in os.listdir(base):
-                item_path = os.path.join(base, item)
-                if os.path.isdir(item_path):
-                    target = os.path.join(item_path, TRUST_FILE_NAME)
-                    if os.path.exists(target):
-                        return target
-                        
-    return os.path.join(os.getcwd(), TRUST_FILE_NAME)
-
-def find_block_file():
-    """Deep searches for blocked_users.json."""
-    base_search = [os.getcwd(), os.path.expanduser("~")]
-    for base in base_search:
-        full_path = os.path.join(base, BLOCK_FILE_NAME)
-        if os.path.exists(full_path):
-            return full_path
-    return os.path.join(os.getcwd(), BLOCK_FILE_NAME)
-
-TRUST_FILE = find_trust_file()
-BLOCK_FILE = find_block_file()
+class _NotFoundResponse:
+    """Stand-in response so cached 404s can be raised as discord.NotFound."""
+    status = 404
+    reason = "Not Found"
+
+# --- Automod ---
+
+class AhoCorasick:
+    """Multi-keyword matcher: one pass over the text finds every keyword it contains.
+
+    Each keyword's output list is merged along the failure links when the
+    automaton is built, so matching never walks output chains.
+    """
+
+    def __init__(self, keywords):
+        """`keywords` is an iterable of (keyword, value) pairs. Keywords should already be casefolded."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for keyword, value in keywords:
+            node = 0
+            for char in keyword:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = next_node
+            self.out[node] = self.out[node] + (value,)
+        # Breadth-first pass to fill failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                if self.out[self.fail[child]]:
+                    self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def search(self, text):
+        """Returns the values of every keyword found in `text`."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        found = []
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.extend(out[node])
+        return found
+
+REGEX_PREFIX_CHARS = frozenset(string.ascii_letters + string.digits + " _-:/@#")
+
+def regex_literal_prefix(pattern):
+    """Returns the plain-text start every match of `pattern` must begin with, or ''."""
+    if "|" in pattern:
+        return ""
+    prefix = []
+    for i, char in enumerate(pattern):
+        if char not in REGEX_PREFIX_CHARS:
+            break
+        # A quantifier makes the character before it optional
+        if i + 1 < len(pattern) and pattern[i + 1] in "*?{":
+            break
+        prefix.append(char)
+    return "".join(prefix).casefold()
+
+# \1, (?P=name) and (?(1)...) refer to groups by position or name, which breaks once patterns are combined
+REGEX_GROUP_REFERENCE = re.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?\()')
+
+class CompiledRuleSet:
+    """One guild's automod rules compiled into one keyword automaton plus one combined regex.
+
+    Regex rules that start with at least two literal characters are not run on
+    every message. Their prefix goes into the keyword automaton, and the regex is
+    only tried when that prefix appears. All other regex rules share one
+    combined pattern that screens the message in a single pass; only when it
+    matches is each of them searched on its own, so overlapping rules all count.
+    """
+
+    def __init__(self, rules):
+        self.rules = {rule["id"]: rule for rule in rules}
+        # Automaton values: positive = keyword rule ID, negative = regex rule whose prefix was seen
+        keywords = [(rule["pattern"].casefold(), rule["id"]) for rule in rules if rule["kind"] == "keyword"]
+        self.prefixed = {}
+        self.unprefixed = [] # (rule ID, compiled pattern)
+        for rule in rules:
+            if rule["kind"] != "regex":
+                continue
+            prefix = regex_literal_prefix(rule["pattern"])
+            if len(prefix) >= 2:
+                self.prefixed[rule["id"]] = re.compile(rule["pattern"], re.IGNORECASE)
+                keywords.append((prefix, -rule["id"]))
+            else:
+                self.unprefixed.append((rule["id"], re.compile(rule["pattern"], re.IGNORECASE)))
+        self.keywords = AhoCorasick(keywords) if keywords else None
+        self.regex = None
+        patterns = [pattern.pattern for _, pattern in self.unprefixed]
+        if len(patterns) > 1 and not any(REGEX_GROUP_REFERENCE.search(pattern) for pattern in patterns):
+            try:
+                self.regex = re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+            except re.error:
+                # e.g. two rules define the same group name; search them one by one instead
+                pass
+
+    def match(self, content):
+        """Returns the IDs of the rules the content breaks."""
+        matched = []
+        if self.keywords:
+            for value in set(self.keywords.search(content.casefold())):
+                if value > 0:
+                    matched.append(value)
+                elif self.prefixed[-value].search(content):
+                    matched.append(-value)
+        if self.unprefixed and (self.regex is None or self.regex.search(content)):
+            matched.extend(rule_id for rule_id, pattern in self.unprefixed if pattern.search(content))
+        return matched
+
+class AutomodEngine:
+    """Per-guild automod rule sets, compiled once per rule set version."""
+
+    ACTIONS = ("delete", "flag")
+
+    def __init__(self, path):
+        self.path = path
+        self.guilds = {} # guild_id (str) -> {"version": int, "next_id": int, "rules": [...]}
+        self._compiled = {} # guild_id -> (version, CompiledRuleSet)
+        self.checked = 0
+        self.matched = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.guilds = json.load(f)
+
+    async def _save(self):
+        snapshot = {guild_id: dict(config, rules=list(config["rules"])) for guild_id, config in self.guilds.items()}
+        await asyncio.to_thread(write_guild_json, self.path, snapshot)
+
+    def rules_for(self, guild_id: int):
+        return self.guilds.get(str(guild_id), {}).get("rules", [])
+
+    def compiled(self, guild_id: int):
+        config = self.guilds.get(str(guild_id))
+        if not config or not config["rules"]:
+            return None
+        cached = self._compiled.get(guild_id)
+        if cached is None or cached[0] != config["version"]:
+            cached = self._compiled[guild_id] = (config["version"], CompiledRuleSet(config["rules"]))
+        return cached[1]
+
+    async def add_rule(self, guild_id: int, kind: str, pattern: str, action: str, delta: int):
+        if kind == "regex":
+            # Raises re.error for the caller to report
+            re.compile(pattern, re.IGNORECASE)
+            if REGEX_GROUP_REFERENCE.search(pattern):
+                raise re.error("backreferences are not supported")
+        config = self.guilds.setdefault(str(guild_id), {"version": 0, "next_id": 1, "rules": []})
+        rule = {"id": config["next_id"], "kind": kind, "pattern": pattern, "action": action, "delta": delta}
+        config["next_id"] += 1
+        config["rules"].append(rule)
+        config["version"] += 1
+        await self._save()
+        return rule
+
+    async def remove_rule(self, guild_id: int, rule_id: int):
+        config = self.guilds.get(str(guild_id))
+        if not config:
+            return False
+        rules = [rule for rule in config["rules"] if rule["id"] != rule_id]
+        if len(rules) == len(config["rules"]):
+            return False
+        config["rules"] = rules
+        config["version"] += 1
+        await self._save()
+        return True
+
+    def check(self, message: discord.Message):
+        """Returns the rules a message breaks, or an empty list."""
+        rule_set = self.compiled(message.guild.id)
+        if rule_set is None or not message.content:
+            return []
+        self.checked += 1
+        rule_ids = rule_set.match(message.content)
+        if not rule_ids:
+            return []
+        self.matched += 1
+        return [rule_set.rules[rule_id] for rule_id in dict.fromkeys(rule_ids)]
+
+# --- Spam Detection ---
+
+SPAM_NORMALIZE = re.compile(r'[\W_]+')
+SPAM_REPEATS = re.compile(r'(.)\1{2,}')
+
+def spam_fingerprint(content: str):
+    """Hash of a message with case, punctuation, spacing and stretched letters removed."""
+    text = SPAM_NORMALIZE.sub('', content.casefold())
+    if not text:
+        return 0
+    return hash(SPAM_REPEATS.sub(r'\1', text[:SPAM_FINGERPRINT_CHARS])) or 1
+
+class _SpamHistory:
+    """Fixed-size ring of a member's recent (time, fingerprint, channel) triples."""
+
+    __slots__ = ('times', 'hashes', 'channels', 'head')
+
+    def __init__(self, size):
+        self.times = array('d', [float('-inf')]) * size
+        self.hashes = array('q', bytes(8 * size))
+        self.channels = array('Q', bytes(8 * size))
+        self.head = 0
+
+class SpamDetector:
+    """Flood and duplicate-message detection with bounded memory.
+
+    Every tracked member has a fixed ring of their last `history` messages.
+    Members sit in one global LRU capped at `max_tracked`, so memory stays flat
+    however busy the servers are. A member is flagged for sending
+    `rate_limit` messages within `rate_window` seconds, or for posting the same
+    normalized content `duplicate_limit` times, or in `duplicate_channels`
+    different channels, within `duplicate_window` seconds.
+    """
+
+    def __init__(self, history=SPAM_HISTORY, max_tracked=SPAM_MAX_TRACKED, rate_limit=SPAM_RATE_LIMIT, rate_window=SPAM_RATE_WINDOW,
+                 duplicate_limit=SPAM_DUPLICATE_LIMIT, duplicate_channels=SPAM_DUPLICATE_CHANNELS, duplicate_window=SPAM_DUPLICATE_WINDOW):
+        self.history = history
+        self.max_tracked = max_tracked
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.duplicate_limit = duplicate_limit
+        self.duplicate_channels = duplicate_channels
+        self.duplicate_window = duplicate_window
+        self.members = OrderedDict() # (guild_id, user_id) -> _SpamHistory
+        self.flagged = 0
+
+    def observe(self, guild_id: int, user_id: int, channel_id: int, content: str, now: float = None):
+        """Records a message. Returns a reason string when the member is spamming, else None."""
+        now = time.monotonic() if now is None else now
+        key = (guild_id, user_id)
+        ring = self.members.get(key)
+        if ring is None:
+            ring = self.members[key] = _SpamHistory(self.history)
+            if len(self.members) > self.max_tracked:
+                self.members.popitem(last=False)
+        else:
+            self.members.move_to_end(key)
+        fingerprint = spam_fingerprint(content) if content else 0
+        slot = ring.head
+        ring.times[slot] = now
+        ring.hashes[slot] = fingerprint
+        ring.channels[slot] = channel_id
+        ring.head = (slot + 1) % self.history
+
+        recent = 0
+        duplicates = 0
+        channels = set()
+        rate_cutoff = now - self.rate_window
+        duplicate_cutoff = now - self.duplicate_window
+        for sent_at, other, channel in zip(ring.times, ring.hashes, ring.channels):
+            if sent_at >= rate_cutoff:
+                recent += 1
+            if fingerprint and other == fingerprint and sent_at >= duplicate_cutoff:
+                duplicates += 1
+                channels.add(channel)
+
+        reason = None
+        if recent >= self.rate_limit:
+            reason = f"Flooding ({recent} messages in {self.rate_window:g}s)"
+        elif len(channels) >= self.duplicate_channels:
+            reason = f"Cross-posting the same message in {len(channels)} channels"
+        elif duplicates >= self.duplicate_limit:
+            reason = f"Repeating the same message {duplicates} times"
+        if reason:
+            # Start over so one burst is only punished once
+            del self.members[key]
+            self.flagged += 1
+        return reason
+
+    def check(self, message: discord.Message):
+        return self.observe(message.guild.id, message.author.id, message.channel.id, message.content)
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -74,144 +2820,542 @@ intents.members = True
 
 class MyBot(commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix='!', intents=intents)
-        self.trust_data = {}
-        self.blocked_users = []
-        self.antiraid = False # Anti-raid join gate toggle
+        # cluster.py sets the shard for each worker process; a plain run is unsharded
+        shards = {"shard_id": SHARD_ID, "shard_count": SHARD_COUNT} if SHARD_COUNT else {}
+        super().__init__(command_prefix='!', intents=intents, tree_cls=InstrumentedTree, **shards)
+        self.state = StateClient(self, STATE_SOCKET) if STATE_SOCKET else None
+        self.trust = TrustStore(make_trust_backend())
+        self.dm_dispatcher = DMDispatcher(self, DM_JOBS_DIR)
+        self.cleanup = CleanupEngine()
+        self.users_cache = UserLookupCache(self)
+        self.mod_dms = ModerationOutbox()
+        self.invites = InvitePool()
+        self.audit = AuditLog(AUDIT_DIR)
+        self.automod = AutomodEngine(AUTOMOD_FILE)
+        self.spam = SpamDetector()
+        self.startup = StartupTimer()
+        self._gateway_started = None
+        self.lockdown = LockdownEngine(LOCKDOWN_FILE)
+        self.message_index = MessageIndex() if MESSAGE_INDEX_ENABLED else None
+        if self.state is not None:
+            self.blocked_users = SharedBlockRegistry(self.state)
+        else:
+            self.blocked_users = BlockRegistry(BLOCK_SNAPSHOT_FILE, BLOCK_LOG_FILE, legacy_json_path=BLOCK_FILE)
+        self.raid_detector = JoinRateDetector() # Anti-raid join gate, per guild
+        self.raid_enforcer = RaidEnforcer(self)
+
+    async def login(self, token):
+        with self.startup.phase("login"):
+            await super().login(token)
 
     async def setup_hook(self):
-        self.load_trust_data()
-        self.load_blocked_users()
-        # Sync slash commands
+        startup = self.startup
+        with startup.phase("owner lookup"):
+            # Cache the owner once so owner-only commands never call application_info
+            app_info = await self.application_info()
+            if app_info.team:
+                self.owner_ids = {member.id for member in app_info.team.members}
+            else:
+                self.owner_id = app_info.owner.id
+        with startup.phase("trust store"):
+            self.trust.open()
+            self.trust.start()
+        if self.state is not None:
+            with startup.phase("cluster state"):
+                await self.state.connect()
+        with startup.phase("data files"):
+            self.blocked_users.load()
+            self.lockdown.load()
+            self.automod.load()
+            self.audit.load()
+            self.audit.start()
+        with startup.phase("metrics"):
+            metrics.instrument(self)
+            metrics.add_collector("trust", self.trust.stats)
+            metrics.add_collector("rest_lane", rest.stats)
+            metrics.add_collector("mod_dm", self.mod_dms.stats)
+            metrics.add_collector("invite_pool", self.invites.stats)
+            metrics.add_collector("audit", self.audit.stats)
+            await metrics.start()
+        with startup.phase("resume jobs"):
+            self.dm_dispatcher.resume()
+            if self.message_index is not None:
+                self._prune_task = asyncio.create_task(self._prune_message_index())
+        if SHARD_ID == 0:
+            # Commands are per application, so one worker of a cluster syncs for all
+            with startup.phase("command sync"):
+                await self.sync_commands()
+        self._gateway_started = time.perf_counter()
+
+    def command_tree_hash(self):
+        """Stable hash of the slash command payload Discord would receive."""
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands()), key=lambda c: (c["name"], c.get("type", 1)))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def sync_commands(self):
+        """Syncs slash commands only when the command tree changed since the last sync."""
+        current = {"application_id": self.application_id, "hash": self.command_tree_hash()}
+        previous = None
+        if os.path.exists(COMMAND_SYNC_FILE):
+            try:
+                with open(COMMAND_SYNC_FILE, 'r') as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if previous == current and not FORCE_COMMAND_SYNC:
+            print("Slash commands unchanged, skipping sync.")
+            return
         await self.tree.sync()
+        atomic_write_json(COMMAND_SYNC_FILE, current)
         print("Slash commands synced.")
 
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        metrics.observe_command(interaction, "ok")
+
     async def on_member_join(self, member: discord.Member):
-        if self.antiraid:
-            try:
-                await member.send("🛡️ The server is currently in **Anti-Raid Mode**. New joins are temporarily restricted. Please try again later.")
-                await member.kick(reason="Anti-Raid Mode Active")
-            except:
-                await member.kick(reason="Anti-Raid Mode Active")
-
-    def load_trust_data(self):
-        if os.path.exists(TRUST_FILE):
-            with open(TRUST_FILE, 'r') as f:
-                self.trust_data = json.load(f)
-        else:
-            self.trust_data = {}
+        active, started = self.raid_detector.record_join(member.guild.id, member.created_at)
+        if started:
+            asyncio.create_task(self.announce_raid(member.guild))
+        if not active:
+            return
+        # Established accounts only get through when raid mode was switched on automatically
+        manual = member.guild.id in self.raid_detector.manual
+        if not manual and discord.utils.utcnow() - member.created_at > RAID_TRUSTED_ACCOUNT_AGE:
+            return
+        self.raid_enforcer.submit(member.guild, member.id)
+
+    async def announce_raid(self, guild: discord.Guild):
+        channel = guild.system_channel
+        if channel is None or not channel.permissions_for(guild.me).send_messages:
+            return
+        try:
+            await rest.call(f"messages:{channel.id}", channel.send,
+                f"🛡️ **Raid detected.** Anti-Raid Mode switched on automatically: new joins are being "
+                f"{'banned' if RAID_ACTION == 'ban' else 'kicked'}. It will switch off after "
+                f"{int(RAID_COOLDOWN_SECONDS // 60)} quiet minutes."
+            )
+        except discord.HTTPException:
+            pass
+
+    async def on_message(self, message: discord.Message):
+        if self.message_index is not None and message.guild is not None:
+            self.message_index.add(message.guild.id, message.author.id, message.channel.id, message.id)
+        if message.guild is not None and not message.author.bot and isinstance(message.author, discord.Member):
+            broken = self.automod.check(message)
+            spam_reason = self.spam.check(message)
+            if (broken or spam_reason) and not message.channel.permissions_for(message.author).manage_messages:
+                if broken:
+                    await self.apply_automod(message, broken)
+                if spam_reason:
+                    await self.punish_spam(message, spam_reason)
+        await self.process_commands(message)
+
+    async def punish_spam(self, message: discord.Message, reason: str):
+        try:
+            deduction, new_score = await self.timeout_member(message.author, SPAM_TIMEOUT_MINUTES, f"Spam filter: {reason}", channel=message.channel, moderator=self.user)
+        except discord.HTTPException:
+            return
+        try:
+            await rest.call(f"messages:{message.channel.id}", message.channel.send, f"🔇 {message.author.mention} was timed out for {SPAM_TIMEOUT_MINUTES} minutes: {reason}. Trust reduced by {deduction} (Now: {new_score}).")
+        except discord.HTTPException:
+            pass
 
-    def save_trust_data(self):
-        with open(TRUST_FILE, 'w') as f:
-            json.dump(self.trust_data, f, indent=4)
+    async def timeout_member(self, member: discord.Member, minutes: int, reason: str, interaction: discord.Interaction = None,
+                             *, channel=None, moderator=None):
+        """DMs, times out and deducts trust. Shared by /timeout and the spam filter. Returns (deduction, new_score)."""
+        duration = datetime.timedelta(minutes=minutes)
+        self.mod_dms.send(member, "timeout", f"⏳ You have been timed out in **{member.guild.name}** for {minutes} minutes.\n**Reason:** {reason}")
+        await rest.call(f"members:{member.guild.id}", member.timeout, duration, reason=reason)
+        acting = moderator or (interaction.user if interaction else None)
+        self.audit.record(member.guild.id, "timeout", member.id, acting.id if acting else None, reason, minutes=minutes)
+        # Deduct 5 trust per 10 minutes, max 50
+        deduction = min(50, (minutes // 10) * 5 + 5)
+        new_score = await self.update_trust(member, -deduction, f"Timeout ({minutes}m): {reason}", interaction, channel=channel, moderator=moderator)
+        return deduction, new_score
 
-    def load_blocked_users(self):
-        if os.path.exists(BLOCK_FILE):
+    async def apply_automod(self, message: discord.Message, rules):
+        # The harshest rule decides the trust change; any delete rule removes the message
+        delta = min(rule["delta"] for rule in rules)
+        rule_list = ", ".join(f"#{rule['id']}" for rule in rules)
+        if any(rule["action"] == "delete" for rule in rules):
             try:
-                with open(BLOCK_FILE, 'r') as f:
-                    self.blocked_users = json.load(f)
-            except:
-                self.blocked_users = []
-        else:
-            self.blocked_users = []
+                await rest.call(f"messages:{message.channel.id}", message.delete)
+            except discord.HTTPException:
+                pass
+            try:
+                await rest.call(f"messages:{message.channel.id}", message.channel.send, f"🛡️ {message.author.mention}, your message was removed by automod (rule {rule_list}).", delete_after=10)
+            except discord.HTTPException:
+                pass
+        await self.update_trust(message.author, delta, f"Automod rule {rule_list}", channel=message.channel, moderator=self.user)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if self.message_index is not None and payload.guild_id:
+            self.message_index.remove(payload.message_id)
 
-    def save_blocked_users(self):
-        with open(BLOCK_FILE, 'w') as f:
-            json.dump(self.blocked_users, f, indent=4)
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if self.message_index is not None and payload.guild_id:
+            for message_id in payload.message_ids:
+                self.message_index.remove(message_id)
 
-    def get_trust(self, user_id: str):
-        return self.trust_data.get(user_id, 100)
+    async def _prune_message_index(self):
+        while True:
+            await asyncio.sleep(600)
+            self.message_index.prune()
 
-    async def update_trust(self, member: discord.Member, amount: int, reason: str, interaction: discord.Interaction):
+    async def close(self):
+        # Flush pending trust writes before the connection goes away
+        await self.trust.close()
+        await self.audit.close()
+        if self.state is not None:
+            await self.state.close()
+        await metrics.stop()
+        await super().close()
+
+    async def get_trust(self, guild_id: int, user_id: str):
+        return await self.trust.get(guild_id, user_id)
+
+    async def update_trust(self, member: discord.Member, amount: int, reason: str, interaction: discord.Interaction = None,
+                           *, channel=None, moderator=None):
+        # Automated callers (automod, spam filter) pass channel/moderator instead of an interaction
+        guild = member.guild
+        channel = channel or (interaction.channel if interaction else None)
+        moderator = moderator or (interaction.user if interaction else None)
         user_id = str(member.id)
-        current_score = self.get_trust(user_id)
+        current_score = await self.get_trust(guild.id, user_id)
         new_score = max(0, min(100, current_score + amount))
-        self.trust_data[user_id] = new_score
-        self.save_trust_data()
+        await self.trust.set(guild.id, user_id, new_score, reason=reason, moderator_id=moderator.id if moderator else None)
 
         if new_score <= 0:
             try:
                 # Try to DM before banning
-                try:
-                    await member.send(f"⚠️ You have been automatically banned from **{interaction.guild.name}** because your trust score reached 0.\n**Last Action:** {reason}")
-                except:
-                    pass
-                await member.ban(reason=f"Trust score reached 0. Last action: {reason}")
-                await interaction.channel.send(f"🚨 {member.mention} has been automatically banned for reaching 0 trust score.")
+                await self.mod_dms.before_action(member, "autoban", f"⚠️ You have been automatically banned from **{guild.name}** because your trust score reached 0.\n**Last Action:** {reason}")
+                await rest.call(f"bans:{guild.id}", member.ban, reason=f"Trust score reached 0. Last action: {reason}")
+                self.audit.record(guild.id, "autoban", member.id, self.user.id, f"Trust score reached 0. Last action: {reason}")
+                if channel:
+                    await rest.call(f"messages:{channel.id}", channel.send, f"🚨 {member.mention} has been automatically banned for reaching 0 trust score.")
             except discord.Forbidden:
-                await interaction.channel.send(f"⚠️ Failed to auto-ban {member.mention} (missing permissions).")
+                if channel:
+                    await rest.call(f"messages:{channel.id}", channel.send, f"⚠️ Failed to auto-ban {member.mention} (missing permissions).")
         
         return new_score
 
     async def get_invite(self, guild):
-        for channel in guild.text_channels:
-            if channel.permissions_for(guild.me).create_instant_invite:
-                return await channel.create_invite(max_age=3600, max_uses=1)
-        return None
+        """A rejoin invite for softbans, from the guild's invite pool. None if no channel allows invites."""
+        try:
+            # Single-use by default: the pool still creates the next link ahead of time, but never shares one
+            return await self.invites.get(guild, max_age=SOFTBAN_INVITE_AGE, min_remaining=SOFTBAN_INVITE_MIN_REMAINING,
+                                          uses=SOFTBAN_INVITE_USES, reason="Softban rejoin link")
+        except discord.HTTPException:
+            return None
+
+    # The invite pool caches which channel it can create invites in, and the invites themselves
+    async def on_guild_channel_delete(self, channel):
+        self.invites.drop_channel(channel.guild.id, channel.id)
+
+    async def on_guild_channel_update(self, before, after):
+        if before.overwrites != after.overwrites or before.category_id != after.category_id:
+            self.invites.drop_channel(after.guild.id, after.id)
+
+    async def on_guild_channel_create(self, channel):
+        self.invites.forget_channel_choice(channel.guild.id)
+
+    async def on_guild_role_update(self, before, after):
+        if before.permissions != after.permissions:
+            self.invites.forget_channel_choice(after.guild.id)
+
+    async def on_guild_role_delete(self, role):
+        self.invites.forget_channel_choice(role.guild.id)
+
+    async def on_member_update(self, before, after):
+        if after.id == self.user.id and before.roles != after.roles:
+            self.invites.forget_channel_choice(after.guild.id)
+
+    async def on_invite_delete(self, invite):
+        self.invites.drop_invite(invite.code)
+
+    async def on_guild_remove(self, guild):
+        self.invites.drop_guild(guild.id)
 
 bot = MyBot()
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user.name} ({bot.user.id})')
+    if not bot.startup.reported and bot._gateway_started is not None:
+        bot.startup.phases.append(("gateway ready", time.perf_counter() - bot._gateway_started))
+        bot.startup.reported = True
+        print(bot.startup.report())
     print('------')
 
+# --- Bulk Action Helpers ---
+
+def parse_ids(id_str):
+    """Pulls numeric IDs out of free text (mentions, commas, spaces), de-duplicated in order."""
+    if not id_str:
+        return []
+    return list(dict.fromkeys(re.findall(r'\d+', id_str)))
+
+class IdReader:
+    """Collects Discord IDs from typed text and uploaded .txt/.csv/.json files.
+
+    Files are streamed in ID_FILE_CHUNK pieces and never held whole: each piece
+    is scanned for digit runs, and a run cut off at the end of a piece is carried
+    into the next. Only digit runs matter, so plain lists, CSV columns, mentions
+    and JSON strings or numbers all work. A run counts if it is a plausible
+    snowflake (17-20 digits, not minted in the future), and a set drops repeats
+    across everything fed to the same reader.
+    """
+
+    DIGITS = re.compile(rb'\d+')
+
+    def __init__(self):
+        self.seen = set()
+        self.bytes = 0
+        self.found = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.files = []
+        self._carry = b""
+        self._started = self._finished = time.perf_counter()
+
+    @staticmethod
+    def file_problem(attachment: discord.Attachment):
+        """Why `attachment` can't be read as an ID list, or None."""
+        if not attachment.filename.lower().endswith(ID_FILE_EXTENSIONS):
+            return f"`{attachment.filename}` is not a .txt, .csv or .json file."
+        if attachment.size > ID_FILE_MAX_BYTES:
+            return f"`{attachment.filename}` is {attachment.size / 1048576:.1f} MB; the limit is {ID_FILE_MAX_BYTES // 1048576} MB."
+        return None
+
+    def feed(self, data: bytes):
+        """Parses the next piece of a stream. Returns the new unique IDs in it."""
+        data = self._carry + data
+        head = data.rstrip(b"0123456789")
+        # Anything past 20 digits is already too long to be a snowflake, so the carry stays small
+        self._carry = data[len(head):][-21:]
+        return self._take(self.DIGITS.findall(head))
+
+    def flush(self):
+        """Ends the current stream, returning the new unique IDs in its last run."""
+        runs, self._carry = [self._carry] if self._carry else [], b""
+        self._finished = time.perf_counter()
+        return self._take(runs)
+
+    def feed_text(self, text: str):
+        """Parses a whole string (a command option). Returns the new unique IDs in it."""
+        if not text:
+            return []
+        return self.feed(text.encode()) + self.flush()
+
+    def _take(self, runs):
+        newest = ((int(time.time() * 1000) + 60_000 - discord.utils.DISCORD_EPOCH) << 22) | 0x3FFFFF
+        new = []
+        for run in runs:
+            self.found += 1
+            if not 17 <= len(run) <= 20 or int(run) > newest:
+                self.invalid += 1
+                continue
+            user_id = int(run)
+            if user_id in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(user_id)
+            new.append(user_id)
+        return new
+
+    async def stream(self, attachment: discord.Attachment):
+        """Yields the new unique IDs of `attachment` piece by piece as it downloads."""
+        self.files.append(attachment.filename)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(attachment.url) as response:
+                response.raise_for_status()
+                async for piece in response.content.iter_chunked(ID_FILE_CHUNK):
+                    self.bytes += len(piece)
+                    if self.bytes > ID_FILE_MAX_BYTES:
+                        raise ValueError(f"{attachment.filename} is larger than {ID_FILE_MAX_BYTES // 1048576} MB")
+                    new = self.feed(piece)
+                    if new:
+                        yield new
+        new = self.flush()
+        if new:
+            yield new
+
+    async def read(self, attachment: discord.Attachment):
+        """Streams `attachment` and returns its new unique IDs as one list."""
+        ids = []
+        async for batch in self.stream(attachment):
+            ids.extend(batch)
+        return ids
+
+    def describe(self):
+        elapsed = max(self._finished - self._started, 1e-6)
+        source = f"{', '.join(self.files)} ({self.bytes / 1048576:.1f} MB)" if self.files else "input"
+        return (
+            f"📄 {len(self.seen):,} unique IDs from {source} in {elapsed:.1f}s ({len(self.seen) / elapsed:,.0f} IDs/s): "
+            f"{self.duplicates:,} duplicates and {self.invalid:,} invalid entries skipped."
+        )
+
+async def run_bounded(items, worker, concurrency):
+    """Runs `worker(item)` for every item with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await worker(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+class ProgressMessage:
+    """A followup message that is edited in place with throttled progress updates."""
+
+    def __init__(self, interaction: discord.Interaction, interval: float = PROGRESS_EDIT_INTERVAL):
+        self.interaction = interaction
+        self.interval = interval
+        self.message = None
+        self._last_edit = 0.0
+
+    async def start(self, content: str):
+        self.message = await self.interaction.followup.send(content, wait=True)
+        self._last_edit = time.monotonic()
+
+    async def update(self, content: str, force: bool = False):
+        now = time.monotonic()
+        if self.message is None or (not force and now - self._last_edit < self.interval):
+            return
+        self._last_edit = now
+        try:
+            await self.message.edit(content=content)
+        except discord.HTTPException:
+            pass
+
+    async def finish(self, content: str, report: str = None, filename: str = "report.txt"):
+        """Posts the final summary, attaching `report` as a file when it won't fit in a message."""
+        if report and len(content) + len(report) + 1 <= 2000:
+            content, report = f"{content}\n{report}", None
+        attachments = [discord.File(io.BytesIO(report.encode()), filename=filename)] if report else []
+        if self.message is None:
+            await self.interaction.followup.send(content, files=attachments)
+            return
+        try:
+            await self.message.edit(content=content, attachments=attachments)
+        except discord.HTTPException:
+            await self.interaction.followup.send(content, files=attachments)
+
+async def ban_many(guild: discord.Guild, user_ids, reason: str, on_progress=None):
+    """Bans user IDs without fetching users first. Returns (banned_ids, failed_ids)."""
+    async def one_batch():
+        yield user_ids
+
+    return await ban_stream(guild, one_batch(), reason, on_progress)
+
+async def ban_stream(guild: discord.Guild, batches, reason: str, on_progress=None):
+    """Bans user IDs arriving as an async iterator of batches, e.g. while a file downloads.
+
+    IDs go through the bulk-ban endpoint in chunks of BULK_BAN_CHUNK, sent as
+    soon as each chunk fills. Reading more IDs waits while BULK_BAN_CONCURRENCY
+    chunks are in flight. If bulk ban is unavailable (missing Manage Server, or
+    the endpoint rejects a chunk), that chunk falls back to concurrent single
+    bans. Returns (banned_ids, failed_ids).
+    """
+    banned, failed = [], []
+    received = 0
+    use_bulk = True
+    slots = asyncio.Semaphore(BULK_BAN_CONCURRENCY)
+    tasks = []
+
+    async def report():
+        if on_progress:
+            await on_progress(len(banned), len(failed), received)
+
+    async def ban_one(uid):
+        try:
+            await rest.call(f"bans:{guild.id}", guild.ban, discord.Object(id=uid), reason=reason)
+            banned.append(uid)
+        except discord.HTTPException:
+            failed.append(uid)
+        await report()
+
+    async def ban_chunk(chunk):
+        nonlocal use_bulk
+        try:
+            if use_bulk:
+                try:
+                    result = await rest.call(f"bans:{guild.id}", guild.bulk_ban, [discord.Object(id=uid) for uid in chunk], reason=reason)
+                    banned.extend(obj.id for obj in result.banned)
+                    failed.extend(obj.id for obj in result.failed)
+                    await report()
+                    return
+                except discord.Forbidden:
+                    use_bulk = False
+                except discord.HTTPException:
+                    # Discord fails the whole request when no user in it could be banned
+                    pass
+            await run_bounded(chunk, ban_one, MASSBAN_CONCURRENCY)
+        finally:
+            slots.release()
+
+    async def submit(chunk):
+        await slots.acquire()
+        tasks.append(asyncio.create_task(ban_chunk(chunk)))
+
+    pending = []
+    try:
+        async for batch in batches:
+            received += len(batch)
+            pending.extend(int(uid) for uid in batch)
+            while len(pending) >= BULK_BAN_CHUNK:
+                await submit(pending[:BULK_BAN_CHUNK])
+                del pending[:BULK_BAN_CHUNK]
+        if pending:
+            await submit(pending)
+    finally:
+        await asyncio.gather(*tasks)
+    return banned, failed
+
 # --- Moderation Slash Commands ---
 
 @bot.tree.command(name="purge", description="Deletes a specified number of messages")
 @app_commands.checks.has_permissions(manage_messages=True)
 async def purge(interaction: discord.Interaction, amount: int):
     await interaction.response.defer(ephemeral=True)
-    deleted = await interaction.channel.purge(limit=amount)
-    await interaction.followup.send(f"Deleted {len(deleted)} messages.", ephemeral=True)
+    # Page history first, then schedule each delete batch on its own so the purge never holds a slot while reading
+    message_ids = [message.id async for message in interaction.channel.history(limit=amount)]
+    deleted = await bot.cleanup.delete_ids(interaction.channel, message_ids, reason="Purge") if message_ids else 0
+    await interaction.followup.send(f"Deleted {deleted} messages.", ephemeral=True)
 
 @bot.tree.command(name="kick", description="Kicks a member and reduces trust score")
 @app_commands.checks.has_permissions(kick_members=True)
 async def kick(interaction: discord.Interaction, member: discord.Member, reason: Optional[str] = "No reason provided"):
     await interaction.response.defer()
-    try:
-        await member.send(f"👢 You have been kicked from **{interaction.guild.name}**.\n**Reason:** {reason}")
-    except:
-        pass
-    await member.kick(reason=reason)
+    notified = await bot.mod_dms.before_action(member, "kick", f"👢 You have been kicked from **{interaction.guild.name}**.\n**Reason:** {reason}")
+    await rest.call(f"members:{interaction.guild.id}", member.kick, reason=reason)
+    bot.audit.record(interaction.guild.id, "kick", member.id, interaction.user.id, reason)
     new_score = await bot.update_trust(member, -30, f"Kicked: {reason}", interaction)
-    await interaction.followup.send(f"Kicked {member.mention}. Trust score reduced by 30 (Now: {new_score}). Reason: {reason}")
+    await interaction.followup.send(f"Kicked {member.mention}. Trust score reduced by 30 (Now: {new_score}). Reason: {reason}" + ("" if notified else " (DM not delivered)"))
 
 @bot.tree.command(name="ban", description="Bans a member")
 @app_commands.checks.has_permissions(ban_members=True)
 async def ban(interaction: discord.Interaction, member: discord.Member, reason: Optional[str] = "No reason provided"):
     await interaction.response.defer()
-    try:
-        await member.send(f"🔨 You have been permanently banned from **{interaction.guild.name}**.\n**Reason:** {reason}")
-    except:
-        pass
-    await member.ban(reason=reason)
+    notified = await bot.mod_dms.before_action(member, "ban", f"🔨 You have been permanently banned from **{interaction.guild.name}**.\n**Reason:** {reason}")
+    await rest.call(f"bans:{interaction.guild.id}", member.ban, reason=reason)
+    bot.audit.record(interaction.guild.id, "ban", member.id, interaction.user.id, reason)
     await bot.update_trust(member, -100, f"Manual Ban: {reason}", interaction)
-    await interaction.followup.send(f"Banned {member.mention}. Reason: {reason}")
+    await interaction.followup.send(f"Banned {member.mention}. Reason: {reason}" + ("" if notified else " (DM not delivered)"))
 
 @bot.tree.command(name="timeout", description="Times out a member and reduces trust score")
 @app_commands.checks.has_permissions(moderate_members=True)
 async def timeout(interaction: discord.Interaction, member: discord.Member, minutes: int, reason: Optional[str] = "No reason provided"):
     await interaction.response.defer()
-    duration = datetime.timedelta(minutes=minutes)
-    try:
-        await member.send(f"⏳ You have been timed out in **{interaction.guild.name}** for {minutes} minutes.\n**Reason:** {reason}")
-    except:
-        pass
-    await member.timeout(duration, reason=reason)
-    # Deduct 5 trust per 10 minutes, max 50
-    deduction = min(50, (minutes // 10) * 5 + 5)
-    new_score = await bot.update_trust(member, -deduction, f"Timeout ({minutes}m): {reason}", interaction)
+    deduction, new_score = await bot.timeout_member(member, minutes, reason, interaction)
     await interaction.followup.send(f"Timed out {member.mention} for {minutes} minutes. Trust reduced by {deduction} (Now: {new_score}). Reason: {reason}")
 
 @bot.tree.command(name="warn", description="Warns a member and reduces trust score")
 @app_commands.checks.has_permissions(manage_messages=True)
 async def warn(interaction: discord.Interaction, member: discord.Member, reason: str):
     await interaction.response.defer()
-    try:
-        await member.send(f"⚠️ You have been warned in **{interaction.guild.name}**.\n**Reason:** {reason}")
-    except:
-        pass
+    bot.mod_dms.send(member, "warn", f"⚠️ You have been warned in **{interaction.guild.name}**.\n**Reason:** {reason}")
+    bot.audit.record(interaction.guild.id, "warn", member.id, interaction.user.id, reason)
     new_score = await bot.update_trust(member, -10, f"Warned: {reason}", interaction)
     await interaction.followup.send(f"⚠️ {member.mention} has been warned. Trust reduced by 10 (Now: {new_score}). Reason: {reason}")
 
@@ -219,14 +3363,14 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
 @app_commands.checks.has_permissions(manage_channels=True)
 async def lock(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    await interaction.channel.set_permissions(interaction.guild.default_role, send_messages=False)
+    await rest.call(f"channel:{interaction.channel.id}", interaction.channel.set_permissions, interaction.guild.default_role, send_messages=False)
     await interaction.followup.send("🔒 Channel locked.")
 
 @bot.tree.command(name="unlock", description="Unlocks the current channel")
 @app_commands.checks.has_permissions(manage_channels=True)
 async def unlock(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    await interaction.channel.set_permissions(interaction.guild.default_role, send_messages=True)
+    await rest.call(f"channel:{interaction.channel.id}", interaction.channel.set_permissions, interaction.guild.default_role, send_messages=True)
     await interaction.followup.send("🔓 Channel unlocked.")
 
 @bot.tree.command(name="softban", description="Bans and immediately unbans to clear messages")
@@ -235,12 +3379,10 @@ async def softban(interaction: discord.Interaction, member: discord.Member, reas
     await interaction.response.defer()
     invite = await bot.get_invite(interaction.guild)
     invite_msg = f"\n**Join back here:** {invite.url}" if invite else ""
-    try:
-        await member.send(f"💨 You have been softbanned from **{interaction.guild.name}** to clear your message history.\n**Reason:** {reason}{invite_msg}")
-    except:
-        pass
-    await member.ban(reason=reason, delete_message_days=7)
-    await interaction.guild.unban(member)
+    await bot.mod_dms.before_action(member, "softban", f"💨 You have been softbanned from **{interaction.guild.name}** to clear your message history.\n**Reason:** {reason}{invite_msg}")
+    await rest.call(f"bans:{interaction.guild.id}", member.ban, reason=reason, delete_message_days=7)
+    await rest.call(f"bans:{interaction.guild.id}", interaction.guild.unban, member)
+    bot.audit.record(interaction.guild.id, "softban", member.id, interaction.user.id, reason)
     new_score = await bot.update_trust(member, -50, f"Softban: {reason}", interaction)
     await interaction.followup.send(f"💨 Softbanned {member.mention}. Messages cleared, trust reduced by 50 (Now: {new_score}).")
 
@@ -249,8 +3391,8 @@ async def softban(interaction: discord.Interaction, member: discord.Member, reas
 async def unban(interaction: discord.Interaction, user_id: str):
     await interaction.response.defer()
     try:
-        user = await bot.fetch_user(int(user_id))
-        await interaction.guild.unban(user)
+        user = await bot.users_cache.get(int(user_id))
+        await rest.call(f"bans:{interaction.guild.id}", interaction.guild.unban, user)
         await interaction.followup.send(f"✅ Unbanned {user.name} ({user_id}).")
     except Exception as e:
         await interaction.followup.send(f"❌ Failed to unban: {e}")
@@ -259,35 +3401,71 @@ async def unban(interaction: discord.Interaction, user_id: str):
 @app_commands.checks.has_permissions(manage_guild=True)
 async def clear_trust(interaction: discord.Interaction, member: discord.Member):
     await interaction.response.defer()
-    bot.trust_data[str(member.id)] = 100
-    bot.save_trust_data()
+    await bot.trust.clear(interaction.guild.id, str(member.id), reason="Trust cleared", moderator_id=interaction.user.id)
     await interaction.followup.send(f"♻️ Reset {member.mention}'s trust score to **100**.")
 
-@bot.tree.command(name="massban", description="Bans multiple users by IDs or mentions")
+@bot.tree.command(name="massban", description="Bans multiple users by IDs or mentions, typed or in a file")
 @app_commands.checks.has_permissions(ban_members=True)
-async def massban(interaction: discord.Interaction, user_ids: str, reason: Optional[str] = "Mass ban"):
+@app_commands.describe(
+    user_ids="User IDs or mentions separated by spaces or commas",
+    user_file="A .txt, .csv or .json file of User IDs, for lists too long to type"
+)
+async def massban(interaction: discord.Interaction, user_ids: Optional[str] = None, reason: Optional[str] = "Mass ban",
+                  user_file: Optional[discord.Attachment] = None):
+    problem = IdReader.file_problem(user_file) if user_file else None
+    if problem:
+        await interaction.response.send_message(f"❌ {problem}", ephemeral=True)
+        return
     await interaction.response.defer()
-    # Split by space, comma, or mention format
-    ids = re.findall(r'\d+', user_ids)
-    banned = []
-    failed = []
-    
-    for uid in ids:
-        try:
-            user = await bot.fetch_user(int(uid))
-            await interaction.guild.ban(user, reason=reason)
-            banned.append(user.name)
-        except:
-            failed.append(uid)
-            
-    await interaction.followup.send(f"✅ Banned: {', '.join(banned) if banned else 'None'}\n❌ Failed IDs: {', '.join(failed) if failed else 'None'}")
+    # Typed IDs go first; a file's IDs are banned while it is still downloading
+    reader = IdReader()
+    typed = reader.feed_text(user_ids)
+    if not typed and not user_file:
+        await interaction.followup.send("❌ No valid User IDs found in your input.")
+        return
+
+    async def batches():
+        if typed:
+            yield typed
+        if user_file:
+            async for batch in reader.stream(user_file):
+                yield batch
+
+    started = time.monotonic()
+    progress = ProgressMessage(interaction)
+    await progress.start(f"🔨 Banning {len(typed)} users..." if not user_file else f"🔨 Reading `{user_file.filename}` and banning...")
+
+    async def on_progress(done, errors, total):
+        await progress.update(f"🔨 Banning... {done + errors}/{total} (✅ {done} ❌ {errors})")
+
+    try:
+        with rest.lane("bulk"):
+            banned, failed = await ban_stream(interaction.guild, batches(), reason, on_progress)
+    except (aiohttp.ClientError, ValueError) as e:
+        # Bans already sent stand; report how far the file got
+        await progress.finish(f"❌ Stopped reading `{user_file.filename}`: {e}\n{reader.describe()}")
+        return
+    if not banned and not failed:
+        await progress.finish(f"❌ No valid User IDs found in your input.\n{reader.describe()}")
+        return
+    for user_id in banned:
+        bot.audit.record(interaction.guild.id, "massban", user_id, interaction.user.id, reason)
+    elapsed = time.monotonic() - started
+    summary = f"🔨 **Mass Ban Complete** in {elapsed:.1f}s: ✅ {len(banned)} banned, ❌ {len(failed)} failed."
+    if user_file:
+        summary += f"\n{reader.describe()}"
+    report = (
+        f"✅ Banned: {', '.join(map(str, banned)) if banned else 'None'}\n"
+        f"❌ Failed IDs: {', '.join(map(str, failed)) if failed else 'None'}"
+    )
+    await progress.finish(summary, report, filename="massban_report.txt")
 
 @bot.tree.command(name="vmute", description="Mutes a member in voice channels")
 @app_commands.checks.has_permissions(mute_members=True)
 async def vmute(interaction: discord.Interaction, member: discord.Member, reason: Optional[str] = "Voice mute"):
     await interaction.response.defer()
     if member.voice:
-        await member.edit(mute=True, reason=reason)
+        await rest.call(f"members:{interaction.guild.id}", member.edit, mute=True, reason=reason)
         await interaction.followup.send(f"🔇 Voice muted {member.mention}.")
     else:
         await interaction.followup.send(f"❌ {member.mention} is not in a voice channel.")
@@ -297,7 +3475,7 @@ async def vmute(interaction: discord.Interaction, member: discord.Member, reason
 async def vunmute(interaction: discord.Interaction, member: discord.Member):
     await interaction.response.defer()
     if member.voice:
-        await member.edit(mute=False)
+        await rest.call(f"members:{interaction.guild.id}", member.edit, mute=False)
         await interaction.followup.send(f"🔊 Voice unmuted {member.mention}.")
     else:
         await interaction.followup.send(f"❌ {member.mention} is not in a voice channel.")
@@ -307,7 +3485,7 @@ async def vunmute(interaction: discord.Interaction, member: discord.Member):
 async def nickname(interaction: discord.Interaction, member: discord.Member, nick: Optional[str] = None):
     await interaction.response.defer()
     try:
-        await member.edit(nick=nick)
+        await rest.call(f"members:{interaction.guild.id}", member.edit, nick=nick)
         await interaction.followup.send(f"✅ Changed {member.mention}'s nickname to `{nick if nick else 'Default'}`.")
     except:
         await interaction.followup.send(f"❌ Failed to change nickname for {member.mention} (missing permissions).")
@@ -317,7 +3495,7 @@ async def nickname(interaction: discord.Interaction, member: discord.Member, nic
 async def roleadd(interaction: discord.Interaction, member: discord.Member, role: discord.Role):
     await interaction.response.defer()
     try:
-        await member.add_roles(role)
+        await rest.call(f"members:{interaction.guild.id}", member.add_roles, role)
         await interaction.followup.send(f"✅ Added role {role.name} to {member.mention}.")
     except:
         await interaction.followup.send(f"❌ Failed to add role (check hierarchy/permissions).")
@@ -327,7 +3505,7 @@ async def roleadd(interaction: discord.Interaction, member: discord.Member, role
 async def roleremove(interaction: discord.Interaction, member: discord.Member, role: discord.Role):
     await interaction.response.defer()
     try:
-        await member.remove_roles(role)
+        await rest.call(f"members:{interaction.guild.id}", member.remove_roles, role)
         await interaction.followup.send(f"✅ Removed role {role.name} from {member.mention}.")
     except:
         await interaction.followup.send(f"❌ Failed to remove role (check hierarchy/permissions).")
@@ -336,7 +3514,7 @@ async def roleremove(interaction: discord.Interaction, member: discord.Member, r
 @app_commands.checks.has_permissions(manage_channels=True)
 async def slowmode(interaction: discord.Interaction, seconds: int):
     await interaction.response.defer()
-    await interaction.channel.edit(slowmode_delay=seconds)
+    await rest.call(f"channel:{interaction.channel.id}", interaction.channel.edit, slowmode_delay=seconds)
     await interaction.followup.send(f"⏲️ Slowmode set to {seconds} seconds.")
 
 @bot.tree.command(name="serverinfo", description="Shows detailed information about the server")
@@ -356,14 +3534,41 @@ async def serverinfo(interaction: discord.Interaction):
 async def ping(interaction: discord.Interaction):
     await interaction.response.send_message(f"🏓 Pong! Latency: {round(bot.latency * 1000)}ms")
 
+@bot.tree.command(name="botstats", description="Shows internal bot counters (Admin)")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def botstats(interaction: discord.Interaction):
+    embed = discord.Embed(title="📈 Bot Stats", color=discord.Color.dark_grey())
+    trust_stats = "\n".join(f"{key}: `{value}`" for key, value in bot.trust.stats().items())
+    embed.add_field(name="Trust Store", value=trust_stats, inline=False)
+    raid_stats = (
+        f"active here: `{bot.raid_detector.is_active(interaction.guild.id)}`\n"
+        f"enforced: `{bot.raid_enforcer.enforced}`\nfailed: `{bot.raid_enforcer.failed}`\npending: `{bot.raid_enforcer.pending()}`"
+    )
+    embed.add_field(name="Anti-Raid", value=raid_stats, inline=False)
+    cache_stats = "\n".join(f"{key}: `{value}`" for key, value in bot.users_cache.stats().items())
+    embed.add_field(name="User Lookup Cache", value=cache_stats, inline=False)
+    lane_stats = "\n".join(
+        f"{lane}: `{stats['calls']}` calls, `{stats['queued']}` queued (max `{stats['max_queued']}`), "
+        f"wait avg `{stats['avg_wait_ms']}ms` max `{stats['max_wait_ms']}ms`, `{stats['errors']}` errors"
+        for lane, stats in rest.stats().items()
+    )
+    embed.add_field(name="REST Lanes", value=lane_stats, inline=False)
+    dm_stats = "\n".join(f"{key}: `{value}`" for key, value in bot.mod_dms.stats().items())
+    embed.add_field(name="Moderation DMs", value=dm_stats, inline=False)
+    invite_stats = "\n".join(f"{key}: `{value}`" for key, value in bot.invites.stats().items())
+    embed.add_field(name="Invite Pool", value=invite_stats, inline=False)
+    audit_stats = "\n".join(f"{key}: `{value}`" for key, value in bot.audit.stats().items())
+    embed.add_field(name="Audit Log", value=audit_stats, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="poll", description="Creates a simple yes/no poll")
 async def poll(interaction: discord.Interaction, question: str):
     embed = discord.Embed(title="📊 Poll", description=question, color=discord.Color.purple())
     embed.set_footer(text=f"Asked by {interaction.user.name}")
     await interaction.response.send_message(embed=embed)
     message = await interaction.original_response()
-    await message.add_reaction("✅")
-    await message.add_reaction("❌")
+    await rest.call(f"messages:{message.channel.id}", message.add_reaction, "✅")
+    await rest.call(f"messages:{message.channel.id}", message.add_reaction, "❌")
 
 @bot.tree.command(name="8ball", description="Ask the magic 8-ball a question")
 async def eightball(interaction: discord.Interaction, question: str):
@@ -384,80 +3589,211 @@ async def hug(interaction: discord.Interaction, member: discord.Member):
 @bot.tree.command(name="antiraid", description="Toggles anti-raid mode (auto-kicks new joins)")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def antiraid_toggle(interaction: discord.Interaction, enabled: bool):
-    bot.antiraid = enabled
+    bot.raid_detector.set_manual(interaction.guild.id, enabled)
     status = "ENABLED 🛡️" if enabled else "DISABLED 🔓"
-    await interaction.response.send_message(f"Anti-Raid Mode is now **{status}**.")
+    note = ""
+    if bot.state is not None:
+        try:
+            await bot.state.request("antiraid", guild_id=interaction.guild.id, enabled=enabled)
+        except (ConnectionError, asyncio.TimeoutError, StateServiceError):
+            note = "\n⚠️ The cluster state service is unreachable, so this is not saved across restarts."
+    await interaction.response.send_message(f"Anti-Raid Mode is now **{status}**.{note}")
+
+@bot.tree.command(name="automodadd", description="Adds an automod keyword or regex rule")
+@app_commands.checks.has_permissions(manage_guild=True)
+@app_commands.describe(
+    kind="keyword (case-insensitive substring) or regex",
+    pattern="The keyword or regular expression to match",
+    action="delete removes the message; flag only changes trust",
+    delta=f"Trust change when the rule is broken (default {AUTOMOD_DEFAULT_DELTA})"
+)
+@app_commands.choices(
+    kind=[app_commands.Choice(name="keyword", value="keyword"), app_commands.Choice(name="regex", value="regex")],
+    action=[app_commands.Choice(name=action, value=action) for action in AutomodEngine.ACTIONS]
+)
+async def automod_add(interaction: discord.Interaction, kind: str, pattern: str, action: str = "delete", delta: int = AUTOMOD_DEFAULT_DELTA):
+    if delta > 0 or delta < -100:
+        await interaction.response.send_message("Trust change must be between -100 and 0.", ephemeral=True)
+        return
+    try:
+        rule = await bot.automod.add_rule(interaction.guild.id, kind, pattern, action, delta)
+    except re.error as e:
+        await interaction.response.send_message(f"❌ Invalid regex: {e}", ephemeral=True)
+        return
+    await interaction.response.send_message(f"✅ Added automod rule **#{rule['id']}** ({kind} `{pattern}`, {action}, trust {delta}).", ephemeral=True)
+
+@bot.tree.command(name="automodremove", description="Removes an automod rule")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def automod_remove(interaction: discord.Interaction, rule_id: int):
+    if await bot.automod.remove_rule(interaction.guild.id, rule_id):
+        await interaction.response.send_message(f"🗑️ Removed automod rule **#{rule_id}**.", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"❌ No automod rule #{rule_id}.", ephemeral=True)
+
+@bot.tree.command(name="automodlist", description="Lists this server's automod rules")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def automod_list(interaction: discord.Interaction):
+    rules = bot.automod.rules_for(interaction.guild.id)
+    if not rules:
+        await interaction.response.send_message("No automod rules set up.", ephemeral=True)
+        return
+    lines = [f"**#{rule['id']}** {rule['kind']} `{rule['pattern']}` → {rule['action']}, trust {rule['delta']}" for rule in rules]
+    content = "\n".join(lines)
+    if len(content) > 1900:
+        await interaction.response.send_message(f"{len(rules)} rules:", file=discord.File(io.BytesIO(content.encode()), filename="automod_rules.txt"), ephemeral=True)
+    else:
+        await interaction.response.send_message(content, ephemeral=True)
 
 @bot.tree.command(name="lockdown", description="Locks all text channels in the server")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def lockdown(interaction: discord.Interaction):
     await interaction.response.defer()
-    locked_channels = []
-    for channel in interaction.guild.text_channels:
-        overwrite = channel.overwrites_for(interaction.guild.default_role)
-        if overwrite.send_messages != False:
-            overwrite.send_messages = False
-            await channel.set_permissions(interaction.guild.default_role, overwrite=overwrite, reason="Server Lockdown")
-            locked_channels.append(channel.name)
-    
-    await interaction.followup.send(f"🚨 **Server Lockdown Active**. Locked {len(locked_channels)} channels.")
+    started = time.monotonic()
+    progress = ProgressMessage(interaction)
+    await progress.start("🚨 Locking channels...")
+
+    async def on_progress(done, errors, total):
+        await progress.update(f"🚨 Locking channels... {done + errors}/{total}")
+
+    with rest.lane("bulk"):
+        locked, failed = await bot.lockdown.lock(interaction.guild, on_progress)
+    summary = f"🚨 **Server Lockdown Active**. Locked {len(locked)} channels in {time.monotonic() - started:.1f}s."
+    report = f"❌ Failed: {', '.join(channel.mention for channel in failed)}" if failed else None
+    await progress.finish(summary, report, filename="lockdown_failures.txt")
 
 @bot.tree.command(name="unlockdown", description="Unlocks all text channels in the server")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def unlockdown(interaction: discord.Interaction):
     await interaction.response.defer()
-    unlocked_channels = []
-    for channel in interaction.guild.text_channels:
-        overwrite = channel.overwrites_for(interaction.guild.default_role)
-        if overwrite.send_messages == False:
-            overwrite.send_messages = None # Reset to default/neutral
-            await channel.set_permissions(interaction.guild.default_role, overwrite=overwrite, reason="Server Lockdown Lifted")
-            unlocked_channels.append(channel.name)
-    
-    await interaction.followup.send(f"🔓 **Server Lockdown Lifted**. Unlocked {len(unlocked_channels)} channels.")
+    if not bot.lockdown.is_locked(interaction.guild.id):
+        await interaction.followup.send("ℹ️ No lockdown is recorded for this server, so there is nothing to restore.")
+        return
+    started = time.monotonic()
+    progress = ProgressMessage(interaction)
+    await progress.start("🔓 Restoring channels...")
+
+    async def on_progress(done, errors, total):
+        await progress.update(f"🔓 Restoring channels... {done + errors}/{total}")
+
+    with rest.lane("bulk"):
+        restored, failed = await bot.lockdown.unlock(interaction.guild, on_progress)
+    summary = f"🔓 **Server Lockdown Lifted**. Restored {len(restored)} channels in {time.monotonic() - started:.1f}s."
+    report = f"❌ Failed (run /unlockdown again to retry): {', '.join(channel.mention for channel in failed)}" if failed else None
+    await progress.finish(summary, report, filename="unlockdown_failures.txt")
 
 @bot.tree.command(name="cleanuser", description="Purges all messages from a specific user across all channels")
 @app_commands.checks.has_permissions(manage_messages=True)
-async def cleanuser(interaction: discord.Interaction, member: discord.Member, limit: Optional[int] = 100):
+@app_commands.describe(
+    limit="Messages to scan per channel when scanning history",
+    scan="Scan channel history even when recent messages are indexed",
+    full_history="Also scan before the member's latest join, for members who left and rejoined"
+)
+async def cleanuser(interaction: discord.Interaction, member: discord.Member, limit: Optional[int] = 100, scan: bool = False, full_history: bool = False):
     await interaction.response.defer()
+    started = time.monotonic()
+    progress = ProgressMessage(interaction)
+    await progress.start(f"🧹 Cleaning up messages from {member.mention}...")
+    lines = []
     total_deleted = 0
-    
-    for channel in interaction.guild.text_channels:
-        try:
-            deleted = await channel.purge(limit=limit, check=lambda m: m.author == member)
-            total_deleted += len(deleted)
-        except:
-            continue
-            
-    await interaction.followup.send(f"🧹 Cleaned up **{total_deleted}** messages from {member.mention} across the server.")
+
+    def describe(result):
+        status = f"⚠️ {result['error']}" if result["error"] else f"{result['deleted']} deleted / {result['scanned']} scanned"
+        return f"#{result['channel'].name}: {status} ({result['elapsed']:.1f}s)"
+
+    async def on_channel_done(result, done, total):
+        nonlocal total_deleted
+        total_deleted += result["deleted"]
+        if result["scanned"] or result["error"]:
+            lines.append(describe(result))
+        await progress.update(f"🧹 Cleaning {member.mention}... {done}/{total} channels, {total_deleted} deleted\n" + "\n".join(lines[-5:]))
+
+    # Scans stop just before the member joined unless they may have posted during an earlier stay
+    since = None if full_history or member.joined_at is None else member.joined_at - CLEAN_JOIN_MARGIN
+    # The index only replaces the scan when it saw everything the member posted since joining
+    indexed = (bot.message_index is not None and not scan and not full_history
+               and bot.message_index.covers(interaction.guild.id, member.id, member.joined_at))
+    with rest.lane("bulk"):
+        if indexed:
+            results = await bot.cleanup.clean_indexed(interaction.guild, member, bot.message_index, on_channel_done)
+        else:
+            results = await bot.cleanup.clean(interaction.guild, member, limit, on_channel_done, since)
+    errors = sum(1 for result in results if result["error"])
+    summary = (
+        f"🧹 Cleaned up **{total_deleted}** messages from {member.mention} across {len(results)} channels "
+        f"in {time.monotonic() - started:.1f}s." + (f" ({errors} channels failed)" if errors else "")
+    )
+    if indexed:
+        summary += "\nℹ️ Found through the message index only (everything since they joined); use `scan: True` to also search channel history."
+    elif since is not None:
+        summary += f"\nℹ️ Only messages since they joined ({discord.utils.format_dt(member.joined_at, 'R')}) were scanned; use `full_history: True` if they rejoined."
+    report = "\n".join(describe(result) for result in sorted(results, key=lambda r: -r["deleted"]) if result["scanned"] or result["error"])
+    await progress.finish(summary, report or None, filename="cleanuser_report.txt")
 
 @bot.tree.command(name="banrole", description="Bans everyone who has a specific role (Server Owner only)")
 @app_commands.checks.has_permissions(administrator=True) # Secondary check
 @app_commands.default_permissions(administrator=True) # This hides the command from non-admins in the UI
-async def banrole(interaction: discord.Interaction, role: discord.Role, reason: Optional[str] = "Mass role ban"):
+@app_commands.describe(
+    exclude_ids="Optional: User IDs to spare (separated by spaces or commas)",
+    exclude_file="Optional: a .txt, .csv or .json file of User IDs to spare"
+)
+async def banrole(interaction: discord.Interaction, role: discord.Role, reason: Optional[str] = "Mass role ban",
+                  exclude_ids: Optional[str] = None, exclude_file: Optional[discord.Attachment] = None):
     # Strict Server Owner check
     if interaction.user.id != interaction.guild.owner_id:
         await interaction.response.send_message("❌ This command can only be used by the **Server Owner**.", ephemeral=True)
         return
+    problem = IdReader.file_problem(exclude_file) if exclude_file else None
+    if problem:
+        await interaction.response.send_message(f"❌ {problem}", ephemeral=True)
+        return
 
     await interaction.response.defer()
-    
-    count = 0
-    failed = 0
-    
-    # We need to fetch members if they aren't cached
-    async for member in interaction.guild.fetch_members(limit=None):
-        if role in member.roles:
-            try:
-                if member.top_role < interaction.guild.me.top_role:
-                    await member.ban(reason=reason)
-                    count += 1
-                else:
-                    failed += 1
-            except:
-                failed += 1
-                
-    await interaction.followup.send(f"🔨 Banned **{count}** members with the role `{role.name}`. (Failed: {failed})")
+    guild = interaction.guild
+    started = time.monotonic()
+    progress = ProgressMessage(interaction)
+    await progress.start(f"🔨 Collecting members with `{role.name}`...")
+
+    exclusions = IdReader()
+    exclusions.feed_text(exclude_ids)
+    if exclude_file:
+        try:
+            await exclusions.read(exclude_file)
+        except (aiohttp.ClientError, ValueError) as e:
+            # Banning without the full exclusion list could hit someone meant to be spared
+            await progress.finish(f"❌ Could not read `{exclude_file.filename}`: {e}. Nobody was banned.")
+            return
+
+    # role.members reads the member cache; only go to the network when it is incomplete
+    if not guild.chunked:
+        try:
+            await guild.chunk()
+            members = role.members
+        except (discord.HTTPException, discord.ClientException, asyncio.TimeoutError):
+            members = [member async for member in guild.fetch_members(limit=None) if role in member.roles]
+    else:
+        members = role.members
+
+    # Hierarchy check in one pass; these would fail at the API anyway
+    my_top_role = guild.me.top_role
+    spared = sum(1 for member in members if member.id in exclusions.seen)
+    targets = [member.id for member in members if member.top_role < my_top_role and member.id != guild.owner_id and member.id not in exclusions.seen]
+    skipped = len(members) - len(targets) - spared
+
+    async def on_progress(done, errors, total):
+        await progress.update(f"🔨 Banning members with `{role.name}`... {done + errors}/{total} (✅ {done} ❌ {errors})")
+
+    with rest.lane("bulk"):
+        banned, failed = await ban_many(guild, targets, reason, on_progress) if targets else ([], [])
+    for user_id in banned:
+        bot.audit.record(guild.id, "banrole", user_id, interaction.user.id, reason, role_id=role.id)
+    summary = (
+        f"🔨 Banned **{len(banned)}** members with the role `{role.name}` in {time.monotonic() - started:.1f}s. "
+        f"(Failed: {len(failed) + skipped}, of which {skipped} outrank the bot)"
+    )
+    if exclude_ids or exclude_file:
+        summary += f"\n🛡️ Spared {spared} excluded members. {exclusions.describe()}"
+    report = f"❌ Failed IDs: {', '.join(map(str, failed))}" if failed else None
+    await progress.finish(summary, report, filename="banrole_failures.txt")
 
 class InviteView(discord.ui.View):
     def __init__(self, user_id: int):
@@ -466,10 +3802,12 @@ class InviteView(discord.ui.View):
 
     @discord.ui.button(label="Stop receiving invites from this bot", style=discord.ButtonStyle.danger)
     async def block_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id_str = str(self.user_id)
-        if user_id_str not in bot.blocked_users:
-            bot.blocked_users.append(user_id_str)
-            bot.save_blocked_users()
+        try:
+            added = await bot.blocked_users.add(self.user_id)
+        except (ConnectionError, asyncio.TimeoutError, StateServiceError):
+            await interaction.response.send_message("⚠️ Could not save that right now. Please try again in a minute.", ephemeral=True)
+            return
+        if added:
             await interaction.response.send_message("✅ You have successfully blocked all future invites from this bot. You can leave the server now.", ephemeral=True)
             # Disable the button
             button.disabled = True
@@ -479,26 +3817,25 @@ class InviteView(discord.ui.View):
 
 @bot.tree.command(name="inviteuser", description="Sends a server invite to a user via DM (Bot Owner only)")
 async def inviteuser(interaction: discord.Interaction, user_id: str):
-    # Bot Owner Check (Using application info)
-    app_info = await bot.application_info()
-    if interaction.user.id != app_info.owner.id:
+    # Bot Owner Check (owner is cached at startup)
+    if not await bot.is_owner(interaction.user):
         await interaction.response.send_message("❌ This command is restricted to the **Bot Owner**.", ephemeral=True)
         return
 
     try:
-        user = await bot.fetch_user(int(user_id))
+        user = await bot.users_cache.get(int(user_id))
     except (ValueError, discord.NotFound):
         await interaction.response.send_message("❌ User not found. Please provide a valid User ID.", ephemeral=True)
         return
 
     # Check if user is blocked
-    if str(user.id) in bot.blocked_users:
+    if user.id in bot.blocked_users:
         await interaction.response.send_message(f"❌ Cannot send invite. **{user.name}** has blocked invites from this bot.", ephemeral=True)
         return
 
-    # Create a 24h invite link for the current channel
+    # A pooled invite link for the current channel, created only when the pool has none left
     try:
-        invite = await interaction.channel.create_invite(max_age=86400, max_uses=1, unique=True, reason=f"Invited by {interaction.user}")
+        invite = await bot.invites.get(interaction.guild, interaction.channel, max_age=INVITE_DM_AGE, min_remaining=INVITE_DM_MIN_REMAINING, reason=f"Invited by {interaction.user}")
     except discord.Forbidden:
         await interaction.response.send_message("❌ I don't have permission to create invites in this channel.", ephemeral=True)
         return
@@ -507,9 +3844,10 @@ async def inviteuser(interaction: discord.Interaction, user_id: str):
     view = InviteView(user.id)
 
     try:
-        await user.send(
+        await rest.call(
+            "dm", user.send,
             f"👋 Hello! **{interaction.user.name}** has invited you to join **{interaction.guild.name}**!\n\n"
-            f"Here is your invite link (expires in 24h):\n{invite.url}\n\n"
+            f"Here is your invite link (valid for at least {INVITE_DM_MIN_REMAINING // 3600}h):\n{invite.url}\n\n"
             f"*If you don't want to receive these messages anymore, click the button below to block this feature.*",
             view=view
         )
@@ -522,75 +3860,76 @@ async def inviteuser(interaction: discord.Interaction, user_id: str):
 @bot.tree.command(name="massinvite", description="Invites multiple users by ID (Bot Owner only)")
 @app_commands.describe(
     user_ids="A list of User IDs separated by spaces or commas",
-    exclude_ids="Optional: User IDs to skip (separated by spaces or commas)"
+    exclude_ids="Optional: User IDs to skip (separated by spaces or commas)",
+    user_file="A .txt, .csv or .json file of User IDs, for lists too long to type",
+    exclude_file="Optional: a .txt, .csv or .json file of User IDs to skip"
 )
-async def massinvite(interaction: discord.Interaction, user_ids: str, exclude_ids: Optional[str] = None):
+async def massinvite(interaction: discord.Interaction, user_ids: Optional[str] = None, exclude_ids: Optional[str] = None,
+                     user_file: Optional[discord.Attachment] = None, exclude_file: Optional[discord.Attachment] = None):
     # Bot Owner Check
-    app_info = await bot.application_info()
-    if interaction.user.id != app_info.owner.id:
+    if not await bot.is_owner(interaction.user):
         await interaction.response.send_message("❌ This command is restricted to the **Bot Owner**.", ephemeral=True)
         return
+    for attachment in (user_file, exclude_file):
+        problem = IdReader.file_problem(attachment) if attachment else None
+        if problem:
+            await interaction.response.send_message(f"❌ {problem}", ephemeral=True)
+            return
 
     await interaction.response.defer(ephemeral=True)
 
-    # Parse IDs
-    def parse_ids(id_str):
-        if not id_str: return []
-        return re.findall(r'\d+', id_str)
-
-    target_ids = parse_ids(user_ids)
-    excluded = set(parse_ids(exclude_ids)) if exclude_ids else set()
+    # The DM job checkpoints its whole target list, so files are read in full up front
+    reader, exclusions = IdReader(), IdReader()
+    try:
+        target_ids = reader.feed_text(user_ids) + (await reader.read(user_file) if user_file else [])
+        exclusions.feed_text(exclude_ids)
+        if exclude_file:
+            await exclusions.read(exclude_file)
+    except (aiohttp.ClientError, ValueError) as e:
+        await interaction.followup.send(f"❌ Could not read the attached file: {e}")
+        return
     
     if not target_ids:
         await interaction.followup.send("❌ No valid User IDs found in your input.")
         return
 
-    success = 0
-    skipped = 0
-    failed = 0
-    blocked_count = 0
+    # Drop excluded and blocked IDs in one pass instead of checking each ID
+    excluded = exclusions.seen
+    skipped = reader.seen & excluded
+    blocked = bot.blocked_users.contains_many(reader.seen - excluded)
+    remaining = reader.seen - skipped - blocked
+    targets = [str(uid) for uid in target_ids if uid in remaining]
 
-    # Create one invite for the batch
+    # One unlimited-use invite for the batch, reused by later runs while it stays fresh
     try:
-        invite = await interaction.channel.create_invite(max_age=86400, max_uses=0, unique=True, reason=f"Mass invite by {interaction.user}")
+        invite = await bot.invites.get(interaction.guild, interaction.channel, max_age=INVITE_DM_AGE, min_remaining=INVITE_DM_MIN_REMAINING, uses=0, reason=f"Mass invite by {interaction.user}")
     except discord.Forbidden:
         await interaction.followup.send("❌ I don't have permission to create invites in this channel.")
         return
 
-    for uid in target_ids:
-        # Skip if in exclude list
-        if uid in excluded:
-            skipped += 1
-            continue
-            
-        # Skip if blocked the bot
-        if uid in bot.blocked_users:
-            blocked_count += 1
-            continue
+    message = (
+        f"👋 Hello! **{interaction.user.name}** has invited you to join **{interaction.guild.name}**!\n\n"
+        f"Here is your invite link:\n{invite.url}\n\n"
+        f"*If you don't want to receive these messages anymore, click the button below to block this feature.*"
+    )
+    job = bot.dm_dispatcher.create_job(targets, message, interaction.user.id, excluded=len(skipped), blocked=len(blocked))
 
-        try:
-            user = await bot.fetch_user(int(uid))
-            view = InviteView(user.id)
-            await user.send(
-                f"👋 Hello! **{interaction.user.name}** has invited you to join **{interaction.guild.name}**!\n\n"
-                f"Here is your invite link:\n{invite.url}\n\n"
-                f"*If you don't want to receive these messages anymore, click the button below to block this feature.*",
-                view=view
-            )
-            success += 1
-        except discord.Forbidden:
-            failed += 1
-        except Exception:
-            failed += 1
+    progress = ProgressMessage(interaction)
+    await progress.start(f"📨 Sending {len(targets)} invites...")
 
-    report = (
-        f"📊 **Mass Invite Report**\n"
-        f"✅ Sent: {success}\n"
-        f"🚫 Failed (DMs off/Blocked): {failed}\n"
-        f"🛑 Already Blocked Bot: {blocked_count}\n"
-        f"⏭️ Skipped (Excluded): {skipped}"
-    )
-    await interaction.followup.send(report)
+    async def on_progress(job):
+        counters = job["counters"]
+        await progress.update(f"📨 Sending invites... {counters['sent'] + counters['failed']}/{len(targets)} (✅ {counters['sent']} 🚫 {counters['failed']})")
+
+    await bot.dm_dispatcher.run(job, on_progress)
+    report = format_dm_report(job)
+    if user_file or exclude_file:
+        report += f"\n{reader.describe()}"
+    try:
+        await progress.finish(report)
+    except discord.HTTPException:
+        # The interaction token expired during a long run
+        await bot.dm_dispatcher.notify_requester(job, report)
 
 @bot.tree.command(name="nuke", description="Deletes and recreates a channel to clear all messages")
 @app_commands.checks.has_permissions(administrator=True)
@@ -603,15 +3942,18 @@ async def nuke(interaction: discord.Interaction):
         "overwrites": interaction.channel.overwrites,
         "topic": interaction.channel.topic
     }
-    new_channel = await interaction.guild.create_text_channel(
+    new_channel = await rest.call(
+        f"guild:{interaction.guild.id}", interaction.guild.create_text_channel,
         name=channel_info["name"],
         category=channel_info["category"],
         overwrites=channel_info["overwrites"],
         position=channel_info["position"],
         topic=channel_info["topic"]
     )
-    await interaction.channel.delete()
-    await new_channel.send("☢️ Channel Nuked!")
+    await rest.call(f"channel:{interaction.channel.id}", interaction.channel.delete)
+    bot.audit.record(interaction.guild.id, "nuke", None, interaction.user.id, None,
+                     channel=channel_info["name"], old_channel_id=interaction.channel.id, channel_id=new_channel.id)
+    await rest.call(f"messages:{new_channel.id}", new_channel.send, "☢️ Channel Nuked!")
 
 # --- Fun Slash Commands ---
 
@@ -631,7 +3973,7 @@ async def userinfo(interaction: discord.Interaction, member: Optional[discord.Me
     embed.set_thumbnail(url=target.display_avatar.url)
     embed.add_field(name="Name", value=target.name, inline=True)
     embed.add_field(name="ID", value=target.id, inline=True)
-    embed.add_field(name="Trust Score", value=f"{bot.get_trust(str(target.id))}/100", inline=True)
+    embed.add_field(name="Trust Score", value=f"{await bot.get_trust(interaction.guild.id, str(target.id))}/100", inline=True)
     embed.add_field(name="Joined Discord", value=discord.utils.format_dt(target.created_at), inline=False)
     embed.add_field(name="Joined Server", value=discord.utils.format_dt(target.joined_at) if target.joined_at else "Unknown", inline=False)
     embed.add_field(name="Roles", value=" ".join(roles) if roles else "None", inline=False)
@@ -665,30 +4007,42 @@ async def help_command(interaction: discord.Interaction):
         "**/purge <amount>** - Delete multiple messages\n"
         "**/kick <@user> [reason]** - Kick member (-30 trust)\n"
         "**/ban <@user> [reason]** - Ban member (-100 trust)\n"
-        "**/banrole <@role>** - Ban everyone with a role (Server Owner only)\n"
-        "**/massban <ids/mentions>** - Ban multiple users\n"
+        "**/banrole <@role> [exclude/file]** - Ban everyone with a role (Server Owner only)\n"
+        "**/massban <ids/mentions or file>** - Ban multiple users (.txt/.csv/.json upload for long lists)\n"
         "**/unban <user_id>** - Unban a user\n"
         "**/timeout <@user> <mins> [reason]** - Mute member\n"
         "**/warn <@user> <reason>** - Warn member (-10 trust)\n"
         "**/softban <@user> [reason]** - Ban/Unban (-50 trust)\n"
         "**/vmute / /vunmute** - Voice mute/unmute\n"
         "**/nickname <@user> [nick]** - Change nickname\n"
-        "**/roleadd / /roleremove** - Manage user roles\n"
+        "**/roleadd / /roleremove** - Manage user roles"
+    )
+    embed.add_field(name="🛡️ Moderation", value=mod_cmds, inline=False)
+
+    # Embed fields hold at most 1024 characters, so server tools get their own
+    server_cmds = (
         "**/lock / /unlock** - Lock/Unlock channel\n"
         "**/lockdown / /unlockdown** - Server-wide lockdown\n"
-        "**/antiraid <on/off>** - Auto-kick new joins\n"
+        "**/antiraid <on/off>** - Auto-kick new joins (also switches on by itself during raids)\n"
         "**/cleanuser <@user>** - Purge user from all channels\n"
+        "**/automodadd / /automodremove / /automodlist** - Manage automod rules\n"
+        "**/dmlog [@user]** - Whether moderation DMs were delivered\n"
+        "**/modlog [@user] [days]** - Recent moderation actions, for the server or one user\n"
         "**/slowmode <secs>** - Set channel slowmode\n"
         "**/inviteuser <user_id>** - Invite a user via DM (Bot Owner only)\n"
-        "**/massinvite <ids> [exclude]** - Mass invite users (Bot Owner only)\n"
+        "**/massinvite <ids or file> [exclude/file]** - Mass invite users (Bot Owner only)\n"
         "**/nuke** - Recreate channel"
     )
-    embed.add_field(name="🛡️ Moderation", value=mod_cmds, inline=False)
+    embed.add_field(name="🧰 Server Tools", value=server_cmds, inline=False)
     
     trust_cmds = (
         "**/trust [@user]** - Check trust score\n"
         "**/settrust <@user> <score>** - Set trust score (Admin)\n"
-        "**/cleartrust <@user>** - Reset trust to 100 (Admin)"
+        "**/cleartrust <@user>** - Reset trust to 100 (Admin)\n"
+        "**/trusthistory <@user>** - Recent trust changes (Admin)\n"
+        "**/trustdrops [threshold] [days]** - Who dropped below a score (Admin)\n"
+        "**/trustboard [page]** - Lowest trust scores (Admin)\n"
+        "**/truststats** - Score distribution and percentiles (Admin)"
     )
     embed.add_field(name="⚖️ Trust System", value=trust_cmds, inline=False)
     
@@ -696,6 +4050,7 @@ async def help_command(interaction: discord.Interaction):
         "**/serverinfo** - Detailed server statistics\n"
         "**/userinfo [@user]** - Detailed user data\n"
         "**/ping** - Check bot latency\n"
+        "**/botstats** - Internal bot counters (Admin)\n"
         "**/poll <question>** - Create a simple poll\n"
         "**/avatar [@user]** - View user avatar"
     )
@@ -718,7 +4073,7 @@ async def help_command(interaction: discord.Interaction):
 @bot.tree.command(name="trust", description="Check a user's trust score")
 async def trust_check(interaction: discord.Interaction, member: Optional[discord.Member] = None):
     target = member or interaction.user
-    score = bot.get_trust(str(target.id))
+    score = await bot.get_trust(interaction.guild.id, str(target.id))
     
     color = discord.Color.green() if score > 70 else discord.Color.orange() if score > 30 else discord.Color.red()
     
@@ -737,15 +4092,162 @@ async def set_trust(interaction: discord.Interaction, member: discord.Member, sc
         await interaction.response.send_message("Score must be between 0 and 100.", ephemeral=True)
         return
         
-    old_score = bot.get_trust(str(member.id))
-    bot.trust_data[str(member.id)] = score
-    bot.save_trust_data()
+    old_score = await bot.get_trust(interaction.guild.id, str(member.id))
+    await bot.trust.set(interaction.guild.id, str(member.id), score, reason="Trust set by moderator", moderator_id=interaction.user.id)
     
     await interaction.response.send_message(f"Updated {member.mention}'s trust score from {old_score} to **{score}**.")
     
     if score <= 0:
-        await member.ban(reason="Trust score set to 0 by admin.")
-        await interaction.channel.send(f"🚨 {member.mention} has been automatically banned (Score set to 0).")
+        await rest.call(f"bans:{interaction.guild.id}", member.ban, reason="Trust score set to 0 by admin.")
+        await rest.call(f"messages:{interaction.channel.id}", interaction.channel.send, f"🚨 {member.mention} has been automatically banned (Score set to 0).")
+
+@bot.tree.command(name="trusthistory", description="Moderator only: Show why a user's trust score changed")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def trust_history(interaction: discord.Interaction, member: discord.Member):
+    if not bot.trust.backend.supports_history:
+        await interaction.response.send_message("❌ Trust history needs the SQLite backend (`TRUST_BACKEND=sqlite`).", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    rows = await bot.trust.history(interaction.guild.id, str(member.id), limit=10)
+    if not rows:
+        await interaction.followup.send(f"No trust history recorded for {member.mention}.")
+        return
+    lines = []
+    for guild_id, delta, score, reason, moderator_id, created_at in rows:
+        when = discord.utils.format_dt(datetime.datetime.fromtimestamp(created_at, tz=datetime.timezone.utc), 'R')
+        by = f" by <@{moderator_id}>" if moderator_id else ""
+        lines.append(f"{when} **{delta:+d}** → {score}{by}: {reason or 'No reason'}")
+    embed = discord.Embed(title=f"Trust History: {member.display_name}", description="\n".join(lines), color=discord.Color.blue())
+    await interaction.followup.send(embed=embed)
+
+@bot.tree.command(name="trustdrops", description="Moderator only: Users who dropped below a trust score recently")
+@app_commands.checks.has_permissions(manage_guild=True)
+@app_commands.describe(threshold="Score to check against (default 30)", days="How many days back to look (default 7)")
+async def trust_drops(interaction: discord.Interaction, threshold: int = 30, days: int = 7):
+    if not bot.trust.backend.supports_history:
+        await interaction.response.send_message("❌ Trust history needs the SQLite backend (`TRUST_BACKEND=sqlite`).", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    since = time.time() - days * 86400
+    rows = await bot.trust.dropped_below(interaction.guild.id, threshold, since)
+    if not rows:
+        await interaction.followup.send(f"Nobody dropped below {threshold} in the last {days} days.")
+        return
+    lines = [f"<@{user_id}> (lowest: {lowest}) {discord.utils.format_dt(datetime.datetime.fromtimestamp(last, tz=datetime.timezone.utc), 'R')}" for user_id, lowest, last in rows]
+    embed = discord.Embed(title=f"Dropped below {threshold} in the last {days} days", description="\n".join(lines), color=discord.Color.orange())
+    await interaction.followup.send(embed=embed)
+
+class TrustBoardView(discord.ui.View):
+    """Prev/Next pages over a guild's lowest trust scores, read live from the score index."""
+
+    def __init__(self, guild_id: int, author_id: int, page_size: int = TRUSTBOARD_PAGE_SIZE):
+        super().__init__(timeout=300)
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.page_size = page_size
+        self.page = 0
+
+    async def render(self):
+        index = await bot.trust.index(self.guild_id)
+        pages = max(1, math.ceil(index.total / self.page_size))
+        self.page = min(self.page, pages - 1)
+        start = self.page * self.page_size
+        rows = index.lowest(start, self.page_size)
+        lines = [f"`{start + i + 1:>4}.` <@{user_id}> — **{score}**" for i, (user_id, score) in enumerate(rows)]
+        embed = discord.Embed(title="📉 Lowest Trust Scores", description="\n".join(lines) or "No trust scores recorded yet.", color=discord.Color.orange())
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} • {index.total} scored members (everyone else is at 100)")
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ Only the moderator who opened this board can page through it.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+@bot.tree.command(name="trustboard", description="Moderator only: Members with the lowest trust scores")
+@app_commands.checks.has_permissions(manage_guild=True)
+@app_commands.describe(page="Page to start on (default 1)")
+async def trust_board(interaction: discord.Interaction, page: int = 1):
+    view = TrustBoardView(interaction.guild.id, interaction.user.id)
+    view.page = max(0, page - 1)
+    await interaction.response.send_message(embed=await view.render(), view=view, ephemeral=True)
+
+@bot.tree.command(name="truststats", description="Moderator only: Trust score distribution for this server")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def trust_stats(interaction: discord.Interaction):
+    index = await bot.trust.index(interaction.guild.id)
+    if not index.total:
+        await interaction.response.send_message("No trust scores recorded yet; everyone is at 100.", ephemeral=True)
+        return
+    bands = index.histogram()
+    widest = max(bands)
+    bars = "\n".join(
+        f"`{i * 10:>3}-{100 if i == len(bands) - 1 else i * 10 + 9:<3}` {'█' * round(12 * count / widest) if count else ''} {count}"
+        for i, count in enumerate(bands)
+    )
+    embed = discord.Embed(title="⚖️ Trust Distribution", color=discord.Color.blue())
+    embed.add_field(name="Scored members", value=str(index.total), inline=True)
+    embed.add_field(name="Mean", value=f"{index.mean:.1f}", inline=True)
+    embed.add_field(name="Median", value=str(index.percentile(50)), inline=True)
+    embed.add_field(name="Percentiles", value=" • ".join(f"p{p}: **{index.percentile(p)}**" for p in (10, 25, 75, 90)), inline=False)
+    embed.add_field(name="Below 30 / 50", value=f"{index.count_below(30)} / {index.count_below(50)}", inline=False)
+    embed.add_field(name="Histogram", value=bars, inline=False)
+    embed.set_footer(text="Members without a recorded score are at 100 and not counted here.")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="dmlog", description="Moderator only: Whether moderation DMs reached their recipients")
+@app_commands.checks.has_permissions(moderate_members=True)
+async def dm_log(interaction: discord.Interaction, member: Optional[discord.User] = None):
+    entries = bot.mod_dms.history(interaction.guild.id, member.id if member else None)
+    if not entries:
+        await interaction.response.send_message("No moderation DMs recorded since the bot started.", ephemeral=True)
+        return
+    icons = {"sent": "✅", "late": "🕓", "closed": "🚫", "failed": "❌"}
+    lines = [
+        f"{icons[entry['outcome']]} {discord.utils.format_dt(datetime.datetime.fromtimestamp(entry['time'], tz=datetime.timezone.utc), 'R')} "
+        f"<@{entry['user_id']}> {entry['kind']}: {entry['outcome']} ({entry['elapsed']:.1f}s, {entry['attempts']} tries)"
+        for entry in entries
+    ]
+    embed = discord.Embed(title="Moderation DM Log", description="\n".join(lines), color=discord.Color.blue())
+    embed.set_footer(text="🕓 late = delivered after the kick/ban went ahead; 🚫 closed = DMs off or no shared server")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="modlog", description="Moderator only: Recent moderation actions in this server or against a user")
+@app_commands.checks.has_permissions(moderate_members=True)
+@app_commands.describe(member="Only actions against this user", days="Only the last this many days")
+async def mod_log(interaction: discord.Interaction, member: Optional[discord.User] = None, days: Optional[app_commands.Range[int, 1, 3650]] = None):
+    await interaction.response.defer(ephemeral=True)
+    since = time.time() - days * 86400 if days else 0.0
+    entries = await bot.audit.query(interaction.guild.id, member.id if member else None, limit=MODLOG_LIMIT, since=since)
+    if not entries:
+        await interaction.followup.send("No moderation actions recorded.", ephemeral=True)
+        return
+    icons = {"kick": "👢", "ban": "🔨", "massban": "🔨", "banrole": "🔨", "autoban": "🚨", "softban": "💨", "timeout": "⏳", "warn": "⚠️", "nuke": "☢️"}
+
+    def describe(entry):
+        when = discord.utils.format_dt(datetime.datetime.fromtimestamp(entry["time"], tz=datetime.timezone.utc), 'R')
+        target = f"<#{entry['channel_id']}>" if entry["action"] == "nuke" else f"<@{entry['user_id']}>"
+        extra = f" ({entry['minutes']}m)" if "minutes" in entry else ""
+        moderator = f" by <@{entry['moderator_id']}>" if entry["moderator_id"] else ""
+        reason = f": {entry['reason'][:100]}" if entry["reason"] else ""
+        return f"{icons.get(entry['action'], '•')} {when} **{entry['action']}**{extra} {target}{moderator}{reason}"
+
+    title = f"Moderation Log: {member}" if member else "Moderation Log"
+    embed = discord.Embed(title=title, description="\n".join(describe(entry) for entry in entries)[:4096], color=discord.Color.blue())
+    embed.set_footer(text=f"Newest {len(entries)} actions" + (f" from the last {days} days" if days else ""))
+    await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.event
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
@@ -756,5 +4258,6 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
         if not interaction.response.is_done():
             await interaction.response.send_message(f"An error occurred: {error}", ephemeral=True)
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    bot.run(TOKEN)
 
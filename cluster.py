@@ -0,0 +1,234 @@
+"""Runs ModBot as several shard worker processes on one machine.
+
+The launcher starts the cluster state service (blocked users, anti-raid switches
+and worker health; see "Cluster State" in bot.py) on a Unix socket in the data
+directory, then runs one worker process per shard. Crashed workers are restarted
+with backoff, and a per-shard health and latency table is printed every
+--report-interval seconds.
+
+Usage:
+  python cluster.py --shards 4             # run 4 shards against Discord (token.txt)
+  python cluster.py --shards 2 --offline   # run against a local fake Discord, no network needed
+  python cluster.py status                 # print the running cluster's health table
+
+Discord sends each guild's events to shard (guild_id >> 22) % shard_count, so
+per-guild state stays in the worker that owns the guild. Workers share trust.db
+(SQLite WAL), while lockdown snapshots and automod rules are merged per shard
+on write.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+
+import bot as modbot
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CLUSTER_SOCKET_NAME = 'cluster.sock'
+WORKER_RESTART_MAX_DELAY = 60.0 # Seconds between restarts of a worker that keeps crashing
+WORKER_STABLE_SECONDS = 60.0 # A worker that ran this long before exiting restarts without delay
+WORKER_STOP_TIMEOUT = 30.0 # Seconds a worker gets to flush and close before it is killed
+OFFLINE_MEMBERS = 50 # Members in each offline worker's fake guild
+
+SOCKET_PATH = os.getenv('MODBOT_STATE_SOCKET', os.path.join(modbot.DATA_DIR, CLUSTER_SOCKET_NAME))
+
+def format_status(status, restarts=None, interval=modbot.CLUSTER_HEARTBEAT_INTERVAL):
+    """Renders the state service's status (plus the launcher's restart counts) as a table."""
+    restarts = restarts or {}
+    now = time.time()
+    header = f"{'shard':>5} {'pid':>7} {'state':<10} {'guilds':>6} {'latency':>9} {'loop lag':>9} {'commands':>8} {'429s':>5} {'trust q':>7} {'restarts':>8} {'uptime':>7}"
+    lines = [header]
+    latencies = []
+    for shard_id, stats in status["shards"].items():
+        if now - stats["received"] > 3 * interval:
+            state = "stale"
+        elif stats["ready"]:
+            state = "ready"
+        else:
+            state = "connecting" if stats["mode"] == "gateway" else stats["mode"]
+        if stats["latency_ms"] is not None:
+            latencies.append(stats["latency_ms"])
+        latency = f"{stats['latency_ms']:.1f}ms" if stats["latency_ms"] is not None else "-"
+        lines.append(
+            f"{shard_id:>5} {stats['pid']:>7} {state:<10} {stats['guilds']:>6} {latency:>9} {stats['loop_lag_max_ms']:>7.1f}ms "
+            f"{stats['commands']:>8} {stats['rate_limited']:>5} {stats['trust_pending']:>7} {restarts.get(int(shard_id), 0):>8} {stats['uptime']:>6}s"
+        )
+    summary = f"{len(status['shards'])} shards, {status['workers']} connected, {sum(s['guilds'] for s in status['shards'].values())} guilds"
+    if latencies:
+        summary += f", latency avg {sum(latencies) / len(latencies):.1f}ms max {max(latencies):.1f}ms"
+    summary += f"; {status['blocked_users']} blocked users, {status['antiraid_guilds']} guilds in manual anti-raid"
+    lines.append(summary)
+    return "\n".join(lines)
+
+# --- Launcher ---
+
+class Worker:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+
+class Cluster:
+    def __init__(self, shard_count, offline=False, report_interval=30.0):
+        self.shard_count = shard_count
+        self.offline = offline
+        self.report_interval = report_interval
+        self.service = modbot.StateService(SOCKET_PATH, modbot.BlockRegistry(
+            modbot.BLOCK_SNAPSHOT_FILE, modbot.BLOCK_LOG_FILE, legacy_json_path=modbot.BLOCK_FILE
+        ))
+        self.workers = [Worker(shard_id) for shard_id in range(shard_count)]
+        self.stopping = asyncio.Event()
+
+    def worker_env(self, shard_id):
+        env = dict(os.environ, MODBOT_SHARD_ID=str(shard_id), MODBOT_SHARD_COUNT=str(self.shard_count), MODBOT_STATE_SOCKET=SOCKET_PATH)
+        if modbot.METRICS_PORT:
+            # One metrics endpoint per worker, on consecutive ports
+            env["METRICS_PORT"] = str(modbot.METRICS_PORT + shard_id)
+        if self.offline:
+            env["MODBOT_CLUSTER_OFFLINE"] = "1"
+        return env
+
+    async def supervise(self, worker: Worker):
+        delay = 1.0
+        while not self.stopping.is_set():
+            worker.started = time.monotonic()
+            # Own session, so Ctrl-C reaches only the launcher and workers get an orderly SIGTERM
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "worker",
+                env=self.worker_env(worker.shard_id), cwd=os.getcwd(), start_new_session=True
+            )
+            code = await worker.process.wait()
+            if self.stopping.is_set():
+                return
+            ran = time.monotonic() - worker.started
+            delay = 1.0 if ran >= WORKER_STABLE_SECONDS else min(delay * 2, WORKER_RESTART_MAX_DELAY)
+            worker.restarts += 1
+            print(f"Shard {worker.shard_id} exited with code {code} after {ran:.0f}s; restarting in {delay:.0f}s.")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(format_status(self.service.status(), {w.shard_id: w.restarts for w in self.workers}))
+
+    async def stop_workers(self):
+        running = [w.process for w in self.workers if w.process is not None and w.process.returncode is None]
+        for process in running:
+            process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in running)), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    process.kill()
+
+    async def run(self):
+        # Run the trust database migrations once, so workers never race on them at startup
+        backend = modbot.make_trust_backend()
+        if hasattr(backend, "open"):
+            backend.open()
+            backend.close()
+        await self.service.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        print(f"Cluster state service on {SOCKET_PATH}; starting {self.shard_count} shard workers{' (offline)' if self.offline else ''}.")
+        supervisors = [asyncio.create_task(self.supervise(worker)) for worker in self.workers]
+        reporter = asyncio.create_task(self.report())
+        await self.stopping.wait()
+        print("Stopping workers...")
+        reporter.cancel()
+        await self.stop_workers()
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await self.service.stop()
+        print("Cluster stopped.")
+
+# --- Worker ---
+
+def offline_guild_id(shard_id, shard_count):
+    """A guild ID that Discord would route to `shard_id`."""
+    guild_id = 600000000000000000
+    while (guild_id >> 22) % shard_count != shard_id:
+        guild_id += 1 << 22
+    return guild_id
+
+async def run_worker():
+    bot = modbot.bot
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    if os.getenv("MODBOT_CLUSTER_OFFLINE") == "1":
+        sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+        from fakediscord import FakeDiscord, FakeGateway, snowflake
+
+        server = FakeDiscord(latency=0.005)
+        await server.start()
+        server.patch_routes()
+        bot.state.mode = "offline"
+        await bot.login("offline-token")
+        guild_id = offline_guild_id(modbot.SHARD_ID, modbot.SHARD_COUNT)
+        FakeGateway(bot, server).create_guild(guild_id, [(snowflake(), []) for _ in range(OFFLINE_MEMBERS)])
+        print(f"Shard {modbot.SHARD_ID} running offline with guild {guild_id}.")
+        await stop.wait()
+        await bot.close()
+        await server.stop()
+        return 0
+
+    if modbot.TOKEN is None:
+        print("No token.txt found; run with --offline to try the cluster without Discord.")
+        return 2
+    await bot.login(modbot.TOKEN)
+    connection = asyncio.create_task(bot.connect())
+    stopping = asyncio.create_task(stop.wait())
+    await asyncio.wait({connection, stopping}, return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    await bot.close()
+    if connection.done() and not connection.cancelled() and connection.exception() is not None:
+        print(f"Shard {modbot.SHARD_ID} lost its gateway connection: {connection.exception()}")
+        return 1
+    return 0
+
+# --- Status ---
+
+async def print_status():
+    try:
+        reader, writer = await asyncio.open_unix_connection(SOCKET_PATH)
+    except OSError:
+        print(f"No cluster is running (nothing listening on {SOCKET_PATH}).")
+        return 1
+    writer.write(json.dumps({"id": 1, "op": "status"}).encode() + b"\n")
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    print(format_status(reply["result"]))
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", nargs="?", choices=("run", "status", "worker"), default="run", help="worker is used by the launcher itself")
+    parser.add_argument("--shards", type=int, default=2, help="Number of shards, one worker process each")
+    parser.add_argument("--offline", action="store_true", help="Run workers against benchmarks/fakediscord.py instead of Discord")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="Seconds between health tables")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        return asyncio.run(run_worker())
+    if args.command == "status":
+        return asyncio.run(print_status())
+    if not args.offline and modbot.TOKEN is None:
+        print("No token.txt found; run with --offline to try the cluster without Discord.")
+        return 2
+    asyncio.run(Cluster(args.shards, args.offline, args.report_interval).run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())